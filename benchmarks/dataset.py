@@ -0,0 +1,65 @@
+"""
+Synthetic dataset with the shape of the French one: about 6300 postal codes
+in 99 departments, scattered around the department centres.
+"""
+import random
+from typing import Dict, Iterator, Optional, Tuple
+
+from dj_codepostal_fr.hexasmal import import_records
+
+# overseas departments: (lon, lat) of their centre
+_OVERSEAS = {
+    "971": (-61.55, 16.25),
+    "972": (-61.02, 14.64),
+    "973": (-53.13, 3.93),
+    "974": (55.54, -21.12),
+    "976": (45.15, -12.82),
+}
+
+
+def generate(
+    seed: int = 0, departments: Optional[int] = None
+) -> Dict[str, Tuple[float, float]]:
+    """
+    (lon, lat) of each synthetic postal code. ``departments`` limits the
+    number of mainland departments, for quick runs.
+    """
+    rng = random.Random(seed)
+    locations = {}
+    # Corsica uses 20xxx codes
+    mainland = [f"{number:02d}" for number in range(1, 96)]
+    for department in mainland[:departments]:
+        lon, lat = rng.uniform(-4.5, 7.5), rng.uniform(42.5, 51.0)
+        for ending in sorted(rng.sample(range(100), 65)):
+            code = f"{department}{ending * 10:03d}"
+            locations[code] = (
+                round(lon + rng.uniform(-0.45, 0.45), 6),
+                round(lat + rng.uniform(-0.35, 0.35), 6),
+            )
+    for prefix, (lon, lat) in _OVERSEAS.items():
+        for ending in sorted(rng.sample(range(100), 30)):
+            locations[f"{prefix}{ending:02d}"] = (
+                round(lon + rng.uniform(-0.2, 0.2), 6),
+                round(lat + rng.uniform(-0.2, 0.2), 6),
+            )
+    return locations
+
+
+def _records(locations: Dict[str, Tuple[float, float]]) -> Iterator[dict]:
+    for code, (lon, lat) in locations.items():
+        yield {
+            "insee": code,
+            "name": f"COMMUNE {code}",
+            "postal_code": code,
+            "line_5": "",
+            "label": f"COMMUNE {code}",
+            "lon": lon,
+            "lat": lat,
+        }
+
+
+def load(locations: Dict[str, Tuple[float, float]]):
+    """
+    Stores the dataset like the ``import_hexasmal`` command does
+    """
+    import_records(_records(locations))
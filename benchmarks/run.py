@@ -0,0 +1,272 @@
+"""
+Benchmarks of the lookups, end-to-end, over a synthetic full-France dataset.
+
+Each lookup is measured with a hot cache, with a cold cache and the data in
+the DB, and with a cold cache and an API stub adding a fixed latency::
+
+    python -m benchmarks.run --output benchmarks.json
+    python -m benchmarks.run --compare benchmarks.json
+
+Results are written as JSON, to be compared between releases.
+"""
+import argparse
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class Case:
+    """
+    ``run(item)`` is timed for each item of the sample, after ``setup(item)``
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[Any], Any],
+        setup: Optional[Callable[[Any], None]] = None,
+        settings: Optional[Dict[str, Any]] = None,
+        warm: bool = False,
+    ):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.settings = settings or {}
+        self.warm = warm
+
+
+def _stats(durations: List[float]) -> Dict[str, float]:
+    durations = sorted(durations)
+    return {
+        "iterations": len(durations),
+        "min": durations[0],
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        "stdev": statistics.stdev(durations) if len(durations) > 1 else 0.0,
+    }
+
+
+def _cases(items: List[Dict[str, Any]]) -> List[Case]:
+    from django.core.cache import cache
+    from django.test import RequestFactory
+
+    from dj_codepostal_fr.models import CodePostalCompletions, CodePostalLocation
+    from dj_codepostal_fr.utils import (
+        complete_and_suggest,
+        postal_code_location,
+        postal_codes_completion,
+        postal_codes_nearby,
+    )
+    from dj_codepostal_fr.views import area_view
+
+    factory = RequestFactory()
+
+    def cold_cache(item):
+        cache.clear()
+
+    def cold_db(item):
+        # saved again by the lookups, after the API call
+        CodePostalCompletions.objects.filter(portion=item["term"][:3]).delete()
+        CodePostalLocation.objects.filter(
+            code__in=[item["code"], *item["selected"]]
+        ).delete()
+        cache.clear()
+
+    lookups = {
+        "completion": lambda item: postal_codes_completion(item["term"]),
+        "location": lambda item: postal_code_location(item["code"]),
+        "nearby": lambda item: postal_codes_nearby(10, postal_code=item["code"]),
+        "complete_and_suggest": lambda item: complete_and_suggest(
+            item["selected"], item["term"]
+        ),
+        "area_view": lambda item: area_view(
+            factory.get(
+                "/codepostal/nearby/",
+                {"postal_codes[]": item["selected"], "term": item["term"]},
+            )
+        ),
+    }
+    cases = []
+    for name, lookup in lookups.items():
+        cases.append(Case(f"{name}.hot", lookup, warm=True))
+        cases.append(
+            Case(
+                f"{name}.cold_db",
+                lookup,
+                setup=cold_cache,
+                # nearby codes from the precomputed table
+                settings={"CODEPOSTAL_NEIGHBORS": True},
+            )
+        )
+        cases.append(Case(f"{name}.cold_api", lookup, setup=cold_db))
+    # the range query on CodePostal answering completions from the DB
+    cases.append(
+        Case(
+            "completion.db_query",
+            lambda item: CodePostalCompletions.complete(item["term"]),
+        )
+    )
+    return cases
+
+
+def run_benchmarks(
+    iterations: int = 30,
+    latency: float = 0.02,
+    seed: int = 0,
+    departments: Optional[int] = None,
+    only: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Loads the synthetic dataset in the configured DB, then runs the cases.
+    Returns the results, by case name.
+    """
+    from django.core.cache import cache
+    from django.test import override_settings
+
+    from benchmarks.dataset import generate, load
+    from benchmarks.stub import StubServer
+    from dj_codepostal_fr import datanova
+    from dj_codepostal_fr.neighbors import build_neighbors
+
+    locations = generate(seed, departments)
+    load(locations)
+    build_neighbors()
+
+    rng = random.Random(seed)
+    codes = sorted(locations)
+    items = []
+    for code in rng.sample(codes, min(iterations, len(codes))):
+        items.append(
+            {
+                "code": code,
+                "term": code[:4],
+                "selected": [code, *rng.sample(codes, 2)],
+            }
+        )
+
+    stub = StubServer(locations, latency)
+    stub.start()
+    datanova.reset_session()
+    results = {}
+    try:
+        with override_settings(CODEPOSTAL_DATANOVA_URL=stub.url):
+            for case in _cases(items):
+                if only and only not in case.name:
+                    continue
+                with override_settings(**case.settings):
+                    cache.clear()
+                    if case.warm:
+                        for item in items:
+                            case.run(item)
+                    durations = []
+                    for item in items:
+                        if case.setup is not None:
+                            case.setup(item)
+                        start = time.perf_counter()
+                        case.run(item)
+                        durations.append(time.perf_counter() - start)
+                results[case.name] = _stats(durations)
+    finally:
+        stub.stop()
+        datanova.reset_session()
+
+    return {
+        "parameters": {
+            "iterations": len(items),
+            "latency": latency,
+            "seed": seed,
+            "postal_codes": len(locations),
+            "api_requests": stub.requests_count,
+        },
+        "results": results,
+    }
+
+
+def _environment() -> Dict[str, Any]:
+    import django
+
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+
+        package_version = version("dj-codepostal-fr")
+    except (ImportError, PackageNotFoundError):
+        package_version = None
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "version": package_version,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+    }
+
+
+def _print(results: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+    previous = (previous or {}).get("results", {})
+    for name, stats in results["results"].items():
+        line = "%-32s median %8.3f ms  p95 %8.3f ms" % (
+            name,
+            stats["median"] * 1000,
+            stats["p95"] * 1000,
+        )
+        if name in previous:
+            line += "  %+6.1f%%" % (
+                (stats["median"] / previous[name]["median"] - 1) * 100
+            )
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        help="fail when a median is slower than the compared one by this ratio",
+    )
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="of the API stub, in seconds"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="only run the cases containing this string")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    results = run_benchmarks(args.iterations, args.latency, args.seed, only=args.only)
+    results.update(_environment())
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    _print(results, previous)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if previous and args.max_regression:
+        for name, stats in results["results"].items():
+            before = previous["results"].get(name)
+            if before and stats["median"] > before["median"] * args.max_regression:
+                print("regression: %s" % name, file=sys.stderr)
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+SECRET_KEY = "benchmarks"
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    },
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+}
+
+INSTALLED_APPS = ("dj_codepostal_fr",)
+
+USE_TZ = True
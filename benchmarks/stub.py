@@ -0,0 +1,93 @@
+"""
+Stub of the datanova records endpoint, answering the queries of
+``dj_codepostal_fr.utils`` from the synthetic dataset after a fixed latency.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from dj_codepostal_fr.geo import haversine_km
+
+_search = re.compile(r"search\(code_postal,'(\d+)'\)")
+_code = re.compile(r"code_postal=(\d+)")
+_distance = re.compile(r'"coordinates":\[([-\d.e]+),([-\d.e]+)\]\}\',([\d.]+)km')
+
+
+class StubServer:
+    def __init__(self, locations: Dict[str, Tuple[float, float]], latency: float):
+        self.locations = locations
+        self.latency = latency
+        self.requests_count = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests_count += 1
+                time.sleep(server.latency)
+                params = {
+                    key: values[0]
+                    for key, values in parse_qs(urlparse(self.path).query).items()
+                }
+                body = json.dumps(server.answer(params)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:%s/records" % self._server.server_address[1]
+
+    def _codes(self, where: str) -> List[str]:
+        match = _search.search(where)
+        if match:
+            return [code for code in self.locations if code.startswith(match.group(1))]
+        match = _distance.search(where)
+        if match:
+            lon, lat, dist_km = (float(value) for value in match.groups())
+            distances = {
+                code: haversine_km(lon, lat, *location)
+                for code, location in self.locations.items()
+            }
+            return sorted(
+                (code for code, distance in distances.items() if distance <= dist_km),
+                key=distances.get,
+            )
+        return [code for code in _code.findall(where) if code in self.locations]
+
+    def answer(self, params: Dict[str, str]) -> dict:
+        codes = self._codes(params.get("where", ""))
+        offset = int(params.get("offset", 0))
+        page = codes[offset : offset + int(params.get("limit", 100))]
+        if "group_by" in params:
+            records = [{"record": {"fields": {"code_postal": code}}} for code in page]
+        else:
+            records = [
+                {
+                    "record": {
+                        "fields": {
+                            "code_postal": code,
+                            "coordonnees_gps": dict(
+                                zip(("lon", "lat"), self.locations[code])
+                            ),
+                        }
+                    }
+                }
+                for code in page
+            ]
+        return {"total_count": len(codes), "records": records}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
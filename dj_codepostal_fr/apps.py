@@ -1,5 +1,55 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class CodepostalConfig(AppConfig):
     name = 'dj_codepostal_fr'
+
+    def ready(self):
+        from . import metrics
+        from .cache import cache
+        from .conf import get_setting
+        from .communes import commune_index
+        from .index import current_version, prefix_index, spatial_index
+        from .models import CodePostal, CodePostalLocation
+        from .revalidate import schedule
+        from .signals import (
+            _code_postal_deleted,
+            _code_postal_saved,
+            _location_changed,
+            datanova_attempt,
+            datanova_rejected,
+            datanova_throttled,
+            dataset_changed,
+            lookup_tier,
+            lookup_timed,
+        )
+
+        post_save.connect(_code_postal_saved, sender=CodePostal)
+        post_delete.connect(_code_postal_deleted, sender=CodePostal)
+        post_save.connect(_location_changed, sender=CodePostalLocation)
+        post_delete.connect(_location_changed, sender=CodePostalLocation)
+        dataset_changed.connect(current_version.invalidate)
+        dataset_changed.connect(prefix_index.invalidate)
+        dataset_changed.connect(spatial_index.invalidate)
+        dataset_changed.connect(commune_index.invalidate)
+        dataset_changed.connect(cache.clear_local)
+        # serve stale values while they are fetched again
+        cache.on_stale = schedule
+        lookup_tier.connect(metrics._on_lookup_tier)
+        lookup_timed.connect(metrics._on_lookup_timed)
+        datanova_attempt.connect(metrics._on_datanova_attempt)
+        datanova_throttled.connect(metrics._on_datanova_throttled)
+        datanova_rejected.connect(metrics._on_datanova_rejected)
+
+        if get_setting("CODEPOSTAL_WARM_CACHE_ON_START"):
+            from .warmup import start_warm_up
+
+            start_warm_up()
+
+        if get_setting("CODEPOSTAL_SYNC_SOURCE") and get_setting(
+            "CODEPOSTAL_SYNC_INTERVAL"
+        ):
+            from .sync import start_sync
+
+            start_sync()
@@ -0,0 +1,449 @@
+"""
+Async versions of the lookups of ``utils``, for ASGI deployments.
+
+Cache reads use the async cache API and API calls the async datanova client;
+independent lookups run concurrently, up to ``CODEPOSTAL_ASYNC_CONCURRENCY``.
+DB queries run in the sync thread.
+"""
+import asyncio
+from functools import partial
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+import requests
+
+from dj_codepostal_fr import datanova, metrics, ratelimit
+from dj_codepostal_fr.cache import cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.db import chunks
+from dj_codepostal_fr.neighbors import neighbors
+from dj_codepostal_fr.singleflight import acoalesce
+from dj_codepostal_fr.snapshot import get_snapshot
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    _PostalCodesCompletion,
+    _codes_from_records,
+    _completion_cache_key,
+    _completion_error_items,
+    _completion_failed,
+    _completion_items,
+    _dedupe,
+    _handle_api_errors,
+    _location_cache_key,
+    _locations_from_db,
+    _locations_from_records,
+    _locations_from_snapshot,
+    _locations_params,
+    _missing_locations_cache_key,
+    _nearby_cache_key,
+    _nearby_error_items,
+    _nearby_from_grid,
+    _nearby_from_index,
+    _nearby_items,
+    _nearby_many_from_index,
+    _nearby_many_from_table,
+    _nearby_params,
+    _nearby_settings,
+    _nearby_source_codes,
+    _next_offset,
+    _read_cached_locations,
+    _store_locations,
+    _throttled_cache_key,
+)
+
+logger = logging.getLogger("codepostal.async_utils")
+
+
+@metrics.timed("datanova")
+async def _acall(params, cache_key):
+    if await cache.aget(_throttled_cache_key) or not await ratelimit.aacquire():
+        metrics.rejected()
+        raise DatanovaThrottlingException()
+
+    try:
+        response = await datanova.aget(params)
+    except requests.RequestException as e:
+        # not cached: may be transient
+        logger.error("datanova request failed: %s", e)
+        return False
+
+    return await sync_to_async(_handle_api_errors)(response, cache_key)
+
+
+async def _gather_limited(coroutines: Iterable, limit: int) -> List[Any]:
+    """
+    Runs the coroutines concurrently, at most ``limit`` at once. The first
+    exception is raised once they are all done.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    results = await asyncio.gather(
+        *[limited(coroutine) for coroutine in coroutines], return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _afetch_locations(
+    postal_codes: List[str], cache_key: str
+) -> Optional[Dict[str, Dict[str, float]]]:
+    pages = []
+    offset = 0
+    while offset is not None:
+        response = await _acall(_locations_params(postal_codes, offset), cache_key)
+        if not response:
+            return None
+        pages.append(response.json())
+        offset = _next_offset(pages[-1], offset)
+    return _locations_from_records(pages, postal_codes)
+
+
+async def apostal_code_locations(
+    postal_codes: Iterable[Any],
+) -> Dict[str, Optional[Dict[str, float]]]:
+    """
+    Async version of ``utils.postal_code_locations``
+    """
+    return (await _apostal_code_locations(postal_codes))[0]
+
+
+@metrics.timed("locations")
+async def _apostal_code_locations(
+    postal_codes: Iterable[Any],
+) -> Tuple[Dict[str, Optional[Dict[str, float]]], bool]:
+    """
+    Async version of ``utils._postal_code_locations``
+    """
+    postal_codes = list(dict.fromkeys(str(code) for code in postal_codes if code))
+    if not postal_codes:
+        return {}, True
+
+    # 0. reading from the snapshot
+    result = _locations_from_snapshot(postal_codes)
+    missing = [postal_code for postal_code in postal_codes if postal_code not in result]
+    if not missing:
+        return result, True
+
+    # 1. reading from cache
+    result.update(
+        _read_cached_locations(
+            missing,
+            await cache.aget_many([_location_cache_key(code) for code in missing]),
+        )
+    )
+    missing = [postal_code for postal_code in missing if postal_code not in result]
+    if not missing:
+        return result, True
+
+    # 2. reading from DB
+    result.update(await sync_to_async(_locations_from_db)(missing))
+    missing = [postal_code for postal_code in missing if postal_code not in result]
+    if not missing:
+        return result, True
+
+    # 3. reading from API
+    complete = True
+    for chunk in chunks(missing, get_setting("CODEPOSTAL_FETCH_CHUNK_SIZE")):
+        fetched = await _afetch_locations(chunk, _missing_locations_cache_key(chunk))
+        if fetched is None:
+            metrics.tier("location", "error", len(chunk))
+            result.update(dict.fromkeys(chunk))
+            complete = False
+            continue
+        metrics.tier("location", "api", len(chunk))
+        # store codes without records too, so that the API is not called again
+        fetched = {postal_code: fetched.get(postal_code) for postal_code in chunk}
+        await sync_to_async(_store_locations)(fetched)
+        result.update(fetched)
+    return result, complete
+
+
+@metrics.timed("location")
+async def apostal_code_location(postal_code: Any) -> Optional[Dict[str, float]]:
+    """
+    Async version of ``utils.postal_code_location``
+    """
+    if not postal_code:
+        return None
+
+    postal_code = str(postal_code)
+    snapshot = _locations_from_snapshot([postal_code])
+    if snapshot:
+        return snapshot[postal_code]
+
+    cache_key = _location_cache_key(postal_code)
+
+    async def fetch():
+        return (await apostal_code_locations([postal_code]))[postal_code]
+
+    cached = await cache.aget(cache_key)
+    if cached is not None:
+        metrics.tier("location", "cache")
+    else:
+        cached = await acoalesce(cache_key, fetch)
+    # False: known to have no location
+    return cached or None
+
+
+async def _afetch_nearby(
+    cache_key: str, lon: float, lat: float, dist_km: int, limit: int
+) -> Optional[List[str]]:
+    response = await _acall(_nearby_params(lon, lat, dist_km, limit), cache_key)
+    if not response:
+        metrics.tier("nearby", "error")
+        return None
+    metrics.tier("nearby", "api")
+    result = _codes_from_records(response.json())
+    await cache.aset(cache_key, result, timeout=None)
+    return result
+
+
+@metrics.timed("nearby")
+async def apostal_codes_nearby(
+    dist_km: Optional[float] = None,
+    lon: Optional[float] = None,
+    lat: Optional[float] = None,
+    postal_code: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Optional[List[str]]:
+    """
+    Async version of ``utils.postal_codes_nearby``
+    """
+    assert (lon is None) == (lat is None)
+    assert (lon is not None) == (postal_code is None)
+    dist_km, limit = _nearby_settings(dist_km, limit)
+
+    # 0. reading from the in-process index (may be loaded from DB)
+    if get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+        result = await sync_to_async(_nearby_from_index)(
+            dist_km, lon, lat, postal_code, limit
+        )
+        if result is not None:
+            return result
+
+    if postal_code is None and get_setting("CODEPOSTAL_NEARBY_GRID"):
+        # the cell is rarely missing from the cache
+        result = await sync_to_async(_nearby_from_grid)(dist_km, lon, lat, limit)
+        return result or None
+
+    cache_key = _nearby_cache_key(dist_km, lon, lat, postal_code, limit)
+
+    async def fetch():
+        if postal_code is None:
+            coords = {"lon": lon, "lat": lat}
+        else:
+            # 2. reading from the neighbor table
+            result = await sync_to_async(neighbors)(postal_code, dist_km, limit)
+            if result is not None:
+                metrics.tier("nearby", "table")
+                await cache.aset(cache_key, result, timeout=None)
+                return result
+            coords = await apostal_code_location(postal_code)
+            if not coords:
+                return None
+        return await _afetch_nearby(
+            cache_key, coords["lon"], coords["lat"], dist_km, limit
+        )
+
+    cached = await cache.aget(cache_key)
+    if cached is not None:
+        metrics.tier("nearby", "cache")
+    else:
+        cached = await acoalesce(cache_key, fetch)
+    if not cached:
+        return None
+    return cached
+
+
+async def apostal_codes_nearby_many(
+    postal_codes: List[str],
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+    code_limit: Optional[int] = None,
+) -> List[str]:
+    """
+    Async version of ``utils.postal_codes_nearby_many``: the API calls for
+    the codes still missing run concurrently.
+    """
+    return (
+        await _apostal_codes_nearby_many(postal_codes, dist_km, limit, code_limit)
+    )[0]
+
+
+@metrics.timed("nearby_many")
+async def _apostal_codes_nearby_many(
+    postal_codes: List[str],
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+    code_limit: Optional[int] = None,
+) -> Tuple[List[str], bool]:
+    """
+    Async version of ``utils._postal_codes_nearby_many``
+    """
+    complete = True
+    dist_km, code_limit = _nearby_settings(dist_km, code_limit)
+    if get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+        found, missing = await sync_to_async(_nearby_many_from_index)(
+            postal_codes, dist_km, code_limit
+        )
+    else:
+        found, missing = [], list(postal_codes)
+
+    if missing:
+        cache_keys = {
+            code: _nearby_cache_key(dist_km, None, None, code, code_limit)
+            for code in missing
+        }
+        cached = await cache.aget_many(list(cache_keys.values()))
+        metrics.tier("nearby", "cache", len(cached))
+        uncached = [code for code in missing if cache_keys[code] not in cached]
+        from_table = await sync_to_async(_nearby_many_from_table)(
+            uncached, dist_km, cache_keys, code_limit
+        )
+        cached.update(from_table)
+        locations, complete = await _apostal_code_locations(
+            [code for code in uncached if cache_keys[code] not in from_table]
+        )
+        to_fetch = [
+            code
+            for code in missing
+            if cache_keys[code] not in cached and locations.get(code)
+        ]
+        fetched = dict(
+            zip(
+                to_fetch,
+                await _gather_limited(
+                    [
+                        acoalesce(
+                            cache_keys[code],
+                            partial(
+                                _afetch_nearby,
+                                cache_keys[code],
+                                locations[code]["lon"],
+                                locations[code]["lat"],
+                                dist_km,
+                                code_limit,
+                            ),
+                        )
+                        for code in to_fetch
+                    ],
+                    get_setting("CODEPOSTAL_ASYNC_CONCURRENCY"),
+                ),
+            )
+        )
+        for postal_code in missing:
+            cache_key = cache_keys[postal_code]
+            if cache_key in cached:
+                result = cached[cache_key]
+            elif postal_code in fetched:
+                result = fetched[postal_code]
+            else:
+                continue
+            # None or False (cached error): the API failed
+            if result is None or result is False:
+                complete = False
+            found += result or []
+
+    return _dedupe(found, limit), complete
+
+
+class _AsyncPostalCodesCompletion(_PostalCodesCompletion):
+    @metrics.timed("completion")
+    async def __call__(self, code_portion: str) -> List[str]:
+        if not self._check_portion(code_portion):
+            return None
+
+        # 0. reading from the snapshot, then from the in-process index (may
+        # be loaded from DB)
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            result = self._from_index(code_portion, snapshot)
+            if result is not None:
+                metrics.tier("completion", "snapshot")
+                return result
+        if get_setting("CODEPOSTAL_PREFIX_INDEX"):
+            result = await sync_to_async(self._from_index)(code_portion)
+            if result is not None:
+                metrics.tier("completion", "index")
+                return result
+
+        cache_key = _completion_cache_key(code_portion)
+
+        # 1. reading from Cache
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            metrics.tier("completion", "cache")
+        else:
+            # 2. and 3., once for concurrent callers
+            cached = await acoalesce(cache_key, partial(self._afetch, code_portion))
+        if not cached:
+            return cached
+        return self._refine_results(code_portion, cached)
+
+    async def _afetch(self, code_portion: str) -> Optional[List[str]]:
+        # 2. reading from DB
+        result = await sync_to_async(self._from_db)(code_portion)
+        if result is not None:
+            return result
+
+        # 3. reading from API
+        response = await _acall(
+            self._params(code_portion), _completion_cache_key(code_portion)
+        )
+        if not response:
+            metrics.tier("completion", "error")
+            return None
+        result = _codes_from_records(response.json())
+        await sync_to_async(self._store)(code_portion, result)
+        return result
+
+
+apostal_codes_completion = _AsyncPostalCodesCompletion()
+
+
+@metrics.timed("complete_and_suggest")
+async def acomplete_and_suggest(
+    postal_codes: List[str],
+    term: str,
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Async version of ``utils.complete_and_suggest``: completion and nearby
+    suggestions are looked up concurrently.
+    """
+
+    async def completion():
+        if len(term) < 3:
+            return []
+        try:
+            completion = await apostal_codes_completion(term)
+        except DatanovaThrottlingException:
+            return _completion_error_items(term)
+        if _completion_failed(term, completion):
+            return _completion_error_items(term)
+        return _completion_items(postal_codes, completion)
+
+    async def nearby():
+        if not postal_codes:
+            return []
+        try:
+            nearby, complete = await _apostal_codes_nearby_many(
+                _nearby_source_codes(postal_codes), dist_km, code_limit=limit
+            )
+        except DatanovaThrottlingException:
+            return _nearby_error_items()
+        items = _nearby_items(postal_codes, term, nearby)
+        if not complete:
+            items += _nearby_error_items()
+        return items
+
+    completion_items, nearby_items = await asyncio.gather(completion(), nearby())
+    return completion_items + nearby_items
@@ -0,0 +1,301 @@
+"""
+Optional process-local LRU in front of the Django cache.
+
+Values of the ``complete``, ``location`` and ``nearby`` keys never change
+until the dataset does, so each process can keep the ones it reads to avoid
+a network round-trip to the cache server. Enabled with
+``CODEPOSTAL_LOCAL_CACHE_SIZE``.
+
+These values are stored with the time until which they are fresh (see
+``CODEPOSTAL_CACHE_FRESHNESS``): past it, they are still returned, and their
+keys are passed to ``on_stale`` to be revalidated in the background (see the
+revalidate module).
+"""
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.signals import dataset_version
+
+# some meaningfull text and a random string
+_cache_key_prefix = "codepostal.utils._AeL3zuay"
+
+_kinds = ("complete", "location", "nearby")
+
+
+class _Entry(NamedTuple):
+    value: Any
+    # time.time() after which the value is stale, None if never
+    fresh_until: Optional[float]
+
+
+def _kind(key: str) -> Optional[str]:
+    if not key.startswith(_cache_key_prefix):
+        return None
+    kind = key[len(_cache_key_prefix) :]
+    for name in _kinds:
+        if kind.startswith(name):
+            return name
+    return None
+
+
+class LocalCache:
+    """
+    Bounded, thread-safe LRU with a time to live per entry
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TwoTierCache:
+    """
+    Django cache with a ``LocalCache`` in front of it for the keys of
+    ``utils``, whose values are stored with their freshness. Other keys, and
+    all the other cache methods, go to the Django cache directly.
+    """
+
+    def __init__(self, alias: str = DEFAULT_CACHE_ALIAS):
+        self._alias = alias
+        # called with the stale keys read
+        self.on_stale: Optional[Callable[[List[str]], None]] = None
+        self._local: Optional[LocalCache] = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self._alias]
+
+    @property
+    def local(self) -> Optional[LocalCache]:
+        """
+        The LRU, None when disabled. It is emptied when the dataset version
+        changes (checked every ``CODEPOSTAL_INDEX_CHECK_INTERVAL`` seconds).
+        """
+        size = get_setting("CODEPOSTAL_LOCAL_CACHE_SIZE")
+        if not size:
+            return None
+        local = self._local
+        if local is None or local.max_size != size:
+            with self._lock:
+                local = self._local = LocalCache(size)
+                self._version = dataset_version()
+                self._checked_at = time.monotonic()
+        now = time.monotonic()
+        if now - self._checked_at >= get_setting("CODEPOSTAL_INDEX_CHECK_INTERVAL"):
+            self._checked_at = now
+            version = dataset_version()
+            if version != self._version:
+                self._version = version
+                local.clear()
+        return local
+
+    def clear_local(self, **kwargs):
+        """
+        Empties the LRU of this process, e.g. on dataset changes.
+        """
+        if self._local is not None:
+            self._local.clear()
+
+    def stats(self) -> Dict[str, int]:
+        local = self._local
+        if local is None:
+            return {"size": 0, "hits": 0, "misses": 0}
+        return {"size": len(local), "hits": local.hits, "misses": local.misses}
+
+    def _ttl(self, key: str) -> Optional[float]:
+        kind = _kind(key)
+        if kind is None:
+            return None
+        return get_setting("CODEPOSTAL_LOCAL_CACHE_TTL").get(kind)
+
+    def _wrap(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        wrapped = {}
+        now = time.time()
+        for key, value in data.items():
+            kind = _kind(key)
+            if kind is None or value is None:
+                wrapped[key] = value
+                continue
+            if value:
+                freshness = get_setting("CODEPOSTAL_CACHE_FRESHNESS").get(kind)
+            else:
+                # e.g. no location, or no codes in a group
+                freshness = get_setting("CODEPOSTAL_CACHE_NEGATIVE_FRESHNESS")
+            wrapped[key] = _Entry(
+                value, None if freshness is None else now + freshness
+            )
+        return wrapped
+
+    def _unwrap(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        values = {}
+        stale = []
+        now = time.time()
+        for key, stored in data.items():
+            if isinstance(stored, _Entry):
+                if stored.fresh_until is not None and stored.fresh_until < now:
+                    stale.append(key)
+                stored = stored.value
+            # values stored without freshness are fresh
+            values[key] = stored
+        if stale and self.on_stale is not None:
+            self.on_stale(stale)
+        return values
+
+    def _local_for(self, key: str):
+        local = self.local
+        if local is None:
+            return None, None
+        ttl = self._ttl(key)
+        if not ttl:
+            return None, None
+        return local, ttl
+
+    def _get_local(self, keys: Iterable[str]) -> Dict[str, Any]:
+        found = {}
+        for key in keys:
+            local, _ = self._local_for(key)
+            if local is not None:
+                value = local.get(key)
+                if value is not None:
+                    found[key] = value
+        return found
+
+    def _set_local(self, data: Dict[str, Any]):
+        for key, value in data.items():
+            local, ttl = self._local_for(key)
+            if local is not None and value is not None:
+                local.set(key, value, ttl)
+
+    def _delete_local(self, key: str):
+        if self._local is not None:
+            self._local.delete(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        found = self._get_local([key])
+        if key not in found:
+            value = self.backend.get(key)
+            if value is None:
+                return default
+            self._set_local({key: value})
+            found[key] = value
+        return self._unwrap(found)[key]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        found = self._get_local(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            from_backend = self.backend.get_many(missing)
+            self._set_local(from_backend)
+            found.update(from_backend)
+        return self._unwrap(found)
+
+    def set(self, key: str, value: Any, timeout=DEFAULT_TIMEOUT):
+        data = self._wrap({key: value})
+        self.backend.set(key, data[key], timeout=timeout)
+        self._set_local(data)
+
+    def set_many(self, data: Dict[str, Any], timeout=DEFAULT_TIMEOUT):
+        data = self._wrap(data)
+        failed = self.backend.set_many(data, timeout=timeout)
+        self._set_local(data)
+        return failed
+
+    def add(self, key: str, value: Any, timeout=DEFAULT_TIMEOUT) -> bool:
+        data = self._wrap({key: value})
+        added = self.backend.add(key, data[key], timeout=timeout)
+        if added:
+            self._set_local(data)
+        return added
+
+    def delete(self, key: str):
+        self._delete_local(key)
+        return self.backend.delete(key)
+
+    def delete_many(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self._delete_local(key)
+        return self.backend.delete_many(keys)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        found = self._get_local([key])
+        if key not in found:
+            value = await self.backend.aget(key)
+            if value is None:
+                return default
+            self._set_local({key: value})
+            found[key] = value
+        return self._unwrap(found)[key]
+
+    async def aget_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        found = self._get_local(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            from_backend = await self.backend.aget_many(missing)
+            self._set_local(from_backend)
+            found.update(from_backend)
+        return self._unwrap(found)
+
+    async def aset(self, key: str, value: Any, timeout=DEFAULT_TIMEOUT):
+        data = self._wrap({key: value})
+        await self.backend.aset(key, data[key], timeout=timeout)
+        self._set_local(data)
+
+    def clear(self):
+        self.clear_local()
+        return self.backend.clear()
+
+    async def adelete(self, key: str):
+        self._delete_local(key)
+        return await self.backend.adelete(key)
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+
+cache = TwoTierCache()
@@ -0,0 +1,147 @@
+"""
+Search of the communes by name, INSEE code or postal code, answered by an
+in-process index of ``Commune``: name lookups never reach datanova.
+
+Names are folded (accents, case, punctuation, "St"/"Ste" abbreviations of the
+hexasmal dataset), and each word is indexed by its trigrams, the first one
+anchored to the beginning of the word: the candidates of a query are the
+communes holding the rarest trigram of each typed word, then only those are
+checked and ranked.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+import heapq
+import re
+import unicodedata
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from dj_codepostal_fr import metrics
+from dj_codepostal_fr.index import _DatasetIndex
+from dj_codepostal_fr.models import Commune
+
+_ABBREVIATIONS = {"st": "saint", "ste": "sainte"}
+
+_separators = re.compile(r"[^a-z0-9]+")
+
+
+def fold(text: str) -> List[str]:
+    """
+    Words of ``text``, without accents and case, abbreviations expanded
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [_ABBREVIATIONS.get(word, word) for word in _separators.split(text) if word]
+
+
+def _trigrams(word: str) -> List[str]:
+    # the leading space marks the beginning of the word
+    word = " " + word
+    return [word[i : i + 3] for i in range(len(word) - 2)]
+
+
+class CommuneMatch(NamedTuple):
+    insee: str
+    name: str
+    postal_code: str
+
+
+class _Communes:
+    __slots__ = ("entries", "words", "trigrams", "codes")
+
+    def __init__(self):
+        self.entries: List[CommuneMatch] = []
+        # folded words of the name of each entry
+        self.words: List[Tuple[str, ...]] = []
+        # trigram: positions of the entries with a word containing it
+        self.trigrams: Dict[str, List[int]] = defaultdict(list)
+        # sorted (INSEE or postal code, position) for digit queries
+        self.codes: List[Tuple[str, int]] = []
+
+
+class CommuneIndex(_DatasetIndex):
+    """
+    Trigram index over the folded names of ``Commune``
+    """
+
+    def _build(self) -> _Communes:
+        data = _Communes()
+        rows = Commune.objects.order_by("name", "postal_code").values_list(
+            "insee", "name", "postal_code"
+        )
+        for position, (insee, name, postal_code) in enumerate(rows):
+            words = tuple(fold(name))
+            data.entries.append(CommuneMatch(insee, name, postal_code))
+            data.words.append(words)
+            for trigram in {t for word in words for t in _trigrams(word)}:
+                data.trigrams[trigram].append(position)
+            data.codes.append((insee, position))
+            data.codes.append((postal_code, position))
+        data.trigrams = dict(data.trigrams)
+        data.codes.sort()
+        return data
+
+    def _search_codes(self, data: _Communes, digits: str) -> List[int]:
+        start = bisect_left(data.codes, (digits,))
+        # ":" sorts right after "9"
+        end = bisect_left(data.codes, (digits + ":",), start)
+        return list(dict.fromkeys(position for _, position in data.codes[start:end]))
+
+    def _search_names(
+        self, data: _Communes, tokens: List[str], limit: Optional[int]
+    ) -> List[int]:
+        postings = []
+        for token in tokens:
+            if len(token) < 3:
+                continue
+            found = [data.trigrams.get(trigram, ()) for trigram in _trigrams(token)]
+            postings.append(min(found, key=len))
+        if not postings:
+            # too short to be selective
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+
+        ranked = []
+        for position in candidates:
+            words = data.words[position]
+            # each typed word starts a word of the name
+            if all(any(word.startswith(token) for word in words) for token in tokens):
+                exact = sum(token in words for token in tokens)
+                # entries are sorted by name
+                ranked.append((-exact, len(words), position))
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            ranked.sort()
+        return [position for *_, position in ranked]
+
+    def search(self, term: str, limit: Optional[int] = 20) -> List[CommuneMatch]:
+        """
+        Communes matching ``term``: the beginning of words of their name (at
+        least one of 3 letters), or of their INSEE or postal code; whole words
+        and short names first.
+        """
+        data = self._get_data()
+        tokens = fold(term)
+        if not tokens:
+            return []
+        if all(token.isdigit() for token in tokens):
+            positions = self._search_codes(data, "".join(tokens))[:limit]
+        else:
+            positions = self._search_names(data, tokens, limit)
+        return [data.entries[position] for position in positions]
+
+
+commune_index = CommuneIndex()
+
+
+@metrics.timed("communes")
+def search_communes(term: str, limit: Optional[int] = 20) -> List[CommuneMatch]:
+    """
+    Communes matching ``term``, see ``CommuneIndex.search``
+    """
+    return commune_index.search(term, limit)
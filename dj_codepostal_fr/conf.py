@@ -0,0 +1,94 @@
+from django.conf import settings
+
+DEFAULTS = {
+    "CODEPOSTAL_DATANOVA_URL": "https://datanova.laposte.fr/api/v2/catalog/datasets/laposte_hexasmal/records",
+    # maximum number of kept-alive connections to datanova, per process
+    "CODEPOSTAL_HTTP_POOL_SIZE": 10,
+    # seconds
+    "CODEPOSTAL_HTTP_CONNECT_TIMEOUT": 3.05,
+    "CODEPOSTAL_HTTP_READ_TIMEOUT": 10,
+    # retries on 5xx and connection errors, with a jittered exponential backoff
+    "CODEPOSTAL_HTTP_RETRIES": 2,
+    "CODEPOSTAL_HTTP_BACKOFF": 0.2,
+    # serve completions from an in-process sorted index of CodePostal
+    "CODEPOSTAL_PREFIX_INDEX": False,
+    # serve nearby postal codes from an in-process spatial index of CodePostalLocation
+    "CODEPOSTAL_SPATIAL_INDEX": False,
+    # maximum number of concurrent lookups of one async request
+    "CODEPOSTAL_ASYNC_CONCURRENCY": 5,
+    # route codepostal-nearby-select2 to the async view (for ASGI deployments)
+    "CODEPOSTAL_ASYNC_VIEWS": False,
+    # postal codes per API query when fetching locations, keeps URLs short
+    "CODEPOSTAL_FETCH_CHUNK_SIZE": 50,
+    # coalesce concurrent fetches of the same missing cache key
+    "CODEPOSTAL_SINGLE_FLIGHT": True,
+    # seconds: lifetime of the cross-process lock, waiting time of the other
+    # callers before fetching anyway, and their polling interval
+    "CODEPOSTAL_SINGLE_FLIGHT_LOCK_TIMEOUT": 10,
+    "CODEPOSTAL_SINGLE_FLIGHT_WAIT": 5,
+    "CODEPOSTAL_SINGLE_FLIGHT_POLL": 0.05,
+    # process-local LRU in front of the Django cache, 0 disables it
+    "CODEPOSTAL_LOCAL_CACHE_SIZE": 0,
+    # seconds the local copies are kept, per kind of cache key
+    "CODEPOSTAL_LOCAL_CACHE_TTL": {"complete": 3600, "location": 3600, "nearby": 3600},
+    # seconds the values are fresh, per kind of cache key (None: forever);
+    # stale values are served while revalidated in the background
+    "CODEPOSTAL_CACHE_FRESHNESS": {
+        "complete": 30 * 24 * 3600,
+        "location": 30 * 24 * 3600,
+        "nearby": 7 * 24 * 3600,
+    },
+    # seconds empty results are fresh, and API errors are kept
+    "CODEPOSTAL_CACHE_NEGATIVE_FRESHNESS": 24 * 3600,
+    "CODEPOSTAL_CACHE_ERROR_TTL": 60,
+    # read nearby postal codes from the CodePostalNeighbor table
+    "CODEPOSTAL_NEIGHBORS": False,
+    # neighbors stored per postal code, and their maximum distance in km
+    "CODEPOSTAL_NEIGHBORS_COUNT": 30,
+    "CODEPOSTAL_NEIGHBORS_MAX_DISTANCE": 50,
+    # path of the file written by the build_codepostal_snapshot command
+    "CODEPOSTAL_SNAPSHOT_PATH": None,
+    # record lookup metrics, see the metrics module
+    "CODEPOSTAL_METRICS": False,
+    # maximum number of datanova calls per window of all the processes, None
+    # disables the limit; background jobs leave the reserved part of it to
+    # interactive requests
+    "CODEPOSTAL_RATE_LIMIT": None,
+    "CODEPOSTAL_RATE_LIMIT_WINDOW": 60,
+    "CODEPOSTAL_RATE_LIMIT_RESERVED": 0.2,
+    # seconds browsers and proxies may reuse a codepostal-nearby-select2 response
+    "CODEPOSTAL_HTTP_MAX_AGE": 3600,
+    # area_view concatenates pre-encoded JSON fragments, see the fragments module
+    "CODEPOSTAL_FAST_JSON": False,
+    # maximum number of results of codepostal-communes-select2
+    "CODEPOSTAL_COMMUNES_LIMIT": 20,
+    # threads fetching missing data from the API in warm_codepostal_cache
+    "CODEPOSTAL_WARM_CACHE_WORKERS": 4,
+    # warm the cache in a background thread when the app is loaded
+    "CODEPOSTAL_WARM_CACHE_ON_START": False,
+    # MultiplePostalCodesWithSuggest completes in the browser from the file
+    # written to CODEPOSTAL_OFFLINE_DIR by build_codepostal_offline, served
+    # under CODEPOSTAL_OFFLINE_URL (default: as a static file)
+    "CODEPOSTAL_OFFLINE": False,
+    "CODEPOSTAL_OFFLINE_DIR": None,
+    "CODEPOSTAL_OFFLINE_URL": None,
+    # radius (km) of the nearby suggestions, and their maximum number per
+    # selected postal code; widgets may ask for others
+    "CODEPOSTAL_NEARBY_DISTANCE": 10,
+    "CODEPOSTAL_NEARBY_LIMIT": 30,
+    # size (degrees) of the grid cells point queries are snapped to, sharing
+    # one cached set of neighbors per cell; None disables it
+    "CODEPOSTAL_NEARBY_GRID": None,
+    # export of hexasmal (path or URL) synced every CODEPOSTAL_SYNC_INTERVAL
+    # seconds by a thread of each process, None disables it; a sync retiring
+    # more than CODEPOSTAL_SYNC_MAX_RETIRED of the known codes fails
+    "CODEPOSTAL_SYNC_SOURCE": None,
+    "CODEPOSTAL_SYNC_INTERVAL": None,
+    "CODEPOSTAL_SYNC_MAX_RETIRED": 0.05,
+    # seconds between two checks of the dataset version by in-process indexes
+    "CODEPOSTAL_INDEX_CHECK_INTERVAL": 60,
+}
+
+
+def get_setting(name: str):
+    return getattr(settings, name, DEFAULTS[name])
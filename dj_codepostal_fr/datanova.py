@@ -0,0 +1,184 @@
+"""
+HTTP client for the La Poste datanova API: one pooled keep-alive session per
+process, with timeouts and jittered retries on server and connection errors.
+An async variant uses httpx when it is installed.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+import weakref
+
+from asgiref.sync import sync_to_async
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.signals import datanova_attempt
+
+logger = logging.getLogger("codepostal.datanova")
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+# httpx clients are bound to an event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # retries are handled by get(), to measure each attempt
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=get_setting("CODEPOSTAL_HTTP_POOL_SIZE"),
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def reset_session():
+    """
+    Closes the pooled connections, a new session is created on next call.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _async_clients.clear()
+
+
+def get_async_client() -> "httpx.AsyncClient":
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool_size = get_setting("CODEPOSTAL_HTTP_POOL_SIZE")
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            timeout=httpx.Timeout(
+                get_setting("CODEPOSTAL_HTTP_READ_TIMEOUT"),
+                connect=get_setting("CODEPOSTAL_HTTP_CONNECT_TIMEOUT"),
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _backoff(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, get_setting("CODEPOSTAL_HTTP_BACKOFF") * 2 ** attempt)
+
+
+def _attempt_done(
+    attempt: int,
+    status_code: Optional[int],
+    duration: float,
+    error: Optional[Exception],
+    retries: int,
+) -> bool:
+    """
+    Reports the attempt, returns whether it should be retried.
+    """
+    logger.debug(
+        "datanova attempt %s: status %s in %.3fs", attempt, status_code, duration
+    )
+    datanova_attempt.send(
+        sender=None,
+        attempt=attempt,
+        status_code=status_code,
+        duration=duration,
+        error=error,
+    )
+    if (error is None and status_code < 500) or attempt >= retries:
+        return False
+    logger.warning(
+        "datanova attempt %s failed (%s), retrying", attempt, error or status_code
+    )
+    return True
+
+
+def get(params: Dict[str, Any]) -> requests.Response:
+    """
+    GET the datanova records endpoint, retrying on 5xx and connection errors.
+
+    Raises ``requests.RequestException`` when every attempt failed without a
+    response. Each attempt sends ``signals.datanova_attempt``.
+    """
+    url = get_setting("CODEPOSTAL_DATANOVA_URL")
+    timeout = (
+        get_setting("CODEPOSTAL_HTTP_CONNECT_TIMEOUT"),
+        get_setting("CODEPOSTAL_HTTP_READ_TIMEOUT"),
+    )
+    retries = get_setting("CODEPOSTAL_HTTP_RETRIES")
+    session = get_session()
+
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        response = error = None
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        status_code = response.status_code if response is not None else None
+
+        if not _attempt_done(
+            attempt, status_code, time.monotonic() - start, error, retries
+        ):
+            if error is not None:
+                raise error
+            return response
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def aget(params: Dict[str, Any]):
+    """
+    Async version of ``get``, with httpx. Without httpx, ``get`` is run in a
+    worker thread.
+
+    The response is an ``httpx.Response``, and errors are raised as
+    ``requests.RequestException`` like with ``get``.
+    """
+    if httpx is None:
+        return await sync_to_async(get, thread_sensitive=False)(params)
+
+    url = get_setting("CODEPOSTAL_DATANOVA_URL")
+    retries = get_setting("CODEPOSTAL_HTTP_RETRIES")
+    client = get_async_client()
+
+    attempt = 0
+    while True:
+        start = time.monotonic()
+        response = error = None
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TimeoutException as e:
+            error = requests.Timeout(str(e))
+        except httpx.TransportError as e:
+            error = requests.ConnectionError(str(e))
+        status_code = response.status_code if response is not None else None
+
+        if not _attempt_done(
+            attempt, status_code, time.monotonic() - start, error, retries
+        ):
+            if error is not None:
+                raise error
+            return response
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
@@ -0,0 +1,26 @@
+from typing import Any, Iterator, List, Optional, Sequence
+
+
+def chunks(items: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def bulk_upsert(
+    model,
+    objects: List[Any],
+    fields: List[str],
+    batch_size: int = 500,
+    unique_fields: Optional[List[str]] = None,
+):
+    """
+    Inserts the objects, updating ``fields`` of the existing rows, matched on
+    ``unique_fields`` (the primary key by default).
+    """
+    model.objects.bulk_create(
+        objects,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=unique_fields or [model._meta.pk.name],
+        update_fields=fields,
+    )
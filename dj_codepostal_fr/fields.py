@@ -1,4 +1,5 @@
 from django import forms
+from django.core.exceptions import ValidationError
 import re
 
 from .widgets import MultiplePostalCodesWithSuggest
@@ -8,5 +9,22 @@ class MultiplePostalCodesField(forms.MultipleChoiceField):
 
     match_regex = re.compile(r"[0-9]{5}")
 
+    # reject the codes that do not exist, not only the malformed ones
+    check_exists = True
+
     def valid_value(self, value: str) -> bool:
         return len(value) == 5 and self.match_regex.match(value)
+
+    def validate(self, value):
+        super().validate(value)
+        if self.check_exists and value:
+            # not at module level: imported by the package, before the models
+            from .utils import unknown_postal_codes
+
+            unknown = unknown_postal_codes(value)
+            if unknown:
+                raise ValidationError(
+                    self.error_messages["invalid_choice"],
+                    code="invalid_choice",
+                    params={"value": unknown[0]},
+                )
@@ -0,0 +1,204 @@
+"""
+Fast path of ``complete_and_suggest`` returning the JSON body of
+``area_view`` directly.
+
+Items of postal codes are encoded once per process, and the completion items
+of each 3-digit group are kept joined: a response body is mostly the
+concatenation of pre-encoded fragments. Encoding uses orjson when installed.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from dj_codepostal_fr.async_utils import (
+    _apostal_codes_nearby_many,
+    apostal_codes_completion,
+)
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    _completion_error_items,
+    _completion_failed,
+    _completion_items,
+    _nearby_error_items,
+    _nearby_source_codes,
+    _postal_codes_nearby_many,
+    postal_codes_completion,
+)
+
+# encoded {"id": code, "text": code} of each postal code
+_code_fragments: Dict[str, bytes] = {}
+# 3-digit group: (codes, their joined fragments)
+_group_fragments: Dict[str, Tuple[List[str], bytes]] = {}
+
+# lookup not made: term too short, or no selected postal codes
+_skipped = object()
+# lookup failed, e.g. connection error or 5xx of the API
+_failed = object()
+
+_Lookup = Union[object, None, List[str], DatanovaThrottlingException]
+
+
+def _dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _code_fragment(code: str) -> bytes:
+    fragment = _code_fragments.get(code)
+    if fragment is None:
+        fragment = _code_fragments[code] = _dumps({"id": code, "text": code})
+    return fragment
+
+
+def _codes_fragment(codes: List[str]) -> bytes:
+    return b",".join([_code_fragment(code) for code in codes])
+
+
+def _group_fragment(group: str, codes: List[str]) -> bytes:
+    cached = _group_fragments.get(group)
+    # comparing is much cheaper than encoding
+    if cached is None or cached[0] != codes:
+        cached = _group_fragments[group] = (list(codes), _codes_fragment(codes))
+    return cached[1]
+
+
+def _completion_fragment(
+    postal_codes: List[str], term: str, completion: _Lookup
+) -> Optional[bytes]:
+    if completion is _skipped:
+        return None
+    if completion is _failed or isinstance(completion, DatanovaThrottlingException):
+        return b",".join(_dumps(item) for item in _completion_error_items(term))
+    if not completion:
+        items = _completion_items(postal_codes, completion)
+        return b",".join(_dumps(item) for item in items)
+    if len(term) == 3 and not set(postal_codes).intersection(completion):
+        # the whole 3-digit group
+        return _group_fragment(term, completion)
+    return _codes_fragment([code for code in completion if code not in postal_codes])
+
+
+def _nearby_fragment(
+    postal_codes: List[str], term: str, nearby: _Lookup
+) -> Optional[bytes]:
+    if nearby is _skipped:
+        return None
+    if isinstance(nearby, DatanovaThrottlingException):
+        return b",".join(_dumps(item) for item in _nearby_error_items())
+    codes = [
+        str(near)
+        for near in nearby
+        if (not term or near.startswith(term)) and near not in postal_codes
+    ]
+    if not codes:
+        return None
+    return (
+        _nearby_prefix
+        + b",".join([_code_fragment(code) for code in dict.fromkeys(codes)])
+        + b"]}"
+    )
+
+
+def _completion_lookup(term: str, completion: _Lookup) -> _Lookup:
+    if _completion_failed(term, completion):
+        return _failed
+    return completion
+
+
+_nearby_prefix = _dumps({"text": "À proximité", "children": []})[:-2]
+
+
+def _body(
+    postal_codes: List[str],
+    term: str,
+    completion: _Lookup,
+    nearby: _Lookup,
+    nearby_complete: bool = True,
+) -> Tuple[bytes, bool]:
+    fragments = [
+        fragment
+        for fragment in (
+            _completion_fragment(postal_codes, term, completion),
+            _nearby_fragment(postal_codes, term, nearby),
+            # suggestions of some postal codes are missing
+            None
+            if nearby_complete
+            else b",".join(_dumps(item) for item in _nearby_error_items()),
+        )
+        # an empty completion fragment: all codes already selected
+        if fragment
+    ]
+    complete = nearby_complete and not any(
+        lookup is _failed or isinstance(lookup, DatanovaThrottlingException)
+        for lookup in (completion, nearby)
+    )
+    return b'{"err":"nil","results":[' + b",".join(fragments) + b"]}", complete
+
+
+def complete_and_suggest_json(
+    postal_codes: List[str],
+    term: str,
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> Tuple[bytes, bool]:
+    """
+    JSON body of ``{"err": "nil", "results": complete_and_suggest(...)}``,
+    and whether all the suggestions could be looked up.
+    """
+    completion = nearby = _skipped
+    nearby_complete = True
+    if len(term) >= 3:
+        try:
+            completion = _completion_lookup(term, postal_codes_completion(term))
+        except DatanovaThrottlingException as e:
+            completion = e
+    if postal_codes:
+        try:
+            nearby, nearby_complete = _postal_codes_nearby_many(
+                _nearby_source_codes(postal_codes), dist_km, code_limit=limit
+            )
+        except DatanovaThrottlingException as e:
+            nearby = e
+    return _body(postal_codes, term, completion, nearby, nearby_complete)
+
+
+async def acomplete_and_suggest_json(
+    postal_codes: List[str],
+    term: str,
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> Tuple[bytes, bool]:
+    """
+    Async version of ``complete_and_suggest_json``
+    """
+
+    async def completion():
+        if len(term) < 3:
+            return _skipped
+        try:
+            return _completion_lookup(term, await apostal_codes_completion(term))
+        except DatanovaThrottlingException as e:
+            return e
+
+    async def nearby():
+        if not postal_codes:
+            return _skipped, True
+        try:
+            return await _apostal_codes_nearby_many(
+                _nearby_source_codes(postal_codes), dist_km, code_limit=limit
+            )
+        except DatanovaThrottlingException as e:
+            return e, True
+
+    completion_lookup, (nearby_lookup, nearby_complete) = await asyncio.gather(
+        completion(), nearby()
+    )
+    return _body(
+        postal_codes, term, completion_lookup, nearby_lookup, nearby_complete
+    )
@@ -0,0 +1,39 @@
+from math import asin, cos, radians, sin, sqrt
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+# length of one degree of latitude
+KM_PER_DEGREE = 111.195
+
+
+def haversine_km(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    """
+    Great-circle distance between two points, in kilometers
+    """
+    lon1, lat1, lon2, lat2 = map(radians, (lon1, lat1, lon2, lat2))
+    a = (
+        sin((lat2 - lat1) / 2) ** 2
+        + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def haversine_matrix_km(lons1, lats1, lons2, lats2):
+    """
+    Distances in kilometers between each point of the first set (rows) and
+    each point of the second set (columns), computed in one vectorized pass.
+
+    Requires numpy.
+    """
+    lons1, lats1 = numpy.radians(lons1)[:, None], numpy.radians(lats1)[:, None]
+    lons2, lats2 = numpy.radians(lons2)[None, :], numpy.radians(lats2)[None, :]
+    a = (
+        numpy.sin((lats2 - lats1) / 2) ** 2
+        + numpy.cos(lats1) * numpy.cos(lats2) * numpy.sin((lons2 - lons1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(a, 1.0)))
@@ -0,0 +1,294 @@
+"""
+Streaming reader and bulk importer for the La Poste hexasmal dataset.
+
+The official export (CSV or JSON) lists one row per commune / postal code
+pair. Rows are read one by one and only per-postal-code accumulators are kept
+in memory, so importing the full dataset needs a bounded amount of memory.
+"""
+from collections import defaultdict
+import csv
+import json
+import logging
+import unicodedata
+from typing import Any, Dict, IO, Iterable, Iterator, Optional, Tuple
+
+from django.db import transaction
+
+from dj_codepostal_fr.cache import cache
+from dj_codepostal_fr.db import bulk_upsert, chunks
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+    Commune,
+)
+from dj_codepostal_fr.signals import notify_dataset_changed
+from dj_codepostal_fr.utils import _completion_cache_key, _location_cache_key
+
+logger = logging.getLogger("codepostal.hexasmal")
+
+# normalized column names of the hexasmal dataset, and their known aliases
+_COLUMN_ALIASES = {
+    "code_commune_insee": "insee",
+    "nom_de_la_commune": "name",
+    "nom_commune": "name",
+    "code_postal": "postal_code",
+    "ligne_5": "line_5",
+    "libelle_d_acheminement": "label",
+    "coordonnees_gps": "coordinates",
+    "_geopoint": "coordinates",
+}
+
+_JSON_CHUNK_SIZE = 64 * 1024
+
+
+def _normalize_column(name: str) -> str:
+    name = unicodedata.normalize("NFKD", name.strip().lstrip("#").lower())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return name.replace(" ", "_").replace("'", "_")
+
+
+def _parse_coordinates(value: Any) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Returns (lon, lat) from any of the encodings found in the exports:
+    ``{"lon": .., "lat": ..}``, ``[lat, lon]`` or ``"lat, lon"``.
+    """
+    if not value:
+        return None, None
+    try:
+        if isinstance(value, dict):
+            return float(value["lon"]), float(value["lat"])
+        if isinstance(value, str):
+            value = value.split(",")
+        lat, lon = value
+        return float(lon), float(lat)
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
+def _normalize_record(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # unwrap the opendatasoft envelopes ({"fields": ...} or {"record": {"fields": ...}})
+    if "record" in raw:
+        raw = raw["record"]
+    if "fields" in raw:
+        raw = raw["fields"]
+
+    record = {}
+    for key, value in raw.items():
+        column = _COLUMN_ALIASES.get(_normalize_column(key))
+        if column:
+            record[column] = value
+
+    postal_code = str(record.get("postal_code") or "").strip()
+    if not postal_code:
+        return None
+    # some exports store codes as integers, losing the leading zero
+    record["postal_code"] = postal_code.zfill(5)
+    record["lon"], record["lat"] = _parse_coordinates(record.pop("coordinates", None))
+    return record
+
+
+def _iter_csv(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    head = stream.readline()
+    delimiter = ";" if head.count(";") >= head.count(",") else ","
+    reader = csv.reader(stream, delimiter=delimiter)
+    columns = next(csv.reader([head], delimiter=delimiter))
+    for row in reader:
+        if row:
+            yield dict(zip(columns, row))
+
+
+def _iter_json(stream: IO[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Incrementally decodes a JSON array of records, or JSON lines.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    while True:
+        # skip separators between records
+        buffer = buffer.lstrip(" \t\r\n,[]")
+        if not buffer:
+            if eof:
+                return
+            chunk = stream.read(_JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        try:
+            obj, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = stream.read(_JSON_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        buffer = buffer[end:]
+        if isinstance(obj, dict) and "records" in obj and isinstance(obj["records"], list):
+            # API page
+            yield from obj["records"]
+        elif isinstance(obj, dict):
+            yield obj
+
+
+def iter_records(stream: IO[str], format: str = "csv") -> Iterator[Dict[str, Any]]:
+    """
+    Yields normalized records (``insee``, ``name``, ``postal_code``,
+    ``line_5``, ``label``, ``lon``, ``lat``) from a hexasmal export.
+
+    ``format`` is ``"csv"`` or ``"json"`` (JSON array, API pages or JSON lines).
+    """
+    raw_records = _iter_json(stream) if format == "json" else _iter_csv(stream)
+    for raw in raw_records:
+        record = _normalize_record(raw)
+        if record is not None:
+            yield record
+
+
+def guess_format(path: str) -> str:
+    return "json" if path.lower().endswith((".json", ".jsonl", ".ndjson")) else "csv"
+
+
+class _Accumulator:
+    __slots__ = ("lon_sum", "lat_sum", "count")
+
+    def __init__(self):
+        self.lon_sum = 0.0
+        self.lat_sum = 0.0
+        self.count = 0
+
+    def add(self, lon: Optional[float], lat: Optional[float]):
+        if lon is None or lat is None:
+            return
+        self.lon_sum += lon
+        self.lat_sum += lat
+        self.count += 1
+
+    def centroid(self) -> Tuple[Optional[float], Optional[float]]:
+        if not self.count:
+            return None, None
+        return self.lon_sum / self.count, self.lat_sum / self.count
+
+
+class _Aggregate:
+    """
+    Per-postal-code and per-commune accumulators of normalized records
+    """
+
+    __slots__ = ("codes", "communes", "commune_names", "rows")
+
+    def __init__(self):
+        self.codes: Dict[str, _Accumulator] = defaultdict(_Accumulator)
+        # (insee, postal code): centroid of the rows (one per "ligne 5") and name
+        self.communes: Dict[Tuple[str, str], _Accumulator] = defaultdict(_Accumulator)
+        self.commune_names: Dict[Tuple[str, str], str] = {}
+        self.rows = 0
+
+
+def _aggregate(records: Iterable[Dict[str, Any]]) -> _Aggregate:
+    aggregate = _Aggregate()
+    for record in records:
+        aggregate.rows += 1
+        aggregate.codes[record["postal_code"]].add(record["lon"], record["lat"])
+        insee = str(record.get("insee") or "").strip()
+        if insee:
+            key = (insee.zfill(5), record["postal_code"])
+            aggregate.communes[key].add(record["lon"], record["lat"])
+            if not aggregate.commune_names.get(key):
+                aggregate.commune_names[key] = str(record.get("name") or "").strip()
+    return aggregate
+
+
+def import_records(records: Iterable[Dict[str, Any]], batch_size: int = 500) -> Dict[str, int]:
+    """
+    Fills ``CodePostal``, ``CodePostalCompletions``, ``CodePostalLocation``
+    and ``Commune`` from normalized hexasmal records, and refreshes the
+    matching cache entries.
+    """
+    aggregate = _aggregate(records)
+    accumulators = aggregate.codes
+    commune_accumulators = aggregate.communes
+    commune_names = aggregate.commune_names
+    rows = aggregate.rows
+
+    codes = sorted(accumulators)
+    groups = defaultdict(list)
+    for code in codes:
+        groups[code[:3]].append(code)
+
+    with transaction.atomic():
+        # codes stored as unknown before are known from now on
+        bulk_upsert(
+            CodePostal,
+            [CodePostal(code=code, known=True) for code in codes],
+            ["known"],
+            batch_size,
+        )
+        CodePostalCompletions.objects.bulk_create(
+            [CodePostalCompletions(portion=portion) for portion in groups],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        locations = []
+        for code in codes:
+            lon, lat = accumulators[code].centroid()
+            locations.append(
+                CodePostalLocation(code_id=code, longitude=lon, latitude=lat)
+            )
+        bulk_upsert(CodePostalLocation, locations, ["longitude", "latitude"], batch_size)
+        communes = []
+        for (insee, code), accumulator in sorted(commune_accumulators.items()):
+            lon, lat = accumulator.centroid()
+            communes.append(
+                Commune(
+                    insee=insee,
+                    name=commune_names[insee, code],
+                    postal_code_id=code,
+                    longitude=lon,
+                    latitude=lat,
+                )
+            )
+        bulk_upsert(
+            Commune,
+            communes,
+            ["name", "longitude", "latitude"],
+            batch_size,
+            unique_fields=["insee", "postal_code"],
+        )
+
+    # stale values (including stored API failures) would shadow the imported data
+    for chunk in chunks(locations, batch_size):
+        cache.set_many(
+            {
+                _location_cache_key(location.code_id): (
+                    {"lon": location.longitude, "lat": location.latitude}
+                    if location.longitude is not None and location.latitude is not None
+                    else False
+                )
+                for location in chunk
+            },
+            timeout=None,
+        )
+    cache.set_many(
+        {
+            _completion_cache_key(portion): completions
+            for portion, completions in groups.items()
+        },
+        timeout=None,
+    )
+
+    notify_dataset_changed()
+
+    logger.info(
+        "imported %s rows, %s postal codes, %s communes",
+        rows,
+        len(codes),
+        len(communes),
+    )
+    return {
+        "rows": rows,
+        "postal_codes": len(codes),
+        "prefixes": len(groups),
+        "communes": len(communes),
+    }
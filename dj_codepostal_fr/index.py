@@ -0,0 +1,242 @@
+"""
+In-process indexes of the known postal codes, answering completion and nearby
+queries without any cache or DB round-trip.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from math import cos, floor, radians
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.geo import (
+    KM_PER_DEGREE,
+    haversine_km,
+    haversine_matrix_km,
+    numpy,
+)
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation
+from dj_codepostal_fr.signals import dataset_version
+
+
+class _DatasetIndex:
+    """
+    Base class of the indexes: built from the DB on first use, and rebuilt
+    when the dataset version changes (checked every
+    ``CODEPOSTAL_INDEX_CHECK_INTERVAL`` seconds).
+    """
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        raise NotImplementedError
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def load(self):
+        # read the version first: a change during the load triggers a new one
+        version = dataset_version()
+        data = self._build()
+        with self._lock:
+            self._data = data
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self._data = None
+
+    def _get_data(self):
+        if self._data is None:
+            self.load()
+        else:
+            now = time.monotonic()
+            if now - self._checked_at >= get_setting("CODEPOSTAL_INDEX_CHECK_INTERVAL"):
+                self._checked_at = now
+                if dataset_version() != self._version:
+                    self.load()
+        return self._data
+
+
+class DatasetVersion(_DatasetIndex):
+    """
+    ``dataset_version()``, read from the cache at most once per
+    ``CODEPOSTAL_INDEX_CHECK_INTERVAL`` seconds
+    """
+
+    def _build(self) -> str:
+        return dataset_version()
+
+    def get(self) -> str:
+        return self._get_data()
+
+
+class PostalCodeIndex(_DatasetIndex):
+    """
+    Sorted array of all postal codes: a prefix query is two binary searches.
+    """
+
+    def _build(self) -> List[str]:
+        return list(
+            CodePostal.objects.filter(known=True)
+            .order_by("code")
+            .values_list("code", flat=True)
+        )
+
+    def complete(self, code_portion: str) -> List[str]:
+        """
+        All known codes starting with ``code_portion`` (1 to 5 digits), sorted.
+        """
+        codes = self._get_data()
+        start = bisect_left(codes, code_portion)
+        # ":" sorts right after "9"
+        end = bisect_left(codes, code_portion + ":", start)
+        return codes[start:end]
+
+    def __contains__(self, code: str) -> bool:
+        codes = self._get_data()
+        position = bisect_left(codes, code)
+        return position < len(codes) and codes[position] == code
+
+    def __len__(self) -> int:
+        return len(self._get_data())
+
+
+class _Grid:
+    __slots__ = ("locations", "cells", "codes", "lons", "lats")
+
+    def __init__(self):
+        self.locations: Dict[str, Tuple[float, float]] = {}
+        self.cells: Dict[Tuple[int, int], List[Tuple[str, float, float]]] = defaultdict(list)
+        # flat arrays of all the locations, only with numpy
+        self.codes = self.lons = self.lats = None
+
+
+class SpatialIndex(_DatasetIndex):
+    """
+    Regular lon/lat grid over the centroids of ``CodePostalLocation``: a radius
+    query only measures the distance to the codes of the cells it overlaps.
+    """
+
+    # about 11 km
+    cell_degrees = 0.1
+    # rows of the distance matrix computed at once, bounds the memory used
+    matrix_rows = 256
+
+    def _cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        return floor(lon / self.cell_degrees), floor(lat / self.cell_degrees)
+
+    def _build(self) -> _Grid:
+        grid = _Grid()
+        for code, lon, lat in CodePostalLocation.objects.filter(
+            longitude__isnull=False, latitude__isnull=False
+        ).values_list("code", "longitude", "latitude"):
+            grid.locations[code] = (lon, lat)
+            grid.cells[self._cell(lon, lat)].append((code, lon, lat))
+        if numpy is not None:
+            grid.codes = list(grid.locations)
+            grid.lons = numpy.array([grid.locations[code][0] for code in grid.codes])
+            grid.lats = numpy.array([grid.locations[code][1] for code in grid.codes])
+        return grid
+
+    def items(self) -> Iterable[Tuple[str, Tuple[float, float]]]:
+        """
+        (code, (lon, lat)) of all the indexed codes
+        """
+        return self._get_data().locations.items()
+
+    def location(self, postal_code: str) -> Optional[Tuple[float, float]]:
+        """
+        (lon, lat) of the code, None if not known
+        """
+        return self._get_data().locations.get(postal_code)
+
+    def nearby(
+        self, lon: float, lat: float, dist_km: float, limit: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        (code, distance in km) of the codes within ``dist_km`` of the point,
+        closest first.
+        """
+        grid = self._get_data()
+        lat_span = dist_km / KM_PER_DEGREE
+        # widest longitude span is at the latitude farthest from the equator
+        max_lat = min(abs(lat) + lat_span, 89.0)
+        lon_span = dist_km / (KM_PER_DEGREE * cos(radians(max_lat)))
+        min_x, min_y = self._cell(lon - lon_span, lat - lat_span)
+        max_x, max_y = self._cell(lon + lon_span, lat + lat_span)
+
+        found = []
+        cells = grid.cells
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for code, code_lon, code_lat in cells.get((x, y), ()):
+                    distance = haversine_km(lon, lat, code_lon, code_lat)
+                    if distance <= dist_km:
+                        found.append((code, distance))
+        found.sort(key=lambda item: item[1])
+        if limit is not None:
+            return found[:limit]
+        return found
+
+    def nearby_many(
+        self,
+        points: Iterable[Tuple[float, float]],
+        dist_km: float,
+        limit: Optional[int] = None,
+        limit_per_point: Optional[int] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        (code, distance in km to the closest point) of the codes within
+        ``dist_km`` of any of the (lon, lat) points, closest first: at most
+        ``limit``, and the ``limit_per_point`` closest codes of each point.
+
+        With numpy, distances to all the known locations are computed in one
+        vectorized pass per block of points.
+        """
+        points = list(points)
+        if not points:
+            return []
+        grid = self._get_data()
+        if numpy is None or not grid.codes:
+            best = {}
+            for lon, lat in points:
+                for code, distance in self.nearby(lon, lat, dist_km, limit_per_point):
+                    if distance < best.get(code, dist_km + 1):
+                        best[code] = distance
+            found = sorted(best.items(), key=lambda item: item[1])
+            return found if limit is None else found[:limit]
+
+        closest = numpy.full(len(grid.codes), numpy.inf)
+        for start in range(0, len(points), self.matrix_rows):
+            block = numpy.array(points[start : start + self.matrix_rows])
+            distances = haversine_matrix_km(block[:, 0], block[:, 1], grid.lons, grid.lats)
+            if limit_per_point is not None and limit_per_point < len(grid.codes):
+                # the closest codes of each point only
+                nearest = numpy.argpartition(distances, limit_per_point - 1, axis=1)[
+                    :, :limit_per_point
+                ]
+                rows = numpy.arange(len(block))[:, None]
+                numpy.minimum.at(
+                    closest, nearest.ravel(), distances[rows, nearest].ravel()
+                )
+            else:
+                numpy.minimum(closest, distances.min(axis=0), out=closest)
+
+        (selected,) = numpy.nonzero(closest <= dist_km)
+        selected = selected[numpy.argsort(closest[selected], kind="stable")]
+        if limit is not None:
+            selected = selected[:limit]
+        return [(grid.codes[i], float(closest[i])) for i in selected]
+
+
+current_version = DatasetVersion()
+prefix_index = PostalCodeIndex()
+spatial_index = SpatialIndex()
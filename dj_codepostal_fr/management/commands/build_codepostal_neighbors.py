@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dj_codepostal_fr.neighbors import build_neighbors
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute the nearest postal codes of each located postal code into the "
+        "CodePostalNeighbor table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            help="neighbors per postal code (default: CODEPOSTAL_NEIGHBORS_COUNT)",
+        )
+        parser.add_argument(
+            "--max-distance",
+            type=float,
+            help="in km (default: CODEPOSTAL_NEIGHBORS_MAX_DISTANCE)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of rows written per query",
+        )
+
+    def handle(self, *args, count, max_distance, batch_size, **options):
+        start = time.monotonic()
+        rows = build_neighbors(
+            count=count, max_dist_km=max_distance, batch_size=batch_size
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Stored %s neighbors in %.1fs" % (rows, time.monotonic() - start)
+            )
+        )
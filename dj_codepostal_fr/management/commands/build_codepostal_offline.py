@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.offline import write_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the offline completion dataset of MultiplePostalCodesWithSuggest, "
+        "a static file named after the hash of its content"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            nargs="?",
+            help="output directory (default: CODEPOSTAL_OFFLINE_DIR)",
+        )
+
+    def handle(self, *args, directory, **options):
+        directory = directory or get_setting("CODEPOSTAL_OFFLINE_DIR")
+        if not directory:
+            raise CommandError("No directory given and CODEPOSTAL_OFFLINE_DIR not set")
+        path = write_dataset(directory)
+        self.stdout.write(
+            self.style.SUCCESS("Wrote %s (%s bytes)" % (path, os.path.getsize(path)))
+        )
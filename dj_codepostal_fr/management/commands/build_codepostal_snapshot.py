@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile the stored postal codes and locations into the binary snapshot "
+        "memory-mapped by the worker processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            help="output file (default: CODEPOSTAL_SNAPSHOT_PATH)",
+        )
+
+    def handle(self, *args, path, **options):
+        path = path or get_setting("CODEPOSTAL_SNAPSHOT_PATH")
+        if not path:
+            raise CommandError("No path given and CODEPOSTAL_SNAPSHOT_PATH not set")
+        count = build_snapshot(path)
+        self.stdout.write(
+            self.style.SUCCESS("Wrote %s postal codes to %s" % (count, path))
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    fetch_postal_code_locations,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch from the La Poste API the locations of the stored postal codes "
+        "that have none. Can be interrupted and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="postal codes per API query (default: CODEPOSTAL_FETCH_CHUNK_SIZE)",
+        )
+
+    def _progress(self, done, total, elapsed):
+        self.stdout.write(
+            "%s/%s postal codes (%.1f codes/s)"
+            % (done, total, done / elapsed if elapsed else 0)
+        )
+
+    def handle(self, *args, chunk_size, **options):
+        try:
+            found = fetch_postal_code_locations(
+                chunk_size=chunk_size, progress=self._progress
+            )
+        except DatanovaThrottlingException:
+            raise CommandError("Throttled by the La Poste API, run again later")
+        if found is None:
+            raise CommandError("La Poste API error, see logs")
+        self.stdout.write(self.style.SUCCESS("Found %s locations" % found))
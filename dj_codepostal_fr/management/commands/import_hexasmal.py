@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dj_codepostal_fr.hexasmal import guess_format, import_records, iter_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Import postal codes, completions and locations from an export of the "
+        "La Poste hexasmal dataset (CSV or JSON)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="path to the CSV or JSON export")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json"],
+            help="file format, guessed from the file extension by default",
+        )
+        parser.add_argument("--encoding", default="utf-8-sig")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of rows written per query",
+        )
+
+    def handle(self, *args, path, format, encoding, batch_size, **options):
+        start = time.monotonic()
+        with open(path, encoding=encoding, newline="") as stream:
+            stats = import_records(
+                iter_records(stream, format or guess_format(path)),
+                batch_size=batch_size,
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Imported %(rows)s rows: %(postal_codes)s postal codes, "
+                "%(prefixes)s prefixes, %(communes)s communes" % stats
+                + " in %.1fs" % (time.monotonic() - start)
+            )
+        )
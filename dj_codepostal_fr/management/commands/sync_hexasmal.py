@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dj_codepostal_fr.sync import SyncError, sync_source
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the differences between an export of the La Poste hexasmal "
+        "dataset (CSV or JSON, file or URL) and the stored postal codes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            nargs="?",
+            help="path or URL of the export (default: CODEPOSTAL_SYNC_SOURCE)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json"],
+            help="file format, guessed from the file extension by default",
+        )
+        parser.add_argument("--encoding", default="utf-8-sig")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of rows written per query",
+        )
+        parser.add_argument(
+            "--no-retire",
+            action="store_false",
+            dest="retire",
+            help="keep the known postal codes missing from the export",
+        )
+        parser.add_argument(
+            "--max-retired",
+            type=float,
+            help="maximum fraction of the known postal codes retired "
+            "(default: CODEPOSTAL_SYNC_MAX_RETIRED)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only count the changes",
+        )
+
+    def handle(
+        self,
+        *args,
+        source,
+        format,
+        encoding,
+        batch_size,
+        retire,
+        max_retired,
+        dry_run,
+        **options
+    ):
+        try:
+            stats = sync_source(
+                source,
+                format,
+                encoding,
+                batch_size=batch_size,
+                retire=retire,
+                max_retired=max_retired,
+                dry_run=dry_run,
+            )
+        except SyncError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            self.style.SUCCESS(
+                "%(rows)s rows: %(inserted)s inserted, %(updated)s updated, "
+                "%(retired)s retired, %(unchanged)s unchanged postal codes, "
+                "%(cache_keys)s cache keys refreshed in %(seconds).1fs" % stats
+            )
+        )
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from dj_codepostal_fr.warmup import warm_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the completions and locations of all the known postal codes to "
+        "the cache, fetching the missing ones from the La Poste API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="cache keys written per set_many",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="threads fetching from the API "
+            "(default: CODEPOSTAL_WARM_CACHE_WORKERS)",
+        )
+        parser.add_argument(
+            "--no-fetch",
+            action="store_false",
+            dest="fetch",
+            help="only write the data stored in the DB",
+        )
+
+    def _progress(self, step, written):
+        self.stdout.write("%s: %s keys" % (step, written))
+
+    def handle(self, *args, batch_size, workers, fetch, **options):
+        stats = warm_cache(
+            batch_size=batch_size,
+            workers=workers,
+            fetch=fetch,
+            progress=self._progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Wrote %s keys in %.1fs (%.0f keys/s)"
+                % (
+                    stats["keys"],
+                    stats["seconds"],
+                    stats["keys"] / stats["seconds"] if stats["seconds"] else 0,
+                )
+            )
+        )
+        if stats["failed"]:
+            self.stderr.write(
+                "%s API queries failed, run again later" % stats["failed"]
+            )
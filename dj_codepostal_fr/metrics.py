@@ -0,0 +1,204 @@
+"""
+Instrumentation of the lookups: which tier answered them (snapshot, index,
+cache, table, DB, API), how long they took, and the datanova calls.
+
+Nothing is measured unless ``CODEPOSTAL_METRICS`` is set. Measurements are
+sent as signals (see ``signals``), so that they can be forwarded to any
+monitoring system; ``registry`` receives them and keeps per-process totals,
+exported in the Prometheus text format by ``views.metrics_view``.
+"""
+from functools import wraps
+import inspect
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.signals import (
+    datanova_rejected,
+    datanova_throttled,
+    lookup_tier,
+    lookup_timed,
+)
+
+
+def enabled() -> bool:
+    return get_setting("CODEPOSTAL_METRICS")
+
+
+def tier(lookup: str, name: str, count: int = 1):
+    """
+    Records that ``count`` items of ``lookup`` were answered by tier ``name``
+    """
+    if count and enabled():
+        lookup_tier.send(sender=None, lookup=lookup, tier=name, count=count)
+
+
+def timed(lookup: str):
+    """
+    Decorator recording the duration of the calls, sync or async
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled():
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _send_timed(lookup, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _send_timed(lookup, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def _send_timed(lookup: str, duration: float):
+    lookup_timed.send(sender=None, lookup=lookup, duration=duration)
+
+
+def throttled(seconds: float):
+    """
+    Records a 429 response, throttling the API calls for ``seconds``
+    """
+    if enabled():
+        datanova_throttled.send(sender=None, seconds=seconds)
+
+
+def rejected():
+    """
+    Records an API call not made because of throttling
+    """
+    if enabled():
+        datanova_rejected.send(sender=None)
+
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+class Registry:
+    """
+    Thread-safe counters and summaries (count and sum) with labels
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[_Labels, float]] = {}
+        self.summaries: Dict[str, Dict[_Labels, list]] = {}
+        self._help: Dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            values = self.summaries.setdefault(name, {}).setdefault(key, [0, 0.0])
+            values[0] += 1
+            values[1] += value
+
+    def get(self, name: str, **labels) -> Optional[float]:
+        return self.counters.get(name, {}).get(tuple(sorted(labels.items())))
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, values in sorted(self.counters.items()):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, values in sorted(self.summaries.items()):
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} summary")
+                for labels, (count, total) in sorted(values.items()):
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: _Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+registry = Registry()
+
+
+def _on_lookup_tier(sender, lookup, tier, count, **kwargs):
+    registry.inc(
+        "codepostal_lookup_tier_total",
+        count,
+        help="Items looked up, by tier that answered",
+        lookup=lookup,
+        tier=tier,
+    )
+
+
+def _on_lookup_timed(sender, lookup, duration, **kwargs):
+    registry.observe(
+        "codepostal_lookup_seconds", duration, help="Duration of lookups", lookup=lookup
+    )
+
+
+def _on_datanova_attempt(sender, status_code, duration, **kwargs):
+    if not enabled():
+        return
+    registry.observe(
+        "codepostal_datanova_request_seconds",
+        duration,
+        help="Duration of the HTTP requests to datanova",
+        status="error" if status_code is None else str(status_code),
+    )
+
+
+def _on_datanova_throttled(sender, seconds, **kwargs):
+    registry.inc(
+        "codepostal_datanova_throttled_total", help="Throttling (429) responses"
+    )
+    registry.inc(
+        "codepostal_datanova_throttled_seconds_total",
+        seconds,
+        help="Time during which API calls were suspended by throttling",
+    )
+
+
+def _on_datanova_rejected(sender, **kwargs):
+    registry.inc(
+        "codepostal_datanova_rejected_total",
+        help="API calls not made because of throttling",
+    )
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dj_codepostal_fr', '0002_codepostalcompletions_codepostallocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodePostalNeighbor',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('distance', models.PositiveIntegerField(help_text='in metres')),
+                ('code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='dj_codepostal_fr.codepostal')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='dj_codepostal_fr.codepostal')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['code', 'distance'], name='dj_codepost_code_id_e0bbb1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('code', 'neighbor'), name='codepostalneighbor_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dj_codepostal_fr', '0003_codepostalneighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Commune',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('insee', models.CharField(db_index=True, help_text='INSEE code', max_length=5)),
+                ('name', models.CharField(max_length=100)),
+                ('longitude', models.FloatField(null=True)),
+                ('latitude', models.FloatField(null=True)),
+                ('postal_code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='communes', to='dj_codepostal_fr.codepostal')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('insee', 'postal_code'), name='commune_unique')],
+            },
+        ),
+    ]
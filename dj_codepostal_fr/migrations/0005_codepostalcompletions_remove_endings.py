@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:19
+
+from django.db import migrations, models
+
+
+def endings_to_codes(apps, schema_editor):
+    """
+    Stores the codes of the comma-separated endings in CodePostal
+    """
+    CodePostal = apps.get_model("dj_codepostal_fr", "CodePostal")
+    CodePostalCompletions = apps.get_model("dj_codepostal_fr", "CodePostalCompletions")
+    codes = [
+        completion.portion + ending
+        for completion in CodePostalCompletions.objects.all()
+        for ending in completion.endings.split(",")
+        if ending
+    ]
+    CodePostal.objects.bulk_create(
+        [CodePostal(code=code) for code in codes],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+def codes_to_endings(apps, schema_editor):
+    CodePostal = apps.get_model("dj_codepostal_fr", "CodePostal")
+    CodePostalCompletions = apps.get_model("dj_codepostal_fr", "CodePostalCompletions")
+    endings = {}
+    for code in CodePostal.objects.order_by("code").values_list("code", flat=True):
+        endings.setdefault(code[:3], []).append(code[3:])
+    for completion in CodePostalCompletions.objects.all():
+        completion.endings = ",".join(endings.get(completion.portion, []))
+        completion.save(update_fields=["endings"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dj_codepostal_fr', '0004_commune'),
+    ]
+
+    operations = [
+        migrations.RunPython(endings_to_codes, codes_to_endings),
+        # lets the column be added back, before codes_to_endings fills it
+        migrations.AlterField(
+            model_name='codepostalcompletions',
+            name='endings',
+            field=models.CharField(default='', help_text='only store last 2 digits', max_length=300),
+        ),
+        migrations.RemoveField(
+            model_name='codepostalcompletions',
+            name='endings',
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def mark_unknown(apps, schema_editor):
+    """
+    Codes stored without coordinates nor commune were reported missing by the
+    API
+    """
+    CodePostal = apps.get_model("dj_codepostal_fr", "CodePostal")
+    CodePostal.objects.filter(
+        codepostallocation__longitude__isnull=True,
+        codepostallocation__isnull=False,
+        communes__isnull=True,
+    ).update(known=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dj_codepostal_fr', '0005_codepostalcompletions_remove_endings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='codepostal',
+            name='known',
+            field=models.BooleanField(default=True, help_text='False for codes missing from the dataset and unknown to the API, e.g. typed in a form'),
+        ),
+        migrations.RunPython(mark_unknown, migrations.RunPython.noop),
+    ]
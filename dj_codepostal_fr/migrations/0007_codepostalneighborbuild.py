@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:03
+
+from django.db import migrations, models
+
+from dj_codepostal_fr.conf import get_setting
+
+
+def record_build(apps, schema_editor):
+    """
+    Tables built before were built with the settings
+    """
+    CodePostalNeighbor = apps.get_model("dj_codepostal_fr", "CodePostalNeighbor")
+    CodePostalNeighborBuild = apps.get_model(
+        "dj_codepostal_fr", "CodePostalNeighborBuild"
+    )
+    if CodePostalNeighbor.objects.exists():
+        CodePostalNeighborBuild.objects.create(
+            count=get_setting("CODEPOSTAL_NEIGHBORS_COUNT"),
+            max_distance=get_setting("CODEPOSTAL_NEIGHBORS_MAX_DISTANCE"),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dj_codepostal_fr', '0006_codepostal_known'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodePostalNeighborBuild',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('count', models.PositiveIntegerField(help_text='neighbors per postal code')),
+                ('max_distance', models.FloatField(help_text='in km')),
+            ],
+        ),
+        migrations.RunPython(record_build, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,71 @@
-from typing import List, Optional
+from typing import Iterable, List, Optional
 from django.db import models
 
 
+class CodePostalManager(models.Manager):
+    def ensure(self, codes: Iterable[str], known: bool = False) -> List["CodePostal"]:
+        """
+        ``CodePostal`` of each of ``codes`` (without duplicates, in their
+        order), creating the missing ones: one query to find them, and one to
+        create them. Creations are not notified as dataset changes: imports
+        and syncs notify theirs.
+
+        The created codes are ``known`` only when the dataset or the API has
+        them; with ``known``, the existing unknown ones are marked known too.
+        """
+        codes = list(dict.fromkeys(codes))
+        if not codes:
+            return []
+        existing = {
+            postal_code.code: postal_code
+            for postal_code in self.filter(code__in=codes)
+        }
+        missing = [
+            self.model(code=code, known=known) for code in codes if code not in existing
+        ]
+        if missing:
+            # concurrent creations are ignored
+            self.bulk_create(missing, ignore_conflicts=True)
+            existing.update((postal_code.code, postal_code) for postal_code in missing)
+        if known:
+            unknown = [code for code in codes if not existing[code].known]
+            if unknown:
+                self.filter(code__in=unknown).update(known=True)
+                for code in unknown:
+                    existing[code].known = True
+        return [existing[code] for code in codes]
+
+
 class CodePostal(models.Model):
     code = models.CharField(primary_key=True, max_length=5)
+    known = models.BooleanField(
+        default=True,
+        help_text="False for codes missing from the dataset and unknown to the API, "
+        "e.g. typed in a form",
+    )
+
+    objects = CodePostalManager()
 
     def __str__(self):
         return self.code
 
+    @classmethod
+    def _starting_with(cls, portion: str) -> models.QuerySet:
+        # a range of the primary key index, whatever the collation (LIKE
+        # queries need a pattern index)
+        codes = cls.objects.filter(code__gte=portion, known=True)
+        if portion.strip("9"):
+            upper = str(int(portion) + 1).zfill(len(portion))
+            codes = codes.filter(code__lt=upper)
+        return codes.order_by("code")
+
+    @classmethod
+    def starting_with(cls, portion: str) -> List[str]:
+        """
+        Known codes starting with ``portion``, sorted
+        """
+        return list(cls._starting_with(portion).values_list("code", flat=True))
+
 
 class CodePostalMany(models.ManyToManyField):
     def __init__(self, *args, **kwargs):
@@ -18,13 +76,27 @@ class CodePostalMany(models.ManyToManyField):
         del kwargs["to"]
         return name, path, args, kwargs
 
+    def formfield(self, **kwargs):
+        from dj_codepostal_fr.fields import MultiplePostalCodesField
+
+        # any existing code, not only the stored ones
+        return models.Field.formfield(
+            self, **{"form_class": MultiplePostalCodesField, **kwargs}
+        )
+
+    def save_form_data(self, instance, data):
+        # unknown codes are created at once
+        getattr(instance, self.attname).set(CodePostal.objects.ensure(data))
+
 
 class CodePostalCompletions(models.Model):
+    """
+    3-digit group whose postal codes are all stored in ``CodePostal``
+    """
 
     portion = models.CharField(
         primary_key=True, max_length=3, help_text="3 first digits"
     )
-    endings = models.CharField(max_length=300, help_text="only store last 2 digits")
 
     def get_completions(self, portion: Optional[str] = None) -> List[str]:
         if portion:
@@ -34,35 +106,40 @@ class CodePostalCompletions(models.Model):
                     "portion argument must start with self.portion. %s does not start with %s"
                     % (portion, self.portion)
                 )
-            if len(portion) > 3:
-                return [
-                    self.portion + ending
-                    for ending in self.endings.split(",")
-                    if ending.startswith(portion[3:])
-                ]
-            # else, default case
+            return CodePostal.starting_with(portion)
         # default case
-        return [self.portion + ending for ending in self.endings.split(",")]
+        return CodePostal.starting_with(self.portion)
 
     @classmethod
     def complete(cls, portion: str) -> List[str]:
         """
         may raise DoesNotExist
         """
-        completion = cls.objects.get(portion=portion[:3])
-        return completion.get_completions(portion)
+        group = cls.objects.filter(portion=portion[:3])
+        # one query, unless there is no code
+        codes = list(
+            CodePostal._starting_with(portion)
+            .filter(models.Exists(group))
+            .values_list("code", flat=True)
+        )
+        if not codes and not group.exists():
+            raise cls.DoesNotExist("no completions stored for %s" % portion[:3])
+        return codes
 
     @classmethod
-    def from_list(cls, portion: str, completions: List[str]):
+    def store(cls, portion: str, completions: List[str]) -> "CodePostalCompletions":
+        """
+        Saves all the codes of the group ``portion``, and marks it as complete
+        """
         if len(portion) != 3:
             raise ValueError("portion parameter must have exactly 3 digits")
-        endings = [code[3:] for code in completions if code.startswith(portion)]
-        if len(endings) != len(completions):
+        if any(not code.startswith(portion) for code in completions):
             raise ValueError(
                 "completions parameter contains codes that do not start with portion"
             )
-        endings = set(endings)  # remove duplicates
-        return cls(portion=portion, endings=",".join(endings))
+        CodePostal.objects.ensure(completions, known=True)
+        completion, _ = cls.objects.get_or_create(portion=portion)
+        return completion
 
 
 class CodePostalLocation(models.Model):
@@ -75,3 +152,64 @@ class CodePostalLocation(models.Model):
     )
     longitude = models.FloatField(null=True)
     latitude = models.FloatField(null=True)
+
+
+class CodePostalNeighbor(models.Model):
+    """
+    One of the nearest postal codes of ``code``, the code itself included,
+    filled by the build_codepostal_neighbors command
+    """
+
+    id = models.AutoField(primary_key=True)
+    code = models.ForeignKey(
+        to=CodePostal, on_delete=models.CASCADE, related_name="neighbors"
+    )
+    neighbor = models.ForeignKey(
+        to=CodePostal, on_delete=models.CASCADE, related_name="+"
+    )
+    distance = models.PositiveIntegerField(help_text="in metres")
+
+    class Meta:
+        indexes = [models.Index(fields=["code", "distance"])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["code", "neighbor"], name="codepostalneighbor_unique"
+            )
+        ]
+
+
+class CodePostalNeighborBuild(models.Model):
+    """
+    Parameters of the last build of the CodePostalNeighbor table: it can only
+    answer the queries within them
+    """
+
+    id = models.AutoField(primary_key=True)
+    count = models.PositiveIntegerField(help_text="neighbors per postal code")
+    max_distance = models.FloatField(help_text="in km")
+
+
+class Commune(models.Model):
+    """
+    A commune served by a postal code, filled from the hexasmal dataset: a
+    commune with several postal codes has one row per code
+    """
+
+    id = models.AutoField(primary_key=True)
+    insee = models.CharField(max_length=5, db_index=True, help_text="INSEE code")
+    name = models.CharField(max_length=100)
+    postal_code = models.ForeignKey(
+        to=CodePostal, on_delete=models.CASCADE, related_name="communes"
+    )
+    longitude = models.FloatField(null=True)
+    latitude = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["insee", "postal_code"], name="commune_unique"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.postal_code_id})"
@@ -0,0 +1,123 @@
+"""
+Precomputed nearest neighbours of each located postal code, stored in
+``CodePostalNeighbor``: a nearby lookup is then one indexed range query.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+
+from dj_codepostal_fr.cache import _cache_key_prefix, cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.index import SpatialIndex
+from dj_codepostal_fr.models import CodePostalNeighbor, CodePostalNeighborBuild
+
+_build_cache_key = _cache_key_prefix + "neighbors_build"
+
+
+def build_neighbors(
+    count: Optional[int] = None,
+    max_dist_km: Optional[float] = None,
+    batch_size: int = 500,
+) -> int:
+    """
+    Replaces the content of ``CodePostalNeighbor`` with the ``count`` nearest
+    codes within ``max_dist_km`` of each located code (defaults:
+    ``CODEPOSTAL_NEIGHBORS_COUNT`` and ``CODEPOSTAL_NEIGHBORS_MAX_DISTANCE``).
+
+    Candidates are read from a grid of the locations, so each code is only
+    compared with the codes of the cells around it. Returns the number of rows.
+    """
+    count = count or get_setting("CODEPOSTAL_NEIGHBORS_COUNT")
+    max_dist_km = max_dist_km or get_setting("CODEPOSTAL_NEIGHBORS_MAX_DISTANCE")
+    index = SpatialIndex()
+    index.load()
+
+    total = 0
+    batch = []
+    with transaction.atomic():
+        CodePostalNeighbor.objects.all().delete()
+        CodePostalNeighborBuild.objects.all().delete()
+        CodePostalNeighborBuild.objects.create(count=count, max_distance=max_dist_km)
+        for code, (lon, lat) in index.items():
+            for neighbor, distance in index.nearby(lon, lat, max_dist_km, limit=count):
+                batch.append(
+                    CodePostalNeighbor(
+                        code_id=code,
+                        neighbor_id=neighbor,
+                        distance=round(distance * 1000),
+                    )
+                )
+            if len(batch) >= batch_size:
+                CodePostalNeighbor.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        CodePostalNeighbor.objects.bulk_create(batch)
+    cache.set(
+        _build_cache_key,
+        (count, max_dist_km),
+        timeout=get_setting("CODEPOSTAL_INDEX_CHECK_INTERVAL"),
+    )
+    return total + len(batch)
+
+
+def _build_parameters() -> Optional[Tuple[int, float]]:
+    """
+    (count, max distance in km) the table was built with, None if never built
+    """
+    parameters = cache.get(_build_cache_key)
+    if parameters is None:
+        build = CodePostalNeighborBuild.objects.first()
+        parameters = (build.count, build.max_distance) if build else False
+        # other processes may rebuild the table
+        cache.set(
+            _build_cache_key,
+            parameters,
+            timeout=get_setting("CODEPOSTAL_INDEX_CHECK_INTERVAL"),
+        )
+    return parameters or None
+
+
+def _usable(dist_km: float, limit: Optional[int]) -> bool:
+    # the table only has the nearest codes within the distance it was built
+    # with, whatever the current settings
+    parameters = _build_parameters()
+    if parameters is None:
+        return False
+    count, max_dist_km = parameters
+    return dist_km <= max_dist_km and (limit is not None and limit <= count)
+
+
+def neighbors(postal_code: str, dist_km: float, limit: int) -> Optional[List[str]]:
+    """
+    Codes within ``dist_km`` of the code, closest first. None when the table
+    cannot answer: not enabled or built, a query wider than the build, or
+    code not in the table.
+    """
+    if not get_setting("CODEPOSTAL_NEIGHBORS") or not _usable(dist_km, limit):
+        return None
+    result = neighbors_many([postal_code], dist_km, limit)
+    return result.get(postal_code)
+
+
+def neighbors_many(
+    postal_codes: Iterable[str], dist_km: float, limit: int = 30
+) -> Dict[str, List[str]]:
+    """
+    Codes within ``dist_km`` of each of the codes found in the table, closest
+    first, with one query.
+    """
+    if not get_setting("CODEPOSTAL_NEIGHBORS") or not _usable(dist_km, limit):
+        return {}
+    result: Dict[str, List[str]] = {}
+    rows = (
+        CodePostalNeighbor.objects.filter(
+            code_id__in=list(postal_codes), distance__lte=dist_km * 1000
+        )
+        .order_by("code_id", "distance")
+        .values_list("code_id", "neighbor_id")
+    )
+    for code, neighbor in rows:
+        codes = result.setdefault(code, [])
+        if len(codes) < limit:
+            codes.append(neighbor)
+    return result
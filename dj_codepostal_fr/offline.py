@@ -0,0 +1,137 @@
+"""
+Offline completion dataset of ``MultiplePostalCodesWithSuggest``: all the
+known postal codes and their locations, in a static JSON file loaded once by
+the browser, which then completes and suggests nearby codes without any
+request to ``codepostal-nearby-select2``.
+
+Codes are sorted and delta-encoded, locations are quantized to
+``1 / scale`` degree and delta-encoded too (``null`` when unknown). The file
+name holds a hash of its content, so that it can be cached forever; the name
+of the latest file is kept in a manifest next to it.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.templatetags.static import static
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation
+
+FORMAT_VERSION = 1
+# about 110 m
+SCALE = 1000
+
+MANIFEST_NAME = "codepostal-offline.json"
+
+# manifest path: (mtime, dataset name)
+_manifests: Dict[str, Tuple[float, Optional[str]]] = {}
+
+
+def _deltas(values: List[Optional[int]]) -> List[Optional[int]]:
+    # None values are kept, and skipped by the deltas
+    result = []
+    previous = 0
+    for value in values:
+        if value is None:
+            result.append(None)
+        else:
+            result.append(value - previous)
+            previous = value
+    return result
+
+
+def build_dataset() -> Dict[str, Any]:
+    locations = {
+        code: (lon, lat)
+        for code, lon, lat in CodePostalLocation.objects.filter(
+            longitude__isnull=False, latitude__isnull=False
+        ).values_list("code", "longitude", "latitude")
+    }
+    codes = sorted(
+        code
+        for code in CodePostal.objects.filter(known=True).values_list(
+            "code", flat=True
+        )
+        if code.isdigit() and len(code) == 5
+    )
+    lons = []
+    lats = []
+    for code in codes:
+        lon, lat = locations.get(code, (None, None))
+        lons.append(None if lon is None else round(lon * SCALE))
+        lats.append(None if lat is None else round(lat * SCALE))
+    return {
+        "format": FORMAT_VERSION,
+        "scale": SCALE,
+        "codes": _deltas([int(code) for code in codes]),
+        "lons": _deltas(lons),
+        "lats": _deltas(lats),
+    }
+
+
+def _write(path: str, content: bytes):
+    # atomic, readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_dataset(directory: Optional[str] = None) -> str:
+    """
+    Writes the dataset to ``directory`` (default
+    ``CODEPOSTAL_OFFLINE_DIR``), and the manifest pointing to it. Returns the
+    path of the dataset.
+    """
+    directory = directory or get_setting("CODEPOSTAL_OFFLINE_DIR")
+    os.makedirs(directory, exist_ok=True)
+    content = json.dumps(build_dataset(), separators=(",", ":")).encode()
+    name = "codepostal-%s.json" % hashlib.sha256(content).hexdigest()[:16]
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        _write(path, content)
+    _write(
+        os.path.join(directory, MANIFEST_NAME),
+        json.dumps({"format": FORMAT_VERSION, "name": name}).encode(),
+    )
+    return path
+
+
+def dataset_name() -> Optional[str]:
+    """
+    Name of the latest dataset written to ``CODEPOSTAL_OFFLINE_DIR``, None
+    without one
+    """
+    directory = get_setting("CODEPOSTAL_OFFLINE_DIR")
+    if not directory:
+        return None
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _manifests.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            with open(path) as f:
+                name = json.load(f).get("name")
+        except (OSError, ValueError):
+            name = None
+        cached = _manifests[path] = (mtime, name)
+    return cached[1]
+
+
+def dataset_url() -> Optional[str]:
+    """
+    URL of the latest dataset: ``CODEPOSTAL_OFFLINE_URL`` followed by its
+    name, or its static URL
+    """
+    name = dataset_name()
+    if name is None:
+        return None
+    base_url = get_setting("CODEPOSTAL_OFFLINE_URL")
+    if base_url:
+        return base_url.rstrip("/") + "/" + name
+    return static(name)
@@ -0,0 +1,104 @@
+"""
+Client-side rate limiting of the datanova calls, shared by all the processes
+through the cache, so that the API quota is never exceeded.
+
+Calls are counted per time window of ``CODEPOSTAL_RATE_LIMIT_WINDOW`` seconds
+with an atomic ``incr``, up to ``CODEPOSTAL_RATE_LIMIT`` calls. Background
+jobs (see ``background``) can only use the part of the budget that is not
+reserved to interactive requests, and wait for the next window instead of
+failing.
+"""
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Tuple
+
+from dj_codepostal_fr.cache import cache
+from dj_codepostal_fr.conf import get_setting
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_key_prefix = "codepostal.ratelimit._AeL3zuay/"
+
+_priority: ContextVar = ContextVar("codepostal_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """
+    Marks the datanova calls made within the block as low priority
+    """
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _budget(priority: str) -> int:
+    limit = get_setting("CODEPOSTAL_RATE_LIMIT")
+    if priority == BACKGROUND:
+        return int(limit * (1 - get_setting("CODEPOSTAL_RATE_LIMIT_RESERVED")))
+    return limit
+
+
+def _window() -> Tuple[str, float, int]:
+    """
+    Cache key of the current window, seconds until the next one, and the
+    timeout of the key
+    """
+    size = get_setting("CODEPOSTAL_RATE_LIMIT_WINDOW")
+    # wall clock: windows must be the same in all processes
+    now = time.time()
+    index = int(now // size)
+    return f"{_key_prefix}{index}", (index + 1) * size - now, int(size) + 1
+
+
+def _try_acquire(priority: str) -> Tuple[bool, float]:
+    key, remaining, timeout = _window()
+    cache.add(key, 0, timeout=timeout)
+    if cache.incr(key) <= _budget(priority):
+        return True, 0
+    # rejected calls do not count
+    cache.decr(key)
+    return False, remaining
+
+
+async def _atry_acquire(priority: str) -> Tuple[bool, float]:
+    key, remaining, timeout = _window()
+    await cache.aadd(key, 0, timeout=timeout)
+    if await cache.aincr(key) <= _budget(priority):
+        return True, 0
+    await cache.adecr(key)
+    return False, remaining
+
+
+def acquire() -> bool:
+    """
+    Counts a call to datanova. Returns False when an interactive call would
+    exceed the limit; background calls wait for the next window instead.
+    """
+    if not get_setting("CODEPOSTAL_RATE_LIMIT"):
+        return True
+    priority = _priority.get()
+    while True:
+        allowed, wait = _try_acquire(priority)
+        if allowed or priority == INTERACTIVE:
+            return allowed
+        time.sleep(wait)
+
+
+async def aacquire() -> bool:
+    """
+    Async version of ``acquire``
+    """
+    if not get_setting("CODEPOSTAL_RATE_LIMIT"):
+        return True
+    priority = _priority.get()
+    while True:
+        allowed, wait = await _atry_acquire(priority)
+        if allowed or priority == INTERACTIVE:
+            return allowed
+        await asyncio.sleep(wait)
@@ -0,0 +1,214 @@
+"""
+Background revalidation of the stale cache values (see
+``CODEPOSTAL_CACHE_FRESHNESS``): they keep being served while a worker
+thread of the process reads them again, with the background priority of
+``ratelimit``. Values of the snapshot, of the stored completions, of
+imported postal codes, of the neighbor table or of the spatial index are read
+again from them: only the other values are fetched again from the API.
+
+A key is revalidated by one process at a time, at most once per
+``CODEPOSTAL_CACHE_ERROR_TTL`` seconds: when the API fails, the stale value
+is kept and served until the next attempt.
+"""
+from collections import defaultdict
+import logging
+import queue
+import threading
+from typing import Iterable, List, Optional, Set
+
+from django.db import connection
+
+from dj_codepostal_fr import ratelimit
+from dj_codepostal_fr.cache import _cache_key_prefix, _kind, cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.db import chunks
+from dj_codepostal_fr.index import current_version
+from dj_codepostal_fr.models import Commune
+from dj_codepostal_fr.neighbors import neighbors
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    _call,
+    _codes_from_records,
+    _fetch_locations,
+    _fetch_nearby,
+    _fetch_nearby_cell,
+    _location_cache_key,
+    _locations_from_db,
+    _locations_from_snapshot,
+    _nearby_from_index,
+    _store_locations,
+    postal_code_location,
+    postal_codes_completion,
+)
+
+logger = logging.getLogger("codepostal.revalidate")
+
+_lock_key_prefix = _cache_key_prefix + "revalidate/"
+
+# prefixes of the cache keys of utils, followed by the lookup parameters
+_completion_prefix = _cache_key_prefix + "complete"
+_location_prefix = _cache_key_prefix + "location"
+_nearby_prefix = _cache_key_prefix + "nearby"
+_nearby_cell_prefix = _cache_key_prefix + "nearby_cell"
+
+# stale keys waiting for the worker
+_queue: "queue.Queue[str]" = queue.Queue()
+_pending: Set[str] = set()
+_lock = threading.Lock()
+_worker: Optional[threading.Thread] = None
+
+# keys revalidated together
+_batch_size = 50
+
+
+def _number(value: str):
+    return int(value) if value.isdigit() else float(value)
+
+
+def _revalidate_completions(keys: List[str]):
+    for key in keys:
+        portion = key[len(_completion_prefix) :]
+        # groups stored by an import, a sync or a previous fetch are read again
+        # from DB
+        if postal_codes_completion._from_db(portion) is not None:
+            continue
+        response = _call(postal_codes_completion._params(portion), key)
+        if response:
+            codes = _codes_from_records(response.json())
+            postal_codes_completion._store(portion, codes)
+
+
+def _revalidate_locations(keys: List[str]):
+    codes = [key[len(_location_prefix) :] for key in keys]
+    found = _locations_from_snapshot(codes)
+    if found:
+        cache.set_many(
+            {_location_cache_key(code): location for code, location in found.items()},
+            timeout=None,
+        )
+    # codes with communes come from an import or a sync, which are kept over
+    # the API
+    imported = (
+        Commune.objects.filter(
+            postal_code__in=[code for code in codes if code not in found]
+        )
+        .values_list("postal_code_id", flat=True)
+        .distinct()
+    )
+    found.update(_locations_from_db(list(imported)))
+    missing = [code for code in codes if code not in found]
+    for chunk in chunks(missing, get_setting("CODEPOSTAL_FETCH_CHUNK_SIZE")):
+        locations = _fetch_locations(chunk, _cache_key_prefix + "multiple_locations")
+        if locations is not None:
+            # codes unknown to the API are stored without coordinates
+            _store_locations({code: locations.get(code) for code in chunk})
+
+
+def _revalidate_nearby(keys: List[str]):
+    version = current_version.get()
+    for key in keys:
+        if key.startswith(_nearby_cell_prefix):
+            key_version, dist_km, cell_degrees, x, y = key[
+                len(_nearby_cell_prefix) :
+            ].split("/")
+            # cells of another version or grid are not read anymore
+            if key_version == version and float(cell_degrees) == get_setting(
+                "CODEPOSTAL_NEARBY_GRID"
+            ):
+                _fetch_nearby_cell(key, _number(dist_km), int(x), int(y))
+            continue
+        key_version, dist_km, lon, lat, postal_code, *limit = key[
+            len(_nearby_prefix) :
+        ].split("/")
+        if key_version != version:
+            continue
+        dist_km = _number(dist_km)
+        limit = int(limit[0]) if limit else 30
+        if postal_code == "None":
+            postal_code, lon, lat = None, float(lon), float(lat)
+
+        result = None
+        if postal_code is not None:
+            result = neighbors(postal_code, dist_km, limit)
+        if result is None and get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+            result = _nearby_from_index(dist_km, lon, lat, postal_code, limit)
+        if result is not None:
+            cache.set(key, result, timeout=None)
+            continue
+
+        if postal_code is not None:
+            location = postal_code_location(postal_code)
+            if not location:
+                continue
+            lon, lat = location["lon"], location["lat"]
+        _fetch_nearby(key, lon, lat, dist_km, limit)
+
+
+_revalidators = {
+    "complete": _revalidate_completions,
+    "location": _revalidate_locations,
+    "nearby": _revalidate_nearby,
+}
+
+
+def revalidate(keys: Iterable[str]):
+    """
+    Fetches the values of the stale ``keys`` again, skipping those being
+    revalidated or recently attempted
+    """
+    by_kind = defaultdict(list)
+    for key in keys:
+        if cache.add(
+            _lock_key_prefix + key,
+            True,
+            timeout=get_setting("CODEPOSTAL_CACHE_ERROR_TTL"),
+        ):
+            by_kind[_kind(key)].append(key)
+    with ratelimit.background():
+        for kind, kind_keys in by_kind.items():
+            try:
+                _revalidators[kind](kind_keys)
+            except DatanovaThrottlingException:
+                # stale values are served until the next attempt
+                logger.warning(
+                    "revalidation of %s %s keys throttled", len(kind_keys), kind
+                )
+                return
+
+
+def _run():
+    while True:
+        keys = [_queue.get()]
+        while len(keys) < _batch_size:
+            try:
+                keys.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            revalidate(keys)
+        except Exception:
+            logger.exception("revalidation failed")
+        finally:
+            with _lock:
+                _pending.difference_update(keys)
+            connection.close()
+            for _ in keys:
+                _queue.task_done()
+
+
+def schedule(keys: Iterable[str]):
+    """
+    Revalidates the stale ``keys`` in the worker thread of the process,
+    started on first use
+    """
+    global _worker
+    with _lock:
+        keys = [key for key in keys if key not in _pending]
+        _pending.update(keys)
+        if keys and _worker is None:
+            _worker = threading.Thread(
+                target=_run, name="codepostal-revalidate", daemon=True
+            )
+            _worker.start()
+    for key in keys:
+        _queue.put(key)
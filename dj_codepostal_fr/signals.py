@@ -0,0 +1,51 @@
+import uuid
+
+from django.core.cache import cache
+from django.dispatch import Signal
+
+# sent when postal codes are added, updated or removed
+dataset_changed = Signal()
+
+# sent after each HTTP attempt to datanova, with attempt, status_code (None on
+# connection errors), duration (seconds) and error
+datanova_attempt = Signal()
+
+# sent with CODEPOSTAL_METRICS only, see the metrics module:
+# - lookup_tier, with lookup, tier and count of the items answered by the tier
+# - lookup_timed, with lookup and duration (seconds)
+# - datanova_throttled on 429 responses, with seconds until the reset time
+# - datanova_rejected, for calls not made because of throttling
+lookup_tier = Signal()
+lookup_timed = Signal()
+datanova_throttled = Signal()
+datanova_rejected = Signal()
+
+_version_cache_key = "codepostal.signals._AeL3zuay/dataset_version"
+
+
+def dataset_version() -> str:
+    """
+    Opaque version of the postal codes dataset, shared by all processes
+    through the cache.
+    """
+    return cache.get_or_set(_version_cache_key, lambda: uuid.uuid4().hex, None)
+
+
+def notify_dataset_changed(sender=None) -> str:
+    version = uuid.uuid4().hex
+    cache.set(_version_cache_key, version, None)
+    dataset_changed.send(sender=sender, version=version)
+    return version
+
+
+def _code_postal_saved(sender, created=False, **kwargs):
+    if created:
+        notify_dataset_changed(sender)
+
+
+def _code_postal_deleted(sender, **kwargs):
+    notify_dataset_changed(sender)
+
+
+def _location_changed(sender, **kwargs):
+    notify_dataset_changed(sender)
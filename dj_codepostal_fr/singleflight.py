@@ -0,0 +1,161 @@
+"""
+Request coalescing for cold cache keys: only one thread of one process
+fetches a given key at a time, the others wait for the value it caches.
+
+In-process callers wait for the outcome of the one fetching the key, failures
+included, rather than fetching again in turn; across processes, the fetching
+worker holds a lock stored in the Django cache with ``cache.add``.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+import uuid
+import weakref
+
+from dj_codepostal_fr.cache import cache
+from dj_codepostal_fr.conf import get_setting
+
+_lock_key_prefix = "codepostal.singleflight._AeL3zuay/"
+
+
+class _Call:
+    """
+    A fetch in progress in this process, whose outcome is shared with the
+    callers waiting for it
+    """
+
+    def __init__(self, done: Union[threading.Event, asyncio.Event]):
+        self.done = done
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+_calls: Dict[str, _Call] = {}
+_calls_guard = threading.Lock()
+# asyncio events are bound to an event loop
+_async_calls = weakref.WeakKeyDictionary()
+
+
+def _release(lock_key: str, token: str):
+    # do not release a lock that expired and was taken by another worker
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def coalesce(cache_key: str, fetch: Callable[[], Any]) -> Any:
+    """
+    Returns the value cached under ``cache_key``, or the result of
+    ``fetch()``, which is expected to cache its result under ``cache_key``.
+
+    ``fetch`` is only run by one caller at a time; the others wait up to
+    ``CODEPOSTAL_SINGLE_FLIGHT_WAIT`` seconds for its outcome in the same
+    process (its result or exception, even a failure), or for the value
+    cached by another process, then fetch it themselves.
+    """
+    if not get_setting("CODEPOSTAL_SINGLE_FLIGHT"):
+        return fetch()
+
+    with _calls_guard:
+        call = _calls.get(cache_key)
+        leader = call is None
+        if leader:
+            call = _calls[cache_key] = _Call(threading.Event())
+    if not leader:
+        if call.done.wait(get_setting("CODEPOSTAL_SINGLE_FLIGHT_WAIT")):
+            return call.outcome()
+        return fetch()
+
+    try:
+        call.result = _fetch_once(cache_key, fetch)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_guard:
+            del _calls[cache_key]
+        call.done.set()
+
+
+def _fetch_once(cache_key: str, fetch: Callable[[], Any]) -> Any:
+    value = cache.get(cache_key)
+    if value is not None:
+        return value
+
+    lock_key = _lock_key_prefix + cache_key
+    token = uuid.uuid4().hex
+    lock_timeout = get_setting("CODEPOSTAL_SINGLE_FLIGHT_LOCK_TIMEOUT")
+    deadline = time.monotonic() + get_setting("CODEPOSTAL_SINGLE_FLIGHT_WAIT")
+    while not cache.add(lock_key, token, timeout=lock_timeout):
+        # another process is fetching
+        if time.monotonic() >= deadline:
+            return fetch()
+        time.sleep(get_setting("CODEPOSTAL_SINGLE_FLIGHT_POLL"))
+        value = cache.get(cache_key)
+        if value is not None:
+            return value
+
+    try:
+        return fetch()
+    finally:
+        _release(lock_key, token)
+
+
+async def acoalesce(cache_key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Async version of ``coalesce``
+    """
+    if not get_setting("CODEPOSTAL_SINGLE_FLIGHT"):
+        return await fetch()
+
+    calls = _async_calls.setdefault(asyncio.get_running_loop(), {})
+    call = calls.get(cache_key)
+    if call is not None:
+        try:
+            await asyncio.wait_for(
+                call.done.wait(), get_setting("CODEPOSTAL_SINGLE_FLIGHT_WAIT")
+            )
+        except asyncio.TimeoutError:
+            return await fetch()
+        return call.outcome()
+
+    call = calls[cache_key] = _Call(asyncio.Event())
+    try:
+        call.result = await _afetch_once(cache_key, fetch)
+        return call.result
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        del calls[cache_key]
+        call.done.set()
+
+
+async def _afetch_once(cache_key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    value = await cache.aget(cache_key)
+    if value is not None:
+        return value
+
+    lock_key = _lock_key_prefix + cache_key
+    token = uuid.uuid4().hex
+    lock_timeout = get_setting("CODEPOSTAL_SINGLE_FLIGHT_LOCK_TIMEOUT")
+    deadline = time.monotonic() + get_setting("CODEPOSTAL_SINGLE_FLIGHT_WAIT")
+    while not await cache.aadd(lock_key, token, timeout=lock_timeout):
+        if time.monotonic() >= deadline:
+            return await fetch()
+        await asyncio.sleep(get_setting("CODEPOSTAL_SINGLE_FLIGHT_POLL"))
+        value = await cache.aget(cache_key)
+        if value is not None:
+            return value
+
+    try:
+        return await fetch()
+    finally:
+        if await cache.aget(lock_key) == token:
+            await cache.adelete(lock_key)
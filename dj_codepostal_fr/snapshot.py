@@ -0,0 +1,230 @@
+"""
+Compact binary snapshot of the postal codes and their locations.
+
+The file is memory-mapped read-only: all the worker processes of a host share
+one copy of it through the page cache, and start without any DB query.
+
+Layout, little-endian:
+
+* header: magic, format version, number of codes, build timestamp;
+* ``uint32`` codes, sorted;
+* ``float32`` longitudes then latitudes of the codes, NaN without location;
+* ``uint32`` offsets of the first code of each 3-digit prefix, 1001 entries.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.models import CodePostal
+
+logger = logging.getLogger("codepostal.snapshot")
+
+_MAGIC = b"CPFRSNAP"
+_FORMAT_VERSION = 1
+# magic, format version, count, build timestamp
+_header = struct.Struct("<8sIIQ")
+_prefixes = 1000
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":  # pragma: no cover
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def build_snapshot(path: str) -> int:
+    """
+    Writes the snapshot of the stored postal codes and locations to ``path``,
+    returns the number of codes.
+
+    The file is replaced atomically: processes using the previous one keep
+    reading it until they reload.
+    """
+    codes = array("I")
+    lons = array("f")
+    lats = array("f")
+    offsets = array("I", [0] * (_prefixes + 1))
+    nan = float("nan")
+    rows = (
+        CodePostal.objects.filter(known=True)
+        .order_by("code")
+        .values_list(
+            "code", "codepostallocation__longitude", "codepostallocation__latitude"
+        )
+    )
+    for code, lon, lat in rows:
+        if len(code) != 5 or not code.isdigit():
+            logger.warning("postal code %r not included in the snapshot", code)
+            continue
+        codes.append(int(code))
+        lons.append(nan if lon is None else lon)
+        lats.append(nan if lat is None else lat)
+        offsets[int(code[:3]) + 1] += 1
+    # counts to cumulated offsets
+    for prefix in range(_prefixes):
+        offsets[prefix + 1] += offsets[prefix]
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_header.pack(_MAGIC, _FORMAT_VERSION, len(codes), int(time.time())))
+        for values in (codes, lons, lats, offsets):
+            f.write(_little_endian(values))
+    os.replace(tmp_path, path)
+    return len(codes)
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot file. Lookups read the mapped arrays in
+    place, nothing is copied to the process memory.
+    """
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":  # pragma: no cover
+            raise SnapshotError("snapshots can only be mapped on little-endian hosts")
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.count, self.built_at = _header.unpack_from(self._mmap)
+        except struct.error:
+            raise SnapshotError(f"{path} is not a postal code snapshot")
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise SnapshotError(f"{path} is not a version {_FORMAT_VERSION} snapshot")
+        expected_size = _header.size + 4 * (3 * self.count + _prefixes + 1)
+        if len(self._mmap) != expected_size:
+            raise SnapshotError(f"{path} is truncated")
+
+        view = memoryview(self._mmap)
+        position = _header.size
+        arrays = []
+        for typecode, size in (
+            ("I", self.count),
+            ("f", self.count),
+            ("f", self.count),
+            ("I", _prefixes + 1),
+        ):
+            arrays.append(view[position : position + 4 * size].cast(typecode))
+            position += 4 * size
+        self._codes, self._lons, self._lats, self._offsets = arrays
+
+    def close(self):
+        for values in (self._codes, self._lons, self._lats, self._offsets):
+            values.release()
+        self._mmap.close()
+
+    def _range(self, code_portion: str) -> Tuple[int, int]:
+        # the offsets table narrows the search to the 3-digit prefixes
+        start = self._offsets[int(code_portion[:3].ljust(3, "0"))]
+        end = self._offsets[int(code_portion[:3].ljust(3, "9")) + 1]
+        if len(code_portion) > 3:
+            start = bisect_left(self._codes, int(code_portion.ljust(5, "0")), start, end)
+            end = bisect_right(self._codes, int(code_portion.ljust(5, "9")), start, end)
+        return start, end
+
+    def _position(self, code: str) -> Optional[int]:
+        if len(code) != 5 or not code.isdigit():
+            return None
+        start, end = self._range(code)
+        return start if start < end else None
+
+    def complete(self, code_portion: str) -> List[str]:
+        """
+        All the codes starting with ``code_portion`` (1 to 5 digits), sorted.
+        """
+        if not code_portion.isdigit() or len(code_portion) > 5:
+            return []
+        start, end = self._range(code_portion)
+        return [f"{code:05d}" for code in self._codes[start:end]]
+
+    def location(self, code: str) -> Optional[Tuple[float, float]]:
+        """
+        (lon, lat) of the code, None if not known
+        """
+        position = self._position(code)
+        if position is None:
+            return None
+        lon = self._lons[position]
+        if lon != lon:
+            # NaN
+            return None
+        return lon, self._lats[position]
+
+    def __contains__(self, code: str) -> bool:
+        return self._position(code) is not None
+
+    def __len__(self) -> int:
+        return self.count
+
+
+_snapshot: Optional[Snapshot] = None
+# (path, inode, mtime) of the mapped file
+_snapshot_id = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _file_id(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, stat.st_ino, stat.st_mtime_ns
+
+
+def get_snapshot() -> Optional[Snapshot]:
+    """
+    The snapshot at ``CODEPOSTAL_SNAPSHOT_PATH``, None when not configured or
+    not readable. A rebuilt file is mapped again within
+    ``CODEPOSTAL_INDEX_CHECK_INTERVAL`` seconds.
+    """
+    global _snapshot, _snapshot_id, _checked_at
+    path = get_setting("CODEPOSTAL_SNAPSHOT_PATH")
+    if not path:
+        return None
+    now = time.monotonic()
+    if (
+        _snapshot_id is not None
+        and _snapshot_id[0] == path
+        and now - _checked_at < get_setting("CODEPOSTAL_INDEX_CHECK_INTERVAL")
+    ):
+        return _snapshot
+
+    with _lock:
+        _checked_at = now
+        file_id = _file_id(path)
+        if file_id != _snapshot_id:
+            # the previous mapping is left to the garbage collector, other
+            # threads may still be reading it
+            _snapshot = None
+            _snapshot_id = file_id
+            if file_id[1] is not None:
+                try:
+                    _snapshot = Snapshot(path)
+                except (OSError, ValueError, SnapshotError) as e:
+                    logger.error("cannot load postal code snapshot: %s", e)
+            else:
+                logger.warning("postal code snapshot %s not found", path)
+    return _snapshot
+
+
+def reset_snapshot():
+    """
+    Forgets the mapped snapshot, it is loaded again on next call.
+    """
+    global _snapshot, _snapshot_id
+    with _lock:
+        _snapshot = None
+        _snapshot_id = None
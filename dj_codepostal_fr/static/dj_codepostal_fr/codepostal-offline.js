@@ -0,0 +1,162 @@
+/* global jQuery */
+/*
+ * Offline completion of MultiplePostalCodesWithSuggest: the widgets with a
+ * data-codepostal-offline attribute load the dataset written by the
+ * build_codepostal_offline command once, then answer select2 queries in the
+ * browser like codepostal-nearby-select2 does. The server is only queried
+ * when the dataset cannot be loaded.
+ *
+ * Must be loaded after django_select2.js, and before the page is ready.
+ */
+(($ => {
+  'use strict'
+
+  // default distance (km) and number of the nearby suggestions per selected
+  // code, as area_view; widgets render the configured ones
+  const NEARBY_DISTANCE = 10
+  const NEARBY_LIMIT = 30
+  const NEARBY_SOURCES = 5
+  const EARTH_RADIUS_KM = 6371.0
+
+  const datasets = {}
+
+  const undelta = (deltas, scale) => {
+    const values = new Array(deltas.length)
+    let previous = 0
+    for (let i = 0; i < deltas.length; i++) {
+      if (deltas[i] === null) {
+        values[i] = null
+      } else {
+        previous += deltas[i]
+        values[i] = scale ? previous / scale : previous
+      }
+    }
+    return values
+  }
+
+  const decode = data => {
+    const codes = undelta(data.codes).map(code => String(code).padStart(5, '0'))
+    const lons = undelta(data.lons, data.scale)
+    const lats = undelta(data.lats, data.scale)
+    const positions = {}
+    codes.forEach((code, i) => { positions[code] = i })
+    return { codes, lons, lats, positions }
+  }
+
+  const load = url => {
+    if (!datasets[url]) {
+      // the file name changes with its content: the browser may cache it
+      datasets[url] = $.ajax({ url, dataType: 'json', cache: true }).then(decode)
+      // try again on the next query
+      datasets[url].fail(() => { delete datasets[url] })
+    }
+    return datasets[url]
+  }
+
+  // first position of the codes >= prefix
+  const lowerBound = (codes, prefix) => {
+    let low = 0
+    let high = codes.length
+    while (low < high) {
+      const middle = (low + high) >> 1
+      if (codes[middle] < prefix) low = middle + 1
+      else high = middle
+    }
+    return low
+  }
+
+  const complete = (dataset, term) => {
+    const result = []
+    for (let i = lowerBound(dataset.codes, term); i < dataset.codes.length; i++) {
+      if (!dataset.codes[i].startsWith(term)) break
+      result.push(dataset.codes[i])
+    }
+    return result
+  }
+
+  const radians = degrees => degrees * Math.PI / 180
+
+  const haversine = (lon1, lat1, lon2, lat2) => {
+    const dlat = radians(lat2 - lat1)
+    const dlon = radians(lon2 - lon1)
+    const a = Math.sin(dlat / 2) ** 2 +
+      Math.cos(radians(lat1)) * Math.cos(radians(lat2)) * Math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * Math.asin(Math.sqrt(a))
+  }
+
+  // codes within distance of any of the selected codes, closest first
+  const nearby = (dataset, selected, distance = NEARBY_DISTANCE, limit = NEARBY_LIMIT) => {
+    const sources = selected.slice(-NEARBY_SOURCES)
+      .map(code => dataset.positions[code])
+      .filter(i => i !== undefined && dataset.lons[i] !== null)
+    const distances = {}
+    sources.forEach(source => {
+      const lon = dataset.lons[source]
+      const lat = dataset.lats[source]
+      // 1 degree of latitude is about 111 km: skip far codes cheaply
+      const span = distance / 111
+      for (let i = 0; i < dataset.codes.length; i++) {
+        if (dataset.lats[i] === null || Math.abs(dataset.lats[i] - lat) > span) continue
+        const d = haversine(lon, lat, dataset.lons[i], dataset.lats[i])
+        if (d <= distance && !(distances[dataset.codes[i]] <= d)) {
+          distances[dataset.codes[i]] = d
+        }
+      }
+    })
+    return Object.keys(distances)
+      .sort((a, b) => distances[a] - distances[b])
+      .slice(0, limit * sources.length)
+  }
+
+  // same results as complete_and_suggest
+  const suggest = (dataset, selected, term, distance, limit) => {
+    const results = []
+    const item = code => ({ id: code, text: code })
+    if (term.length >= 3) {
+      const completion = complete(dataset, term)
+      if (completion.length) {
+        completion.filter(code => !selected.includes(code))
+          .forEach(code => results.push(item(code)))
+      } else {
+        results.push({ text: 'Aucun code postal ne correspond', children: [] })
+      }
+    }
+    if (selected.length) {
+      const children = nearby(dataset, selected, distance, limit)
+        .filter(code => (!term || code.startsWith(term)) && !selected.includes(code))
+        .map(item)
+      if (children.length) {
+        results.push({ text: 'À proximité', children })
+      }
+    }
+    return results
+  }
+
+  const transport = (url, distance, limit) => function (params, success, failure) {
+    const data = params.data || {}
+    const selected = [].concat(data.postal_codes || []).map(code => code.trim())
+      .filter(code => code)
+    const term = (data.term || '').trim()
+    const request = load(url)
+      .then(dataset => success({ results: suggest(dataset, selected, term, distance, limit) }))
+    // fallback: codepostal-nearby-select2
+    request.fail(() => $.ajax(params).then(success, failure))
+    return { abort: () => {} }
+  }
+
+  const select2 = $.fn.select2
+  $.fn.select2 = function (options) {
+    const url = this.attr('data-codepostal-offline')
+    if (url && options && typeof options === 'object' && options.ajax) {
+      const distance = Number(this.attr('data-codepostal-nearby-distance')) || NEARBY_DISTANCE
+      const limit = Number(this.attr('data-codepostal-nearby-limit')) || NEARBY_LIMIT
+      options = $.extend(true, {}, options, {
+        ajax: { transport: transport(url, distance, limit) }
+      })
+    }
+    return select2.call(this, options)
+  }
+  $.extend($.fn.select2, select2)
+
+  $.fn.codepostalOffline = { decode, suggest }
+})(globalThis.jQuery || globalThis.django.jQuery))
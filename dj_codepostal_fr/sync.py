@@ -0,0 +1,394 @@
+"""
+Incremental sync of the stored dataset with a new export of hexasmal.
+
+Each postal code of the export and of the DB is summarized by a hash of its
+content (location and communes): only the codes whose hash differs are
+inserted, updated or retired, in one transaction. Retired codes are kept,
+as records may reference them, but are no longer known: they lose their
+location and communes, and are neither completed nor suggested. Then only
+the cache keys they affect are refreshed: the completions of their 3-digit
+groups and their locations. Nearby suggestions are cached under the dataset
+version, which the sync changes.
+
+``sync_source`` reads the export from a file or a URL (e.g. the CSV export of
+the dataset, or JSON pages of the API); ``start_sync`` runs it periodically
+in a daemon thread.
+"""
+from collections import defaultdict
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from dj_codepostal_fr import datanova
+from dj_codepostal_fr.cache import _cache_key_prefix, cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.db import bulk_upsert, chunks
+from dj_codepostal_fr.hexasmal import _aggregate, guess_format, iter_records
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+    CodePostalNeighbor,
+    Commune,
+)
+from dj_codepostal_fr.neighbors import build_neighbors
+from dj_codepostal_fr.signals import notify_dataset_changed
+from dj_codepostal_fr.utils import _completion_cache_key, _location_cache_key
+
+logger = logging.getLogger("codepostal.sync")
+
+_lock_cache_key = _cache_key_prefix + "sync"
+
+_Location = Tuple[Optional[float], Optional[float]]
+
+
+class SyncError(Exception):
+    pass
+
+
+class _Content(NamedTuple):
+    location: _Location
+    # (insee, name, lon, lat), sorted
+    communes: Tuple[Tuple[str, str, Optional[float], Optional[float]], ...]
+
+    def hash(self) -> str:
+        content = [
+            _rounded(self.location),
+            [
+                [insee, name, *_rounded((lon, lat))]
+                for insee, name, lon, lat in self.communes
+            ],
+        ]
+        return hashlib.sha1(
+            json.dumps(content, separators=(",", ":")).encode()
+        ).hexdigest()
+
+
+def _rounded(location: _Location) -> _Location:
+    # stored floats may differ in their last digits
+    return tuple(None if value is None else round(value, 6) for value in location)
+
+
+def _export_contents(
+    records: Iterable[Dict[str, Any]]
+) -> Tuple[Dict[str, _Content], int]:
+    aggregate = _aggregate(records)
+    communes = defaultdict(list)
+    for (insee, code), accumulator in aggregate.communes.items():
+        communes[code].append(
+            (insee, aggregate.commune_names[insee, code], *accumulator.centroid())
+        )
+    contents = {
+        code: _Content(accumulator.centroid(), tuple(sorted(communes[code])))
+        for code, accumulator in aggregate.codes.items()
+    }
+    return contents, aggregate.rows
+
+
+def _stored_contents() -> Tuple[Dict[str, _Content], Dict[Tuple[str, str], int]]:
+    """
+    Contents of the known stored codes, and ids of the stored communes by
+    (insee, postal code)
+    """
+    locations = {
+        code: (lon, lat)
+        for code, lon, lat in CodePostalLocation.objects.values_list(
+            "code", "longitude", "latitude"
+        )
+    }
+    communes = defaultdict(list)
+    commune_ids = {}
+    for id, insee, name, code, lon, lat in Commune.objects.values_list(
+        "id", "insee", "name", "postal_code", "longitude", "latitude"
+    ):
+        communes[code].append((insee, name, lon, lat))
+        commune_ids[insee, code] = id
+    contents = {
+        code: _Content(locations.get(code, (None, None)), tuple(sorted(communes[code])))
+        for code in CodePostal.objects.filter(known=True).values_list(
+            "code", flat=True
+        )
+    }
+    return contents, commune_ids
+
+
+class Changes(NamedTuple):
+    inserted: List[str]
+    updated: List[str]
+    retired: List[str]
+    unchanged: int
+
+
+def diff(new: Dict[str, _Content], stored: Dict[str, _Content]) -> Changes:
+    """
+    Codes of ``new`` missing from ``stored``, with another content, and codes
+    of ``stored`` missing from ``new``
+    """
+    stored_hashes = {code: content.hash() for code, content in stored.items()}
+    inserted = []
+    updated = []
+    for code in sorted(new):
+        if code not in stored_hashes:
+            inserted.append(code)
+        elif new[code].hash() != stored_hashes[code]:
+            updated.append(code)
+    retired = sorted(stored.keys() - new.keys())
+    return Changes(inserted, updated, retired, len(new) - len(inserted) - len(updated))
+
+
+def _apply(
+    changes: Changes,
+    new: Dict[str, _Content],
+    stored: Dict[str, _Content],
+    commune_ids: Dict[Tuple[str, str], int],
+    batch_size: int,
+):
+    written = changes.inserted + changes.updated
+    with transaction.atomic():
+        # codes stored as unknown before are known from now on
+        bulk_upsert(
+            CodePostal,
+            [CodePostal(code=code, known=True) for code in changes.inserted],
+            ["known"],
+            batch_size,
+        )
+        CodePostalCompletions.objects.bulk_create(
+            [
+                CodePostalCompletions(portion=portion)
+                for portion in sorted({code[:3] for code in changes.inserted})
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        bulk_upsert(
+            CodePostalLocation,
+            [
+                CodePostalLocation(
+                    code_id=code,
+                    longitude=new[code].location[0],
+                    latitude=new[code].location[1],
+                )
+                for code in written
+            ],
+            ["longitude", "latitude"],
+            batch_size,
+        )
+        bulk_upsert(
+            Commune,
+            [
+                Commune(
+                    insee=insee,
+                    name=name,
+                    postal_code_id=code,
+                    longitude=lon,
+                    latitude=lat,
+                )
+                for code in written
+                for insee, name, lon, lat in new[code].communes
+            ],
+            ["name", "longitude", "latitude"],
+            batch_size,
+            unique_fields=["insee", "postal_code"],
+        )
+        removed_communes = [
+            commune_ids[insee, code]
+            for code in changes.updated
+            for insee in (
+                {commune[0] for commune in stored[code].communes}
+                - {commune[0] for commune in new[code].communes}
+            )
+        ]
+        for chunk in chunks(removed_communes, batch_size):
+            Commune.objects.filter(id__in=chunk).delete()
+        # not deleted: the CodePostalMany fields may reference them
+        for chunk in chunks(changes.retired, batch_size):
+            CodePostal.objects.filter(code__in=chunk).update(known=False)
+            CodePostalLocation.objects.filter(code__in=chunk).update(
+                longitude=None, latitude=None
+            )
+            Commune.objects.filter(postal_code__in=chunk).delete()
+            CodePostalNeighbor.objects.filter(
+                Q(code__in=chunk) | Q(neighbor__in=chunk)
+            ).delete()
+
+
+def _refresh_cache(
+    changes: Changes,
+    new: Dict[str, _Content],
+    stored: Dict[str, _Content],
+    codes: Set[str],
+    batch_size: int,
+) -> Tuple[int, bool]:
+    """
+    Writes the locations and completions changed by the sync to the cache.
+    Returns the number of written keys, and whether locations changed.
+    """
+    written = changes.inserted + changes.updated
+    for chunk in chunks(written + changes.retired, batch_size):
+        cache.set_many(
+            {
+                _location_cache_key(code): (
+                    {"lon": new[code].location[0], "lat": new[code].location[1]}
+                    if code in new and None not in new[code].location
+                    else False
+                )
+                for code in chunk
+            },
+            timeout=None,
+        )
+    groups = sorted({code[:3] for code in changes.inserted + changes.retired})
+    group_codes = defaultdict(list)
+    for code in sorted(codes):
+        if code[:3] in groups:
+            group_codes[code[:3]].append(code)
+    cache.set_many(
+        {_completion_cache_key(group): group_codes[group] for group in groups},
+        timeout=None,
+    )
+
+    moved = any(
+        (_rounded(stored[code].location) if code in stored else (None, None))
+        != (_rounded(new[code].location) if code in new else (None, None))
+        for code in written + changes.retired
+    )
+    return len(written) + len(changes.retired) + len(groups), moved
+
+
+def sync_records(
+    records: Iterable[Dict[str, Any]],
+    batch_size: int = 500,
+    retire: bool = True,
+    max_retired: Optional[float] = None,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Applies the differences between normalized hexasmal records (see
+    ``hexasmal.iter_records``) and the stored dataset.
+
+    Known codes missing from the records are retired with ``retire``, unless
+    they are more than ``max_retired`` (default
+    ``CODEPOSTAL_SYNC_MAX_RETIRED``) of the known codes: ``SyncError`` is
+    then raised, as the export is probably truncated. With ``dry_run``,
+    nothing is written.
+
+    Returns the number of read rows, of inserted, updated, retired and
+    unchanged codes, of refreshed cache keys, and the duration in seconds.
+    """
+    start = time.monotonic()
+    if max_retired is None:
+        max_retired = get_setting("CODEPOSTAL_SYNC_MAX_RETIRED")
+    new, rows = _export_contents(records)
+    if not new:
+        raise SyncError("no postal codes in the export")
+    stored, commune_ids = _stored_contents()
+    changes = diff(new, stored)
+    if not retire:
+        changes = changes._replace(retired=[])
+    elif len(changes.retired) > max_retired * len(stored):
+        raise SyncError(
+            "%s of the %s known postal codes would be retired"
+            % (len(changes.retired), len(stored))
+        )
+
+    stats = {
+        "rows": rows,
+        "inserted": len(changes.inserted),
+        "updated": len(changes.updated),
+        "retired": len(changes.retired),
+        "unchanged": changes.unchanged,
+        "cache_keys": 0,
+    }
+    if not dry_run and (changes.inserted or changes.updated or changes.retired):
+        _apply(changes, new, stored, commune_ids, batch_size)
+        codes = (stored.keys() | new.keys()) - set(changes.retired)
+        stats["cache_keys"], moved = _refresh_cache(
+            changes, new, stored, codes, batch_size
+        )
+        if moved and get_setting("CODEPOSTAL_NEIGHBORS"):
+            build_neighbors(batch_size=batch_size)
+        notify_dataset_changed()
+
+    stats["seconds"] = time.monotonic() - start
+    logger.info(
+        "synced %(rows)s rows: %(inserted)s inserted, %(updated)s updated, "
+        "%(retired)s retired, %(unchanged)s unchanged postal codes",
+        stats,
+    )
+    return stats
+
+
+def _open(source: str, encoding: str) -> io.TextIOBase:
+    if source.startswith(("http://", "https://")):
+        response = datanova.get_session().get(
+            source,
+            stream=True,
+            timeout=(
+                get_setting("CODEPOSTAL_HTTP_CONNECT_TIMEOUT"),
+                get_setting("CODEPOSTAL_HTTP_READ_TIMEOUT"),
+            ),
+        )
+        response.raise_for_status()
+        # gzip and deflate responses
+        response.raw.decode_content = True
+        return io.TextIOWrapper(response.raw, encoding=encoding, newline="")
+    return open(source, encoding=encoding, newline="")
+
+
+def sync_source(
+    source: Optional[str] = None,
+    format: Optional[str] = None,
+    encoding: str = "utf-8-sig",
+    **kwargs,
+) -> Dict[str, Any]:
+    """
+    ``sync_records`` from the file or URL ``source`` (default
+    ``CODEPOSTAL_SYNC_SOURCE``), in ``format`` (guessed from its extension
+    by default)
+    """
+    source = source or get_setting("CODEPOSTAL_SYNC_SOURCE")
+    if not source:
+        raise SyncError("no source to sync from")
+    with _open(source, encoding) as stream:
+        return sync_records(
+            iter_records(stream, format or guess_format(source.split("?")[0])),
+            **kwargs,
+        )
+
+
+def _sync_once(interval: float):
+    # once per interval for all the processes
+    if not cache.add(_lock_cache_key, True, timeout=interval):
+        return
+    try:
+        sync_source()
+    except Exception:
+        # e.g. a malformed export: the next interval syncs again
+        logger.exception("sync failed")
+    finally:
+        connection.close()
+
+
+def start_sync(
+    interval: Optional[float] = None, stop: Optional[threading.Event] = None
+) -> threading.Thread:
+    """
+    Syncs from ``CODEPOSTAL_SYNC_SOURCE`` every ``interval`` seconds (default
+    ``CODEPOSTAL_SYNC_INTERVAL``) in a daemon thread, until ``stop`` is set
+    """
+    interval = interval or get_setting("CODEPOSTAL_SYNC_INTERVAL")
+    stop = stop or threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            _sync_once(interval)
+
+    thread = threading.Thread(target=run, name="codepostal-sync", daemon=True)
+    thread.start()
+    return thread
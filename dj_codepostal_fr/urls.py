@@ -1,6 +1,14 @@
 from django.urls import path
-from .views import area_view
+
+from .conf import get_setting
+from .views import area_view, async_area_view, communes_view, metrics_view
 
 urlpatterns = [
-    path("codepostal/nearby/", area_view, name="codepostal-nearby-select2"),
+    path(
+        "codepostal/nearby/",
+        async_area_view if get_setting("CODEPOSTAL_ASYNC_VIEWS") else area_view,
+        name="codepostal-nearby-select2",
+    ),
+    path("codepostal/communes/", communes_view, name="codepostal-communes-select2"),
+    path("codepostal/metrics/", metrics_view, name="codepostal-metrics"),
 ]
@@ -1,24 +1,71 @@
 from collections import defaultdict
 from datetime import datetime
+from functools import partial
 import logging
+from math import ceil, floor
 from pytz import UTC
 import re
 import requests
-from typing import Any, Dict, List, Optional, Union
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
-from django.core.cache import cache
 from django.utils.dateparse import parse_datetime
 
+from dj_codepostal_fr import datanova, metrics, ratelimit
+from dj_codepostal_fr.cache import _cache_key_prefix, cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.db import bulk_upsert, chunks
+from dj_codepostal_fr.geo import haversine_km
+from dj_codepostal_fr.index import current_version, prefix_index, spatial_index
 from dj_codepostal_fr.models import (
     CodePostal,
     CodePostalCompletions,
     CodePostalLocation,
 )
+from dj_codepostal_fr.neighbors import neighbors, neighbors_many
+from dj_codepostal_fr.signals import notify_dataset_changed
+from dj_codepostal_fr.singleflight import coalesce
+from dj_codepostal_fr.snapshot import get_snapshot
 
 logger = logging.getLogger("codepostal.utils")
 
-# some meaningfull text and a random string
-_cache_key_prefix = "codepostal.utils._AeL3zuay"
+
+
+def _location_cache_key(postal_code: str) -> str:
+    return _cache_key_prefix + "location" + postal_code
+
+
+def _nearby_cache_key(
+    dist_km: int,
+    lon: Optional[float],
+    lat: Optional[float],
+    postal_code: Optional[str],
+    limit: int = 30,
+) -> str:
+    # under the dataset version: its changes leave all the previous suggestions
+    # behind, whatever their distance, limit or point
+    cache_key = (
+        _cache_key_prefix
+        + "nearby"
+        + f"{current_version.get()}/{dist_km}/{lon}/{lat}/{postal_code}"
+    )
+    if limit != 30:
+        cache_key += f"/{limit}"
+    return cache_key
+
+
+def _nearby_cell_cache_key(dist_km: float, x: int, y: int) -> str:
+    cell_degrees = get_setting("CODEPOSTAL_NEARBY_GRID")
+    return (
+        _cache_key_prefix
+        + "nearby_cell"
+        + f"{current_version.get()}/{dist_km}/{cell_degrees}/{x}/{y}"
+    )
+
+
+def _completion_cache_key(code_portion: str) -> str:
+    # completions are cached by 3 first digits
+    return _cache_key_prefix + "complete" + code_portion[:3]
 
 
 class DatanovaThrottlingException(RuntimeError):
@@ -35,193 +82,687 @@ def _handle_api_errors(
         # too many requests / throttling:
         # store False with timeout matching the throttling reset time
         reset_time = parse_datetime(response.json().get("reset_time", ""))
-        timeout = reset_time - datetime.now(UTC)
-        cache.set(
-            _cache_key_prefix + "/datanova_throttled", True, timeout=timeout.seconds + 1
-        )
+        # a reset time already passed gives a negative timedelta
+        timeout = max(int((reset_time - datetime.now(UTC)).total_seconds()), 0) + 1
+        cache.set(_throttled_cache_key, True, timeout=timeout)
+        metrics.throttled(timeout)
         raise DatanovaThrottlingException()
 
     # default
     logger.error(
         "%s: error %s: %s", response.url, response.status_code, response.json()
     )
-    cache.set(cache_key, False)  # use default timeout, store False
+    # short-lived, and keeps a stale value being revalidated
+    cache.add(cache_key, False, timeout=get_setting("CODEPOSTAL_CACHE_ERROR_TTL"))
     return False
 
 
+_throttled_cache_key = _cache_key_prefix + "/datanova_throttled"
+
+
+@metrics.timed("datanova")
 def _call(params, cache_key):
-    if cache.get(_cache_key_prefix + "/datanova_throttled"):
+    if cache.get(_throttled_cache_key) or not ratelimit.acquire():
+        metrics.rejected()
         raise DatanovaThrottlingException()
 
-    response = _handle_api_errors(
-        requests.get(
-            "https://datanova.laposte.fr/api/v2/catalog/datasets/laposte_hexasmal/records",
-            params=params,
-        ),
-        cache_key,
-    )
-    return response
+    try:
+        response = datanova.get(params)
+    except requests.RequestException as e:
+        # not cached: may be transient
+        logger.error("datanova request failed: %s", e)
+        return False
+
+    return _handle_api_errors(response, cache_key)
+
+
+def _codes_from_records(json: Dict[str, Any]) -> List[str]:
+    return [record["record"]["fields"]["code_postal"] for record in json["records"]]
 
 
+def _nearby_params(
+    lon: float, lat: float, dist_km: int, limit: int, offset: int = 0
+) -> Dict[str, Any]:
+    return {
+        "where": f'distance(coordonnees_gps,geom\'{{"type": "Point","coordinates":[{lon},{lat}]}}\',{dist_km}km)',
+        "group_by": "code_postal",
+        "limit": limit,
+        "offset": offset,
+        "timezone": "UTC",
+    }
+
+
+def _fetch_nearby(
+    cache_key: str, lon: float, lat: float, dist_km: int, limit: int
+) -> Optional[List[str]]:
+    response = _call(_nearby_params(lon, lat, dist_km, limit), cache_key)
+    if not response:
+        metrics.tier("nearby", "error")
+        return None
+    else:
+        metrics.tier("nearby", "api")
+        result = _codes_from_records(response.json())
+        cache.set(cache_key, result, timeout=None)
+        return result
+
+
+def _nearby_settings(
+    dist_km: Optional[float], limit: Optional[int]
+) -> Tuple[float, int]:
+    if dist_km is None:
+        dist_km = get_setting("CODEPOSTAL_NEARBY_DISTANCE")
+    if limit is None:
+        limit = get_setting("CODEPOSTAL_NEARBY_LIMIT")
+    return dist_km, limit
+
+
+def _grid_cell(lon: float, lat: float) -> Tuple[int, int]:
+    cell_degrees = get_setting("CODEPOSTAL_NEARBY_GRID")
+    return floor(lon / cell_degrees), floor(lat / cell_degrees)
+
+
+def _fetch_nearby_cell(
+    cache_key: str, dist_km: float, x: int, y: int
+) -> Optional[List[Tuple[str, float, float]]]:
+    """
+    (code, lon, lat) of the located codes within ``dist_km`` of any point of
+    the grid cell: one API query around its center, covering its corners,
+    following the pagination.
+    """
+    cell_degrees = get_setting("CODEPOSTAL_NEARBY_GRID")
+    lon = round((x + 0.5) * cell_degrees, 6)
+    lat = round((y + 0.5) * cell_degrees, 6)
+    # the corners closest to the equator are the farthest from the center
+    corner_lat = y * cell_degrees if lat >= 0 else (y + 1) * cell_degrees
+    radius = ceil(dist_km + haversine_km(lon, lat, x * cell_degrees, corner_lat))
+    codes = []
+    offset = 0
+    while offset is not None:
+        response = _call(
+            _nearby_params(lon, lat, radius, _page_size, offset), cache_key
+        )
+        if not response:
+            metrics.tier("nearby", "error")
+            return None
+        json = response.json()
+        codes += _codes_from_records(json)
+        offset = _next_offset(json, offset)
+    metrics.tier("nearby", "api")
+    locations = postal_code_locations(codes)
+    result = [
+        (code, location["lon"], location["lat"])
+        for code, location in locations.items()
+        if location
+    ]
+    cache.set(cache_key, result, timeout=None)
+    return result
+
+
+def _nearby_from_grid(
+    dist_km: float, lon: float, lat: float, limit: int
+) -> Optional[List[str]]:
+    """
+    Codes within ``dist_km`` of the point, closest first, filtered from the
+    cached neighbors of its grid cell.
+    """
+    x, y = _grid_cell(lon, lat)
+    cache_key = _nearby_cell_cache_key(dist_km, x, y)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        metrics.tier("nearby", "cache")
+    else:
+        cached = coalesce(
+            cache_key, partial(_fetch_nearby_cell, cache_key, dist_km, x, y)
+        )
+    if cached is None:
+        return None
+    return _nearest(cached, dist_km, lon, lat, limit)
+
+
+def _nearest(
+    cell: List[Tuple[str, float, float]],
+    dist_km: float,
+    lon: float,
+    lat: float,
+    limit: int,
+) -> List[str]:
+    found = []
+    for code, code_lon, code_lat in cell:
+        distance = haversine_km(lon, lat, code_lon, code_lat)
+        if distance <= dist_km:
+            found.append((distance, code))
+    found.sort()
+    return [code for _, code in found[:limit]]
+
+
+def _nearby_from_index(
+    dist_km: int,
+    lon: Optional[float],
+    lat: Optional[float],
+    postal_code: Optional[str],
+    limit: int,
+) -> Optional[List[str]]:
+    coords = (lon, lat) if postal_code is None else spatial_index.location(postal_code)
+    if coords is None:
+        return None
+    metrics.tier("nearby", "index")
+    return [code for code, _ in spatial_index.nearby(*coords, dist_km, limit=limit)]
+
+
+def _nearby_many_from_index(
+    postal_codes: List[str], dist_km: int, code_limit: int
+) -> Tuple[List[str], List[str]]:
+    """
+    Codes near the postal codes with a location in the spatial index, closest
+    first and at most ``code_limit`` per postal code, and the postal codes
+    without location in the index.
+    """
+    points = []
+    missing = []
+    for postal_code in postal_codes:
+        coords = spatial_index.location(postal_code)
+        if coords is not None:
+            points.append(coords)
+        else:
+            missing.append(postal_code)
+    metrics.tier("nearby", "index", len(points))
+    if not points:
+        return [], missing
+    nearby = spatial_index.nearby_many(points, dist_km, limit_per_point=code_limit)
+    return [code for code, _ in nearby], missing
+
+
+def _nearby_many_from_table(
+    postal_codes: List[str], dist_km: int, cache_keys: Dict[str, str], limit: int
+) -> Dict[str, List[str]]:
+    """
+    Neighbors of the postal codes found in the neighbor table, by cache key.
+    They are cached like API results.
+    """
+    if not postal_codes:
+        return {}
+    found = {
+        cache_keys[code]: codes
+        for code, codes in neighbors_many(postal_codes, dist_km, limit).items()
+    }
+    metrics.tier("nearby", "table", len(found))
+    if found:
+        cache.set_many(found, timeout=None)
+    return found
+
+
+def _dedupe(codes: List[str], limit: Optional[int]) -> List[str]:
+    # remove duplicates, keeping the order
+    codes = list(dict.fromkeys(codes))
+    if limit is not None:
+        return codes[:limit]
+    return codes
+
+
+@metrics.timed("nearby")
 def postal_codes_nearby(
-    dist_km: int = 10,
+    dist_km: Optional[float] = None,
     lon: Optional[float] = None,
     lat: Optional[float] = None,
     postal_code: Optional[str] = None,
+    limit: Optional[int] = None,
 ):
+    """
+    Postal codes within ``dist_km`` (default ``CODEPOSTAL_NEARBY_DISTANCE``)
+    of a point or of a postal code location, at most ``limit`` (default
+    ``CODEPOSTAL_NEARBY_LIMIT``).
+
+    With ``CODEPOSTAL_SPATIAL_INDEX``, results are ordered by distance and
+    computed locally; the API is only used for codes without a known location.
+    With ``CODEPOSTAL_NEIGHBORS``, neighbors of a postal code missing from the
+    cache are read from the precomputed neighbor table. With
+    ``CODEPOSTAL_NEARBY_GRID``, points are looked up in the cached neighbors
+    of their grid cell, ordered by distance.
+    """
     assert (lon is None) == (lat is None)
     assert (lon is not None) == (postal_code is None)
-    cache_key = _cache_key_prefix + "nearby" + f"{dist_km}/{lon}/{lat}/{postal_code}"
+    dist_km, limit = _nearby_settings(dist_km, limit)
+
+    # 0. reading from the in-process index
+    if get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+        result = _nearby_from_index(dist_km, lon, lat, postal_code, limit)
+        if result is not None:
+            return result
+
+    if postal_code is None and get_setting("CODEPOSTAL_NEARBY_GRID"):
+        return _nearby_from_grid(dist_km, lon, lat, limit) or None
+
+    cache_key = _nearby_cache_key(dist_km, lon, lat, postal_code, limit)
 
     cached = cache.get(cache_key)
     if cached is not None:
-        if not cached:
-            return None
-        return cached
+        metrics.tier("nearby", "cache")
+    else:
+        cached = coalesce(
+            cache_key,
+            partial(_nearby_miss, cache_key, dist_km, lon, lat, postal_code, limit),
+        )
+    if not cached:
+        return None
+    return cached
 
+
+def _nearby_miss(
+    cache_key: str,
+    dist_km: int,
+    lon: Optional[float],
+    lat: Optional[float],
+    postal_code: Optional[str],
+    limit: int,
+) -> Optional[List[str]]:
     if postal_code is not None:
+        # 2. reading from the neighbor table
+        result = neighbors(postal_code, dist_km, limit)
+        if result is not None:
+            metrics.tier("nearby", "table")
+            cache.set(cache_key, result, timeout=None)
+            return result
+
         coords = postal_code_location(postal_code)
         if not coords:
             return None
         lon = coords["lon"]
         lat = coords["lat"]
 
-    response = _call(
-        {
-            "where": f'distance(coordonnees_gps,geom\'{{"type": "Point","coordinates":[{lon},{lat}]}}\',{dist_km}km)',
-            "group_by": "code_postal",
-            "limit": 30,
-            "offset": 0,
-            "timezone": "UTC",
-        },
-        cache_key,
-    )
-    if not response:
-        return None
+    return _fetch_nearby(cache_key, lon, lat, dist_km, limit)
+
+
+def postal_codes_nearby_many(
+    postal_codes: List[str],
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+    code_limit: Optional[int] = None,
+) -> List[str]:
+    """
+    Postal codes within ``dist_km`` (default ``CODEPOSTAL_NEARBY_DISTANCE``)
+    of any of ``postal_codes``, at most ``code_limit`` (default
+    ``CODEPOSTAL_NEARBY_LIMIT``) per postal code and ``limit`` in all.
+
+    With ``CODEPOSTAL_SPATIAL_INDEX``, distances to the locations of the
+    in-process spatial index are computed in one batch, closest first. Other
+    codes are looked up with one cache query for all of them, one batch of
+    locations and one API call per code still missing.
+    """
+    return _postal_codes_nearby_many(postal_codes, dist_km, limit, code_limit)[0]
+
+
+@metrics.timed("nearby_many")
+def _postal_codes_nearby_many(
+    postal_codes: List[str],
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+    code_limit: Optional[int] = None,
+) -> Tuple[List[str], bool]:
+    """
+    ``postal_codes_nearby_many``, and whether the suggestions of all the
+    postal codes could be looked up
+    """
+    complete = True
+    dist_km, code_limit = _nearby_settings(dist_km, code_limit)
+    if get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+        found, missing = _nearby_many_from_index(postal_codes, dist_km, code_limit)
     else:
-        result = [
-            record["record"]["fields"]["code_postal"]
-            for record in response.json()["records"]
-        ]
-        cache.set(cache_key, result, timeout=None)
-        return result
+        found, missing = [], list(postal_codes)
 
+    if missing:
+        cache_keys = {
+            code: _nearby_cache_key(dist_km, None, None, code, code_limit)
+            for code in missing
+        }
+        cached = cache.get_many(list(cache_keys.values()))
+        metrics.tier("nearby", "cache", len(cached))
+        uncached = [code for code in missing if cache_keys[code] not in cached]
+        from_table = _nearby_many_from_table(
+            uncached, dist_km, cache_keys, code_limit
+        )
+        cached.update(from_table)
+        locations, complete = _postal_code_locations(
+            [code for code in uncached if cache_keys[code] not in from_table]
+        )
+        for postal_code in missing:
+            cache_key = cache_keys[postal_code]
+            if cache_key in cached:
+                result = cached[cache_key]
+            elif locations.get(postal_code):
+                coords = locations[postal_code]
+                result = coalesce(
+                    cache_key,
+                    partial(
+                        _fetch_nearby,
+                        cache_key,
+                        coords["lon"],
+                        coords["lat"],
+                        dist_km,
+                        code_limit,
+                    ),
+                )
+            else:
+                continue
+            # None or False (cached error): the API failed
+            if result is None or result is False:
+                complete = False
+            found += result or []
 
-def fetch_postal_code_locations():
+    return _dedupe(found, limit), complete
 
-    missing_locations = CodePostal.objects.filter(
-        codepostallocation__isnull=True
-    ).values_list("code", flat=True)
-    if not missing_locations.exists():
-        return 0
 
-    cache_key = _cache_key_prefix + "multiple_locations"
-    response = _call(
-        {
-            "select": "coordonnees_gps,code_postal",
-            "where": " or ".join([f"code_postal={code}" for code in missing_locations]),
-            "limit": 30,
-            "offset": 0,
-            "timezone": "UTC",
-        },
-        cache_key,
-    )
-    if not response:
+# maximum number of records per page of the API
+_page_size = 100
+
+
+def _locations_params(postal_codes: List[str], offset: int = 0) -> Dict[str, Any]:
+    return {
+        "select": "coordonnees_gps,code_postal",
+        "where": " or ".join([f"code_postal={code}" for code in postal_codes]),
+        "limit": _page_size,
+        "offset": offset,
+        "timezone": "UTC",
+    }
+
+
+def _next_offset(json: Dict[str, Any], offset: int) -> Optional[int]:
+    """
+    Offset of the next page of results, None after the last page
+    """
+    offset += len(json["records"])
+    if not json["records"] or offset >= json.get("total_count", 0):
         return None
+    return offset
+
 
-    json = response.json()
-    if json["total_count"] > 0:
-        coordinates = defaultdict(list)
+def _locations_from_records(
+    pages: Iterable[Dict[str, Any]], postal_codes: List[str]
+) -> Dict[str, Dict[str, float]]:
+    """
+    Centroid of the records of each postal code, from all the pages of
+    results. Codes without records are absent from the result.
+    """
+    coordinates = defaultdict(list)
+    for json in pages:
         for record in json["records"]:
-            coordinates[record["record"]["fields"]["code_postal"]].append(
-                record["record"]["fields"]["coordonnees_gps"]
+            fields = record["record"]["fields"]
+            # code_postal is selected, but be lenient when a single code is requested
+            coordinates[fields.get("code_postal", postal_codes[0])].append(
+                fields["coordonnees_gps"]
             )
+    return {
+        postal_code: {
+            "lon": sum([coord["lon"] for coord in code_coord]) / len(code_coord),
+            "lat": sum([coord["lat"] for coord in code_coord]) / len(code_coord),
+        }
+        for postal_code, code_coord in coordinates.items()
+    }
+
+
+def _fetch_locations(
+    postal_codes: List[str], cache_key: str
+) -> Optional[Dict[str, Dict[str, float]]]:
+    """
+    Reads the locations of the postal codes from the API, following the
+    pagination. ``postal_codes`` must fit in a URL, see
+    ``CODEPOSTAL_FETCH_CHUNK_SIZE``.
+    """
+    pages = []
+    offset = 0
+    while offset is not None:
+        response = _call(_locations_params(postal_codes, offset), cache_key)
+        if not response:
+            return None
+        pages.append(response.json())
+        offset = _next_offset(pages[-1], offset)
+    return _locations_from_records(pages, postal_codes)
+
+
+def _locations_from_db(
+    postal_codes: List[str],
+) -> Dict[str, Optional[Dict[str, float]]]:
+    """
+    Stored locations of the postal codes, copied to the cache. Codes without
+    a stored row are absent from the result.
+    """
+    result = {}
+    for postal_code, lon, lat in CodePostalLocation.objects.filter(
+        code__in=postal_codes
+    ).values_list("code", "longitude", "latitude"):
+        if lon is None or lat is None:
+            result[postal_code] = None
+        else:
+            result[postal_code] = {"lon": lon, "lat": lat}
+    metrics.tier("location", "db", len(result))
+    if result:
+        cache.set_many(
+            {
+                _location_cache_key(postal_code): location or False
+                for postal_code, location in result.items()
+            },
+            timeout=None,
+        )
+    return result
+
+
+def _missing_locations_cache_key(missing: List[str]) -> str:
+    if len(missing) == 1:
+        return _location_cache_key(missing[0])
+    return _cache_key_prefix + "multiple_locations"
+
+
+def _locations_from_snapshot(
+    postal_codes: List[str],
+) -> Dict[str, Dict[str, float]]:
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return {}
+    result = {}
+    for postal_code in postal_codes:
+        coords = snapshot.location(postal_code)
+        if coords is not None:
+            result[postal_code] = {"lon": coords[0], "lat": coords[1]}
+    metrics.tier("location", "snapshot", len(result))
+    return result
+
 
-        for postal_code, code_coord in coordinates.items():
-            cache_key = _cache_key_prefix + "location" + postal_code
-            lon = sum([coord["lon"] for coord in code_coord]) / len(code_coord)
-            lat = sum([coord["lat"] for coord in code_coord]) / len(code_coord)
-            result = {"lon": lon, "lat": lat}
-            CodePostalLocation.objects.update_or_create(
-                code=CodePostal.objects.get_or_create(code=postal_code)[0],
-                defaults={"longitude": lon, "latitude": lat},
+def _read_cached_locations(
+    postal_codes: List[str], cached: Dict[str, Any]
+) -> Dict[str, Optional[Dict[str, float]]]:
+    result = {}
+    for postal_code in postal_codes:
+        value = cached.get(_location_cache_key(postal_code))
+        if value is not None:
+            # False: known to have no location
+            result[postal_code] = value or None
+    metrics.tier("location", "cache", len(result))
+    return result
+
+
+def _store_locations(locations: Dict[str, Optional[Dict[str, float]]]):
+    """
+    Saves locations (None when the code has no known location) in DB and cache.
+
+    Filling missing locations is not a change of the dataset: it is only
+    notified when stored coordinates changed.
+    """
+    stored = {
+        code: (lon, lat)
+        for code, lon, lat in CodePostalLocation.objects.filter(
+            code__in=list(locations)
+        ).values_list("code", "longitude", "latitude")
+    }
+    # codes without records in the API are stored as unknown
+    CodePostal.objects.ensure(
+        [code for code, location in locations.items() if location], known=True
+    )
+    CodePostal.objects.ensure(
+        [code for code, location in locations.items() if not location]
+    )
+    bulk_upsert(
+        CodePostalLocation,
+        [
+            CodePostalLocation(
+                code_id=postal_code,
+                longitude=location["lon"] if location else None,
+                latitude=location["lat"] if location else None,
             )
-            cache.set(cache_key, result, timeout=None)
-        return len(coordinates.keys())
+            for postal_code, location in locations.items()
+        ],
+        ["longitude", "latitude"],
+    )
+    cache.set_many(
+        {
+            _location_cache_key(postal_code): location or False
+            for postal_code, location in locations.items()
+        },
+        timeout=None,
+    )
+    coordinates = {
+        code: (location["lon"], location["lat"]) if location else (None, None)
+        for code, location in locations.items()
+    }
+    if any(stored.get(code, coords) != coords for code, coords in coordinates.items()):
+        # bulk queries send no model signals
+        notify_dataset_changed()
 
-    return None
 
+def postal_code_locations(
+    postal_codes: Iterable[Any],
+) -> Dict[str, Optional[Dict[str, float]]]:
+    """
+    Bulk version of ``postal_code_location``: one cache query, one DB query
+    and one API call at most, whatever the number of postal codes.
+    """
+    return _postal_code_locations(postal_codes)[0]
 
-def postal_code_location(postal_code: Any) -> Union[None, Dict[str, float]]:
+
+@metrics.timed("locations")
+def _postal_code_locations(
+    postal_codes: Iterable[Any],
+) -> Tuple[Dict[str, Optional[Dict[str, float]]], bool]:
     """
-    Renvoie le milieu des coordonnées des communes correspondant au code postal
+    ``postal_code_locations``, and whether all the locations could be looked
+    up: codes the API failed for have a None location too
     """
-    # ensure the postal code is converted to string
-    if not postal_code:
-        return None
+    postal_codes = list(dict.fromkeys(str(code) for code in postal_codes if code))
+    if not postal_codes:
+        return {}, True
 
-    postal_code = str(postal_code)
-    cache_key = _cache_key_prefix + "location" + postal_code
+    # 0. reading from the snapshot
+    result = _locations_from_snapshot(postal_codes)
+    missing = [postal_code for postal_code in postal_codes if postal_code not in result]
+    if not missing:
+        return result, True
 
     # 1. reading from cache
-    cached = cache.get(cache_key)
-    if cached is not None:
-        if not cached:
-            # see below, case where the API returns no records
-            return None
-        return cached
+    result.update(
+        _read_cached_locations(
+            missing, cache.get_many([_location_cache_key(code) for code in missing])
+        )
+    )
+    missing = [postal_code for postal_code in missing if postal_code not in result]
+    if not missing:
+        return result, True
 
     # 2. reading from DB
-    try:
-        location = CodePostalLocation.objects.get(code=postal_code)
-        if location.longitude is None or location.latitude is None:
-            cache.set(cache_key, False, timeout=None)
-            return None
-        result = {"lon": location.longitude, "lat": location.latitude}
-        cache.set(cache_key, result, timeout=None)
-        return result
-    except CodePostalLocation.DoesNotExist:
-        # pass to reading from API
-        pass
+    result.update(_locations_from_db(missing))
+    missing = [postal_code for postal_code in missing if postal_code not in result]
+    if not missing:
+        return result, True
 
     # 3. reading from API
-    response = _call(
-        {
-            "select": "coordonnees_gps",
-            "where": f"code_postal={postal_code}",
-            "limit": 30,
-            "offset": 0,
-            "timezone": "UTC",
-        },
-        cache_key,
+    complete = True
+    for chunk in chunks(missing, get_setting("CODEPOSTAL_FETCH_CHUNK_SIZE")):
+        fetched = _fetch_locations(chunk, _missing_locations_cache_key(chunk))
+        if fetched is None:
+            metrics.tier("location", "error", len(chunk))
+            result.update(dict.fromkeys(chunk))
+            complete = False
+            continue
+        metrics.tier("location", "api", len(chunk))
+        # store codes without records too, so that the API is not called again
+        fetched = {postal_code: fetched.get(postal_code) for postal_code in chunk}
+        _store_locations(fetched)
+        result.update(fetched)
+    return result, complete
+
+
+def fetch_postal_code_locations(
+    chunk_size: Optional[int] = None,
+    progress: Optional[Callable[[int, int, float], None]] = None,
+) -> Optional[int]:
+    """
+    Backfills the locations of the stored postal codes that have none.
+
+    Missing codes are fetched by chunks of ``chunk_size`` (default
+    ``CODEPOSTAL_FETCH_CHUNK_SIZE``), and each chunk is saved before the next
+    one is fetched: after an error or a throttling, calling it again resumes
+    where it stopped. Codes unknown to the API are saved without coordinates.
+
+    API calls have the background priority of ``ratelimit``.
+    ``progress(done, total, elapsed_seconds)`` is called after each chunk.
+    Returns the number of codes with a location found, None on API errors.
+    """
+    chunk_size = chunk_size or get_setting("CODEPOSTAL_FETCH_CHUNK_SIZE")
+    missing_locations = list(
+        CodePostal.objects.filter(codepostallocation__isnull=True)
+        .order_by("code")
+        .values_list("code", flat=True)
     )
+    if not missing_locations:
+        return 0
 
-    if not response:
+    cache_key = _cache_key_prefix + "multiple_locations"
+    start = time.monotonic()
+    found = 0
+    done = 0
+    for chunk in chunks(missing_locations, chunk_size):
+        # leave the API quota to interactive requests
+        with ratelimit.background():
+            fetched = _fetch_locations(chunk, cache_key)
+        if fetched is None:
+            return None
+        _store_locations({postal_code: fetched.get(postal_code) for postal_code in chunk})
+        found += len(fetched)
+        done += len(chunk)
+
+        elapsed = time.monotonic() - start
+        logger.info(
+            "fetched locations of %s/%s postal codes (%.1f codes/s)",
+            done,
+            len(missing_locations),
+            done / elapsed if elapsed else 0,
+        )
+        if progress is not None:
+            progress(done, len(missing_locations), elapsed)
+    return found
+
+
+@metrics.timed("location")
+def postal_code_location(postal_code: Any) -> Union[None, Dict[str, float]]:
+    """
+    Renvoie le milieu des coordonnées des communes correspondant au code postal
+    """
+    # ensure the postal code is converted to string
+    if not postal_code:
         return None
+
+    postal_code = str(postal_code)
+    snapshot = _locations_from_snapshot([postal_code])
+    if snapshot:
+        return snapshot[postal_code]
+
+    cache_key = _location_cache_key(postal_code)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        metrics.tier("location", "cache")
     else:
-        json = response.json()
-        if json["total_count"] > 0:
-            coordinates = [
-                record["record"]["fields"]["coordonnees_gps"]
-                for record in json["records"]
-            ]
-            lon = sum([coord["lon"] for coord in coordinates]) / len(coordinates)
-            lat = sum([coord["lat"] for coord in coordinates]) / len(coordinates)
-            result = {"lon": lon, "lat": lat}
-            CodePostalLocation.objects.update_or_create(
-                code=CodePostal.objects.get_or_create(code=postal_code)[0],
-                defaults={"longitude": lon, "latitude": lat},
-            )
-            cache.set(cache_key, result, timeout=None)
-            return result
-        else:
-            # cache anyway
-            CodePostalLocation.objects.update_or_create(
-                code=CodePostal.objects.get_or_create(code=postal_code)[0],
-                defaults={"longitude": None, "latitude": None},
-            )
-            cache.set(cache_key, False, timeout=None)
-            return None
+        cached = coalesce(
+            cache_key, lambda: postal_code_locations([postal_code])[postal_code]
+        )
+    # False: known to have no location
+    return cached or None
 
 
 class _PostalCodesCompletion:
@@ -231,7 +772,7 @@ class _PostalCodesCompletion:
     def _check_portion(self, code_portion):
         if not code_portion:
             return False
-        if not self.regex.match(code_portion):
+        if not self.regex.fullmatch(code_portion):
             logger.error(
                 "code postal portion does not match pattern (%s)", code_portion
             )
@@ -246,55 +787,105 @@ class _PostalCodesCompletion:
         else:
             return codes
 
+    def _from_index(
+        self, code_portion: str, index=prefix_index
+    ) -> Optional[List[str]]:
+        result = index.complete(code_portion)
+        # an unknown 3-digit group may only be not fetched yet
+        if result or index.complete(code_portion[:3]):
+            return result
+        return None
+
+    def _from_db(self, code_portion: str) -> Optional[List[str]]:
+        try:
+            result = CodePostalCompletions.complete(code_portion[:3])
+        except CodePostalCompletions.DoesNotExist:
+            return None
+        metrics.tier("completion", "db")
+        # cache the whole group, as the cache key only has 3 digits
+        cache.set(_completion_cache_key(code_portion), result, timeout=None)
+        return result
+
+    def _params(self, code_portion: str) -> Dict[str, Any]:
+        return {
+            "group_by": "code_postal",
+            "where": f"search(code_postal,'{code_portion[:3]}')",
+            "limit": 100,
+            "offset": 0,
+            "timezone": "UTC",
+        }
+
+    def _store(self, code_portion: str, result: List[str]):
+        metrics.tier("completion", "api")
+        CodePostalCompletions.store(code_portion[:3], result)
+        cache.set(_completion_cache_key(code_portion), result, timeout=None)
+
+    @metrics.timed("completion")
     def __call__(self, code_portion: str) -> List[str]:
         if not self._check_portion(code_portion):
             # FIXME: should raise ?
             return None
 
-        code_portion_key = code_portion[:3]
-        # cache by 3 first digits
-        cache_key = _cache_key_prefix + "complete" + code_portion_key
+        # 0. reading from the snapshot, then from the in-process index
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            result = self._from_index(code_portion, snapshot)
+            if result is not None:
+                metrics.tier("completion", "snapshot")
+                return result
+        if get_setting("CODEPOSTAL_PREFIX_INDEX"):
+            result = self._from_index(code_portion)
+            if result is not None:
+                metrics.tier("completion", "index")
+                return result
+
+        cache_key = _completion_cache_key(code_portion)
 
         # 1. reading from Cache
         cached = cache.get(cache_key)
         if cached is not None:
-            if not cached:
-                return cached
-            return self._refine_results(code_portion, cached)
+            metrics.tier("completion", "cache")
+        else:
+            # 2. and 3., once for concurrent callers
+            cached = coalesce(cache_key, partial(self._fetch, code_portion))
+        if not cached:
+            return cached
+        return self._refine_results(code_portion, cached)
 
+    def _fetch(self, code_portion: str) -> Optional[List[str]]:
+        """
+        All the codes of the 3-digit group, from DB or API
+        """
         # 2. reading from DB
-        try:
-            result = CodePostalCompletions.complete(code_portion)
-            cache.set(cache_key, result, timeout=None)
+        result = self._from_db(code_portion)
+        if result is not None:
             return result
-        except CodePostalCompletions.DoesNotExist:
-            pass
 
         # 3. reading from API
         response = _call(
-            {
-                "group_by": "code_postal",
-                "where": f"search(code_postal,'{code_portion_key}')",
-                "limit": 100,
-                "offset": 0,
-                "timezone": "UTC",
-            },
-            cache_key,
+            self._params(code_portion), _completion_cache_key(code_portion)
         )
         if not response:
+            metrics.tier("completion", "error")
             return None
         else:
-            result = [
-                record["record"]["fields"]["code_postal"]
-                for record in response.json()["records"]
-            ]
-            CodePostalCompletions.from_list(code_portion_key, result).save()
-            cache.set(cache_key, result, timeout=None)
-            return self._refine_results(code_portion, result)
+            result = _codes_from_records(response.json())
+            self._store(code_portion, result)
+            return result
 
 
 postal_codes_completion = _PostalCodesCompletion()
 
+
+def _completion_failed(code_portion: str, result: Optional[List[str]]) -> bool:
+    """
+    Whether the completion ``result`` of a valid portion is an API failure:
+    None, or False for a cached error. Nothing found is an empty list.
+    """
+    return (result is None or result is False) and bool(
+        _PostalCodesCompletion.regex.fullmatch(code_portion)
+    )
+
 _postal_code_regex = re.compile(r"[0-9]{5}")
 
 
@@ -302,69 +893,156 @@ def is_candidate_postal_code(code):
     return bool(_postal_code_regex.match(code))
 
 
-def complete_and_suggest(postal_codes: List[str], term: str):
-    completion = []
-
-    if len(term) >= 3:
+def unknown_postal_codes(postal_codes: Iterable[str]) -> List[str]:
+    """
+    Those of ``postal_codes`` that do not exist: missing from the completion
+    of their 3-digit group. Known codes are checked at once, in memory with
+    the snapshot or the prefix index, else in one query; then one completion
+    is looked up per group of the others. Codes whose group cannot be looked
+    up are not reported.
+    """
+    postal_codes = list(dict.fromkeys(postal_codes))
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        known = {code for code in postal_codes if code in snapshot}
+    elif get_setting("CODEPOSTAL_PREFIX_INDEX"):
+        known = {code for code in postal_codes if code in prefix_index}
+    else:
+        known = set(
+            # stored codes may have been typed in a form, or be missing from
+            # the API
+            CodePostal.objects.filter(code__in=postal_codes, known=True).values_list(
+                "code", flat=True
+            )
+        )
+    groups = defaultdict(list)
+    for code in postal_codes:
+        if code not in known:
+            groups[code[:3]].append(code)
+    unknown = []
+    for group, codes in groups.items():
         try:
-            term_completion = postal_codes_completion(term)
-            if term_completion:
-                completion += [
-                    {"id": value, "text": value}
-                    for value in term_completion
-                    if value not in postal_codes
-                ]
-            else:
-                completion += [
-                    {
-                        "text": "Aucun code postal ne correspond",
-                        "children": [],
-                    }
-                ]
+            completion = postal_codes_completion(group)
         except DatanovaThrottlingException:
-            if is_candidate_postal_code(term):
-                # allow to force a postal code that match the postal code regex
-                term_completion = [{"id": term, "text": term}]
-            else:
-                term_completion = []
-            completion.append(
-                {
-                    "text": "Impossible d'obtenir les suggestions de codes postaux",
-                    "children": term_completion,
-                }
-            )
+            continue
+        if completion is not None:
+            unknown.extend(code for code in codes if code not in completion)
+    return unknown
+
+
+def _completion_items(
+    postal_codes: List[str], term_completion: Optional[List[str]]
+) -> List[Dict[str, Any]]:
+    if term_completion:
+        return [
+            {"id": value, "text": value}
+            for value in term_completion
+            if value not in postal_codes
+        ]
+    return [
+        {
+            "text": "Aucun code postal ne correspond",
+            "children": [],
+        }
+    ]
+
+
+_completion_error_text = "Impossible d'obtenir les suggestions de codes postaux"
+_nearby_error_text = "Impossible d'obtenir les suggestions à proximité"
+
+
+def has_error_items(items: List[Dict[str, Any]]) -> bool:
+    """
+    Whether suggestions could not be looked up, because of throttling or of
+    an API failure
+    """
+    return any(
+        item.get("text") in (_completion_error_text, _nearby_error_text)
+        for item in items
+    )
+
+
+def _completion_error_items(term: str) -> List[Dict[str, Any]]:
+    if is_candidate_postal_code(term):
+        # allow to force a postal code that match the postal code regex
+        term_completion = [{"id": term, "text": term}]
+    else:
+        term_completion = []
+    return [
+        {
+            "text": _completion_error_text,
+            "children": term_completion,
+        }
+    ]
+
 
+def _nearby_source_codes(postal_codes: List[str]) -> List[str]:
+    if get_setting("CODEPOSTAL_SPATIAL_INDEX"):
+        # distances are computed locally, for all postal_codes at once
+        return postal_codes
+    # get neighbors of the last 5 postal_codes only
+    # for performance and because of LaPoste API rate limitations
+    return postal_codes[-5:]
+
+
+def _nearby_items(
+    postal_codes: List[str], term: str, nearby: List[str]
+) -> List[Dict[str, Any]]:
+    # convert to list of dict and remove already selected items
+    neighbors = [
+        {"id": str(near), "text": str(near)}
+        for near in nearby
+        if (not term or near.startswith(term)) and near not in postal_codes
+    ]
+    if neighbors:
+        return [{"text": "À proximité", "children": neighbors}]
+    return []
+
+
+def _nearby_error_items() -> List[Dict[str, Any]]:
+    return [
+        {
+            "text": _nearby_error_text,
+            "children": [],
+        }
+    ]
+
+
+@metrics.timed("complete_and_suggest")
+def complete_and_suggest(
+    postal_codes: List[str],
+    term: str,
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+):
+    """
+    Completions of ``term``, and suggestions within ``dist_km`` of
+    ``postal_codes``, at most ``limit`` per postal code (defaults:
+    ``CODEPOSTAL_NEARBY_DISTANCE`` and ``CODEPOSTAL_NEARBY_LIMIT``)
+    """
     res = []
 
-    if completion:
-        res += completion
+    if len(term) >= 3:
+        try:
+            completion = postal_codes_completion(term)
+        except DatanovaThrottlingException:
+            res += _completion_error_items(term)
+        else:
+            if _completion_failed(term, completion):
+                res += _completion_error_items(term)
+            else:
+                res += _completion_items(postal_codes, completion)
 
     if postal_codes:
         try:
-            # get neighbors of the last 5 postal_codes only
-            # for performance and because of LaPoste API rate limitations
-            neighbors = set(
-                [
-                    near
-                    for code in postal_codes[-5:]
-                    for near in (postal_codes_nearby(postal_code=code) or [])
-                    if not term or near.startswith(term)
-                ]
+            nearby, complete = _postal_codes_nearby_many(
+                _nearby_source_codes(postal_codes), dist_km, code_limit=limit
             )
-            # convert to list of dict and remove already selected items
-            neighbors = [
-                {"id": str(near), "text": str(near)}
-                for near in neighbors
-                if near not in postal_codes
-            ]
-            if neighbors:
-                res.append({"text": "À proximité", "children": neighbors})
         except DatanovaThrottlingException:
-            res.append(
-                {
-                    "text": "Impossible d'obtenir les suggestions à proximité",
-                    "children": [],
-                }
-            )
+            res += _nearby_error_items()
+        else:
+            res += _nearby_items(postal_codes, term, nearby)
+            if not complete:
+                res += _nearby_error_items()
 
     return res
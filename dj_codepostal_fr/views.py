@@ -1,11 +1,172 @@
-from django.http import JsonResponse, HttpRequest
+import hashlib
+from typing import Callable, List, Optional, Tuple, Union
 
-from .utils import complete_and_suggest
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, HttpRequest
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from .async_utils import acomplete_and_suggest
+from .communes import search_communes
+from .conf import get_setting
+from .fragments import acomplete_and_suggest_json, complete_and_suggest_json
+from .metrics import registry
+from .signals import dataset_version
+from .utils import _nearby_source_codes, complete_and_suggest, has_error_items
+
+
+# bounds of the nearby search asked by widgets
+_max_nearby_distance = 100
+_max_nearby_limit = 100
+
+
+def _bounded(
+    request: HttpRequest, name: str, kind: Callable, maximum: Union[int, float]
+) -> Optional[Union[int, float]]:
+    # None when missing or invalid: the setting is used
+    try:
+        value = kind(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+    if not 0 < value <= maximum:
+        return None
+    return value
+
+
+def _area_params(
+    request: HttpRequest,
+) -> Tuple[List[str], str, Optional[float], Optional[int]]:
+    # in the selection order: nearby suggestions come from the last codes
+    postal_codes = list(
+        dict.fromkeys(
+            code.strip()
+            for code in request.GET.getlist("postal_codes[]", [])
+            if code.strip()
+        )
+    )
+    term = request.GET.get("term", "").strip()
+    dist_km = _bounded(request, "dist", float, _max_nearby_distance)
+    limit = _bounded(request, "limit", int, _max_nearby_limit)
+    return postal_codes, term, dist_km, limit
+
+
+def _etag(*parts: str) -> str:
+    return quote_etag(hashlib.sha1("|".join(parts).encode()).hexdigest())
+
+
+def _area_etag(
+    version: str,
+    postal_codes: List[str],
+    term: str,
+    dist_km: Optional[float] = None,
+    limit: Optional[int] = None,
+) -> str:
+    # the order of the selected codes only matters for those the nearby
+    # suggestions come from
+    parts = [
+        version,
+        ",".join(sorted(postal_codes)),
+        ",".join(_nearby_source_codes(postal_codes)),
+        term,
+    ]
+    if dist_km is not None or limit is not None:
+        parts.append(f"{dist_km}/{limit}")
+    return _etag(*parts)
+
+
+def _area_response(
+    response: HttpResponse, complete: bool, etag: str
+) -> HttpResponse:
+    if not complete:
+        # e.g. throttling: ask again later
+        patch_cache_control(response, no_store=True)
+    else:
+        response["ETag"] = etag
+        patch_cache_control(
+            response, public=True, max_age=get_setting("CODEPOSTAL_HTTP_MAX_AGE")
+        )
+    return response
+
+
+def _not_modified(request: HttpRequest, etag: str):
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response["ETag"] = etag
+        patch_cache_control(
+            response, public=True, max_age=get_setting("CODEPOSTAL_HTTP_MAX_AGE")
+        )
+    return response
 
 
 def area_view(request: HttpRequest):
-    postal_codes = request.GET.getlist("postal_codes[]", [])
-    term = request.GET.get("term", "")
+    postal_codes, term, dist_km, limit = _area_params(request)
+    etag = _area_etag(dataset_version(), postal_codes, term, dist_km, limit)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    if get_setting("CODEPOSTAL_FAST_JSON"):
+        body, complete = complete_and_suggest_json(
+            postal_codes, term, dist_km, limit
+        )
+        response = HttpResponse(body, content_type="application/json")
+    else:
+        res = complete_and_suggest(postal_codes, term, dist_km, limit)
+        response = JsonResponse({"err": "nil", "results": res})
+        complete = not has_error_items(res)
+    return _area_response(response, complete, etag)
+
+
+async def async_area_view(request: HttpRequest):
+    postal_codes, term, dist_km, limit = _area_params(request)
+    etag = _area_etag(
+        await sync_to_async(dataset_version)(), postal_codes, term, dist_km, limit
+    )
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    if get_setting("CODEPOSTAL_FAST_JSON"):
+        body, complete = await acomplete_and_suggest_json(
+            postal_codes, term, dist_km, limit
+        )
+        response = HttpResponse(body, content_type="application/json")
+    else:
+        res = await acomplete_and_suggest(postal_codes, term, dist_km, limit)
+        response = JsonResponse({"err": "nil", "results": res})
+        complete = not has_error_items(res)
+    return _area_response(response, complete, etag)
+
+
+def communes_view(request: HttpRequest):
+    """
+    Communes matching ``term``, in the select2 format; the id of each result
+    is "<INSEE code>/<postal code>"
+    """
+    term = request.GET.get("term", "").strip()
+    etag = _etag(dataset_version(), "communes", term)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    results = [
+        {
+            "id": f"{commune.insee}/{commune.postal_code}",
+            "text": f"{commune.name} ({commune.postal_code})",
+            "insee": commune.insee,
+            "postal_code": commune.postal_code,
+        }
+        for commune in search_communes(term, get_setting("CODEPOSTAL_COMMUNES_LIMIT"))
+    ]
+    return _area_response(JsonResponse({"err": "nil", "results": results}), True, etag)
+
 
-    res = complete_and_suggest(postal_codes, term)
-    return JsonResponse({"err": "nil", "results": res})
+def metrics_view(request: HttpRequest):
+    """
+    Metrics of this process in the Prometheus text format
+    """
+    if not get_setting("CODEPOSTAL_METRICS"):
+        raise Http404()
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
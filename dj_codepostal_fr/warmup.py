@@ -0,0 +1,206 @@
+"""
+Warm-up of the cache after a flush: the completions of all the known 3-digit
+prefixes and the locations of all the known postal codes are written with
+``set_many`` in batches, instead of being refilled one request at a time.
+
+Data missing from the DB is fetched from the API by a bounded pool of
+threads, with the background priority of ``ratelimit``. The threads only make
+the HTTP calls: results are stored by the calling thread.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.db import DatabaseError, connection
+
+from dj_codepostal_fr import ratelimit
+from dj_codepostal_fr.cache import _cache_key_prefix, cache
+from dj_codepostal_fr.conf import get_setting
+from dj_codepostal_fr.db import chunks
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    _call,
+    _codes_from_records,
+    _completion_cache_key,
+    _fetch_locations,
+    _location_cache_key,
+    _store_locations,
+    postal_codes_completion,
+)
+
+logger = logging.getLogger("codepostal.warmup")
+
+_lock_cache_key = _cache_key_prefix + "warmup"
+
+
+def _fetch_completion(portion: str) -> Optional[List[str]]:
+    with ratelimit.background():
+        response = _call(
+            postal_codes_completion._params(portion), _completion_cache_key(portion)
+        )
+    if not response:
+        return None
+    return _codes_from_records(response.json())
+
+
+def _fetch_locations_chunk(postal_codes: List[str]) -> Optional[Dict[str, Any]]:
+    with ratelimit.background():
+        return _fetch_locations(postal_codes, _cache_key_prefix + "multiple_locations")
+
+
+def _warm_completions(batch_size: int) -> int:
+    # groups may have no codes at all
+    groups = {
+        portion: []
+        for portion in CodePostalCompletions.objects.order_by("portion").values_list(
+            "portion", flat=True
+        )
+    }
+    codes = CodePostal.objects.filter(known=True).order_by("code")
+    for code in codes.values_list("code", flat=True):
+        if code[:3] in groups:
+            groups[code[:3]].append(code)
+    written = 0
+    for batch in chunks(list(groups.items()), batch_size):
+        cache.set_many(
+            {_completion_cache_key(portion): codes for portion, codes in batch},
+            timeout=None,
+        )
+        written += len(batch)
+    return written
+
+
+def _warm_locations(batch_size: int) -> int:
+    written = 0
+    locations = CodePostalLocation.objects.order_by("code").values_list(
+        "code", "longitude", "latitude"
+    )
+    for batch in chunks(list(locations), batch_size):
+        cache.set_many(
+            {
+                _location_cache_key(code): (
+                    {"lon": lon, "lat": lat}
+                    if lon is not None and lat is not None
+                    # known to have no location
+                    else False
+                )
+                for code, lon, lat in batch
+            },
+            timeout=None,
+        )
+        written += len(batch)
+    return written
+
+
+def _fetch_missing(workers: int) -> Dict[str, int]:
+    """
+    Fetches the completions of the prefixes of stored codes without any, and
+    the locations of the stored codes without any. Returns the number of
+    written cache keys and of failed API queries.
+    """
+    codes = CodePostal.objects.order_by("code").values_list("code", flat=True)
+    known_portions = set(
+        CodePostalCompletions.objects.values_list("portion", flat=True)
+    )
+    portions = sorted({code[:3] for code in codes} - known_portions)
+    missing_locations = list(codes.filter(codepostallocation__isnull=True))
+
+    written = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_fetch_completion, portion): ("completion", portion)
+            for portion in portions
+        }
+        futures.update(
+            {
+                executor.submit(_fetch_locations_chunk, chunk): ("locations", chunk)
+                for chunk in chunks(
+                    missing_locations, get_setting("CODEPOSTAL_FETCH_CHUNK_SIZE")
+                )
+            }
+        )
+        for future in as_completed(futures):
+            kind, key = futures[future]
+            try:
+                result = future.result()
+            except DatanovaThrottlingException:
+                result = None
+            if result is None:
+                failed += 1
+            elif kind == "completion":
+                postal_codes_completion._store(key, result)
+                written += 1
+            else:
+                # codes unknown to the API are stored without coordinates
+                _store_locations({code: result.get(code) for code in key})
+                written += len(key)
+    return {"fetched": written, "failed": failed}
+
+
+def warm_cache(
+    batch_size: int = 500,
+    workers: Optional[int] = None,
+    fetch: bool = True,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Writes the stored completions and locations to the cache, then, with
+    ``fetch``, fetches the missing ones from the API with ``workers`` threads
+    (default ``CODEPOSTAL_WARM_CACHE_WORKERS``).
+
+    ``progress(step, written_keys)`` is called after each step. Returns the
+    counts of written keys by step, their total, failed API queries, and the
+    duration in seconds.
+    """
+    workers = workers or get_setting("CODEPOSTAL_WARM_CACHE_WORKERS")
+    start = time.monotonic()
+    stats = {"completions": _warm_completions(batch_size)}
+    if progress is not None:
+        progress("completions", stats["completions"])
+    stats["locations"] = _warm_locations(batch_size)
+    if progress is not None:
+        progress("locations", stats["locations"])
+    stats.update(_fetch_missing(workers) if fetch else {"fetched": 0, "failed": 0})
+    if fetch and progress is not None:
+        progress("fetched", stats["fetched"])
+
+    stats["keys"] = stats["completions"] + stats["locations"] + stats["fetched"]
+    stats["seconds"] = time.monotonic() - start
+    logger.info(
+        "wrote %s cache keys in %.1fs, %s failed API queries",
+        stats["keys"],
+        stats["seconds"],
+        stats["failed"],
+    )
+    return stats
+
+
+def _warm_cache_once():
+    # one of the processes started together warms the shared cache
+    if not cache.add(_lock_cache_key, True, timeout=300):
+        return
+    try:
+        warm_cache()
+    except DatabaseError as e:
+        # e.g. the migrations were not applied yet
+        logger.warning("cache warm-up failed: %s", e)
+    finally:
+        connection.close()
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    Warms the cache in a daemon thread, see ``CODEPOSTAL_WARM_CACHE_ON_START``
+    """
+    thread = threading.Thread(
+        target=_warm_cache_once, name="codepostal-warmup", daemon=True
+    )
+    thread.start()
+    return thread
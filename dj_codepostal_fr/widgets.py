@@ -1,14 +1,40 @@
+from urllib.parse import urlencode
+
+from django import forms
 from django_select2.forms import HeavySelect2MultipleWidget
 
+from .conf import get_setting
+
 
 class MultiplePostalCodesWithSuggest(HeavySelect2MultipleWidget):
+    """
+    ``nearby_distance`` (km) and ``nearby_limit`` (per selected code) of the
+    nearby suggestions default to ``CODEPOSTAL_NEARBY_DISTANCE`` and
+    ``CODEPOSTAL_NEARBY_LIMIT``.
+    """
     # dependent_fields={"postal_codes": "postal_codes"}
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, nearby_distance=None, nearby_limit=None, **kwargs):
         if "data_view" not in kwargs:
             kwargs["data_view"] = "codepostal-nearby-select2"
+        self.nearby_distance = nearby_distance
+        self.nearby_limit = nearby_limit
         super().__init__(*args, **kwargs)
 
+    def get_url(self):
+        url = super().get_url()
+        params = {
+            name: value
+            for name, value in (
+                ("dist", self.nearby_distance),
+                ("limit", self.nearby_limit),
+            )
+            if value is not None
+        }
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params)
+        return url
+
     def render(self, *args, **kwargs):
         self.dependent_fields[kwargs["name"]]="postal_codes"
         # the "_":"_" is a hack of django-select2 for inhibiting reset of postal_codes on postal_codes change
@@ -18,4 +44,48 @@ class MultiplePostalCodesWithSuggest(HeavySelect2MultipleWidget):
     def build_attrs(self, base_attrs, extra_attrs=None):
         attrs = super().build_attrs(base_attrs, extra_attrs)
         attrs["data-minimum-input-length"] = 0
+        if get_setting("CODEPOSTAL_OFFLINE"):
+            # not at module level: imported by the package, before the models
+            from .offline import dataset_url
+
+            url = dataset_url()
+            if url is not None:
+                # completion in the browser, see the offline module
+                attrs["data-codepostal-offline"] = url
+                attrs["data-codepostal-nearby-distance"] = (
+                    self.nearby_distance or get_setting("CODEPOSTAL_NEARBY_DISTANCE")
+                )
+                attrs["data-codepostal-nearby-limit"] = (
+                    self.nearby_limit or get_setting("CODEPOSTAL_NEARBY_LIMIT")
+                )
+        return attrs
+
+    @property
+    def media(self):
+        media = super().media
+        if get_setting("CODEPOSTAL_OFFLINE"):
+            # after django_select2.js, whose select2 calls it hooks
+            media += forms.Media(
+                js=[
+                    "django_select2/django_select2.js",
+                    "dj_codepostal_fr/codepostal-offline.js",
+                ]
+            )
+        return media
+
+
+class MultipleCommunes(HeavySelect2MultipleWidget):
+    """
+    Communes searched by name, INSEE or postal code; values are
+    "<INSEE code>/<postal code>"
+    """
+
+    def __init__(self, *args, **kwargs):
+        if "data_view" not in kwargs:
+            kwargs["data_view"] = "codepostal-communes-select2"
+        super().__init__(*args, **kwargs)
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        attrs["data-minimum-input-length"] = 2
         return attrs
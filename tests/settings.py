@@ -9,3 +9,5 @@ INSTALLED_APPS = (
     "dj_codepostal_fr",
     "tests",
 )
+
+SECRET_KEY = "tests"
@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from pytz import UTC
+
+from dj_codepostal_fr.async_utils import (
+    acomplete_and_suggest,
+    apostal_code_location,
+    apostal_codes_completion,
+    apostal_codes_nearby,
+)
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
+from dj_codepostal_fr.utils import _nearby_cache_key, complete_and_suggest
+from dj_codepostal_fr.views import async_area_view
+
+from .test_utils import MockResponse
+
+
+def codes_response(*codes):
+    return MockResponse(
+        200,
+        {"records": [{"record": {"fields": {"code_postal": code}}} for code in codes]},
+    )
+
+
+class TestAsyncLookups(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32000", "32100", "32200"]]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id="32000", longitude=0.57, latitude=43.65),
+                CodePostalLocation(code_id="32100", longitude=0.39, latitude=43.95),
+                CodePostalLocation(code_id="32200", longitude=0.87, latitude=43.60),
+            ]
+        )
+        CodePostalCompletions.store("321", ["32100", "32111"])
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    @mock.patch("dj_codepostal_fr.datanova.aget")
+    async def test_stored(self, mock_get):
+        self.assertEqual(
+            await apostal_code_location("32000"), {"lon": 0.57, "lat": 43.65}
+        )
+        self.assertEqual(
+            sorted(await apostal_codes_completion("321")), ["32100", "32111"]
+        )
+        self.assertEqual(await apostal_codes_completion("3211"), ["32111"])
+        mock_get.assert_not_called()
+
+    @mock.patch("dj_codepostal_fr.datanova.aget")
+    async def test_nearby(self, mock_get):
+        mock_get.return_value = codes_response("32000", "32550")
+        self.assertEqual(
+            await apostal_codes_nearby(postal_code="32000"), ["32000", "32550"]
+        )
+        # cached
+        self.assertEqual(
+            await apostal_codes_nearby(postal_code="32000"), ["32000", "32550"]
+        )
+        mock_get.assert_called_once()
+
+    @override_settings(CODEPOSTAL_ASYNC_CONCURRENCY=2)
+    async def test_concurrent_nearby(self):
+        running = 0
+        max_running = 0
+
+        async def slow_get(params):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return codes_response("32300")
+
+        with mock.patch(
+            "dj_codepostal_fr.datanova.aget", side_effect=slow_get
+        ) as mock_get:
+            res = await acomplete_and_suggest(["32000", "32100", "32200"], "")
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(max_running, 2)
+        self.assertEqual(
+            res,
+            [{"text": "À proximité", "children": [{"id": "32300", "text": "32300"}]}],
+        )
+
+    @mock.patch("dj_codepostal_fr.datanova.aget")
+    async def test_throttled(self, mock_get):
+        mock_get.return_value = MockResponse(
+            status_code=429, json={"reset_time": datetime.now(tz=UTC).isoformat()}
+        )
+        res = await acomplete_and_suggest(["32000"], "322")
+        self.assertEqual(len(res), 2)
+        for item in res:
+            self.assertIn("Impossible d'obtenir", item["text"])
+
+    @mock.patch("dj_codepostal_fr.datanova.aget")
+    async def test_same_as_sync(self, mock_get):
+        mock_get.return_value = codes_response("32100", "32300")
+        async_res = await acomplete_and_suggest(["32000"], "321")
+        with mock.patch("requests.Session.get") as mock_sync_get:
+            sync_res = await sync_to_async(complete_and_suggest)(["32000"], "321")
+        mock_sync_get.assert_not_called()
+        self.assertEqual(async_res, sync_res)
+
+    @mock.patch("dj_codepostal_fr.datanova.aget")
+    async def test_view(self, mock_get):
+        cache.set(_nearby_cache_key(10, None, None, "32000"), ["32300"])
+        response = await async_area_view(
+            RequestFactory().get(
+                "/codepostal/nearby/", {"postal_codes[]": ["32000"], "term": "3"}
+            )
+        )
+        self.assertEqual(
+            json.loads(response.content),
+            {
+                "err": "nil",
+                "results": [
+                    {
+                        "text": "À proximité",
+                        "children": [{"id": "32300", "text": "32300"}],
+                    }
+                ],
+            },
+        )
+        mock_get.assert_not_called()
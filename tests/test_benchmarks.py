@@ -0,0 +1,22 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from benchmarks.run import run_benchmarks
+
+
+class TestBenchmarks(TestCase):
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_run(self):
+        results = run_benchmarks(iterations=2, latency=0, departments=2)
+        self.assertEqual(len(results["results"]), 16)
+        self.assertEqual(results["results"]["area_view.cold_api"]["iterations"], 2)
+        self.assertGreater(results["parameters"]["api_requests"], 0)
+        self.assertIn("completion.db_query", results["results"])
+
+    def test_cold_db_without_api(self):
+        results = run_benchmarks(iterations=2, latency=0, departments=2, only="cold_db")
+        self.assertEqual(len(results["results"]), 5)
+        self.assertEqual(results["parameters"]["api_requests"], 0)
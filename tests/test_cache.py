@@ -0,0 +1,145 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache as django_cache
+from django.test import SimpleTestCase, override_settings
+
+from dj_codepostal_fr.cache import LocalCache, TwoTierCache
+from dj_codepostal_fr.signals import notify_dataset_changed
+from dj_codepostal_fr.utils import _location_cache_key
+
+
+class TestLocalCache(SimpleTestCase):
+    def test_lru_eviction(self):
+        local = LocalCache(2)
+        local.set("a", 1, 60)
+        local.set("b", 2, 60)
+        self.assertEqual(local.get("a"), 1)
+        local.set("c", 3, 60)
+        # "b" is the least recently used
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("a"), 1)
+        self.assertEqual(local.get("c"), 3)
+        self.assertEqual(len(local), 2)
+
+    def test_ttl(self):
+        local = LocalCache(2)
+        local.set("a", 1, 60)
+        with mock.patch("dj_codepostal_fr.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(local.get("a"))
+        self.assertEqual(len(local), 0)
+
+    def test_counters(self):
+        local = LocalCache(2)
+        local.set("a", 1, 60)
+        local.get("a")
+        local.get("b")
+        self.assertEqual((local.hits, local.misses), (1, 1))
+
+
+class TestTwoTierCache(SimpleTestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.cache = TwoTierCache()
+
+    def tearDown(self):
+        super().tearDown()
+        django_cache.clear()
+
+    def test_disabled(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        self.assertIsNone(self.cache.local)
+        # stored with its freshness
+        self.assertEqual(django_cache.get(key).value, (2.3, 48.8))
+        self.assertEqual(self.cache.get(key), (2.3, 48.8))
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_local_hit(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        with mock.patch.object(django_cache, "get") as backend_get, mock.patch.object(
+            django_cache, "get_many"
+        ) as backend_get_many:
+            self.assertEqual(self.cache.get(key), (2.3, 48.8))
+            self.assertEqual(self.cache.get_many([key]), {key: (2.3, 48.8)})
+        backend_get.assert_not_called()
+        backend_get_many.assert_not_called()
+        self.assertEqual(self.cache.stats()["hits"], 2)
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_other_keys_not_kept(self):
+        self.cache.set("other", 1)
+        self.assertEqual(len(self.cache.local), 0)
+        self.assertEqual(self.cache.get("other"), 1)
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_filled_on_backend_hit(self):
+        key = _location_cache_key("75001")
+        django_cache.set(key, (2.3, 48.8))
+        self.assertEqual(self.cache.get_many([key, "other"]), {key: (2.3, 48.8)})
+        self.assertEqual(self.cache.local.get(key), (2.3, 48.8))
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_delete(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        self.cache.delete(key)
+        self.assertIsNone(self.cache.get(key))
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_clear(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        self.cache.clear()
+        self.assertEqual(len(self.cache.local), 0)
+        self.assertIsNone(self.cache.get(key))
+
+    @override_settings(CODEPOSTAL_LOCAL_CACHE_SIZE=10)
+    def test_cleared_on_dataset_change(self):
+        from dj_codepostal_fr.cache import cache
+
+        key = _location_cache_key("75001")
+        cache.set(key, (2.3, 48.8))
+        self.assertEqual(len(cache.local), 1)
+        notify_dataset_changed()
+        self.assertEqual(len(cache.local), 0)
+
+    @override_settings(
+        CODEPOSTAL_LOCAL_CACHE_SIZE=10, CODEPOSTAL_INDEX_CHECK_INTERVAL=0
+    )
+    def test_cleared_on_version_change(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        # another process changed the dataset
+        with mock.patch("dj_codepostal_fr.cache.dataset_version", return_value="new"):
+            self.assertIsNone(self.cache.local.get(key))
+
+    def test_stale(self):
+        key = _location_cache_key("75001")
+        self.cache.on_stale = mock.Mock()
+        # the backend expiry follows the mocked time too
+        self.cache.set(key, (2.3, 48.8), timeout=None)
+        self.cache.set_many(
+            {"other": 1, _location_cache_key("75002"): False}, timeout=None
+        )
+        self.assertEqual(self.cache.get("other"), 1)
+
+        later = time.time() + 24 * 3600 + 1
+        with mock.patch("dj_codepostal_fr.cache.time.time", return_value=later):
+            # served, and revalidated
+            self.assertEqual(self.cache.get(key), (2.3, 48.8))
+            self.cache.on_stale.assert_not_called()
+            self.assertIs(self.cache.get(_location_cache_key("75002")), False)
+            self.cache.on_stale.assert_called_once_with([_location_cache_key("75002")])
+
+        later = time.time() + 30 * 24 * 3600 + 1
+        with mock.patch("dj_codepostal_fr.cache.time.time", return_value=later):
+            self.assertEqual(self.cache.get_many([key]), {key: (2.3, 48.8)})
+        self.cache.on_stale.assert_called_with([key])
+
+    def test_error_keeps_stale_value(self):
+        key = _location_cache_key("75001")
+        self.cache.set(key, (2.3, 48.8))
+        self.assertFalse(self.cache.add(key, False, timeout=60))
+        self.assertEqual(self.cache.get(key), (2.3, 48.8))
@@ -0,0 +1,133 @@
+import io
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+
+from dj_codepostal_fr.communes import (
+    CommuneIndex,
+    CommuneMatch,
+    commune_index,
+    fold,
+    search_communes,
+)
+from dj_codepostal_fr.hexasmal import import_records, iter_records
+from dj_codepostal_fr.models import Commune
+from dj_codepostal_fr.views import communes_view
+
+CSV_EXPORT = """#Code_commune_INSEE;Nom_commune;Code_postal;Ligne_5;Libellé_d_acheminement;coordonnees_gps
+42218;ST ETIENNE;42000;;ST ETIENNE;45.4301,4.3872
+42218;ST ETIENNE;42100;;ST ETIENNE;45.4301,4.3872
+42218;ST ETIENNE;42100;ST VICTOR SUR LOIRE;ST ETIENNE;45.4470,4.2570
+42204;ST CHRISTO EN JAREZ;42320;;ST CHRISTO EN JAREZ;45.5430,4.4870
+42207;ST ETIENNE LE MOLARD;42130;;ST ETIENNE LE MOLARD;45.7360,4.0960
+76217;ETRETAT;76790;;ETRETAT;49.7070,0.2030
+06088;NICE;06000;;NICE;43.7120,7.2380
+"""
+
+
+class TestFold(TestCase):
+    def test_fold(self):
+        self.assertEqual(fold("Saint-Étienne"), ["saint", "etienne"])
+        self.assertEqual(fold("ST ETIENNE"), ["saint", "etienne"])
+        self.assertEqual(fold("L'Haÿ-les-Roses"), ["l", "hay", "les", "roses"])
+        self.assertEqual(fold("  "), [])
+
+
+class TestCommuneIndex(TestCase):
+    def setUp(self):
+        cache.clear()
+        import_records(iter_records(io.StringIO(CSV_EXPORT), "csv"))
+        self.index = CommuneIndex()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+        commune_index.invalidate()
+
+    def test_import(self):
+        self.assertEqual(Commune.objects.count(), 6)
+        commune = Commune.objects.get(insee="42218", postal_code="42100")
+        self.assertEqual(commune.name, "ST ETIENNE")
+        self.assertAlmostEqual(commune.longitude, (4.3872 + 4.2570) / 2)
+
+    def test_search(self):
+        self.assertEqual(
+            self.index.search("st etien"),
+            [
+                CommuneMatch("42218", "ST ETIENNE", "42000"),
+                CommuneMatch("42218", "ST ETIENNE", "42100"),
+                CommuneMatch("42207", "ST ETIENNE LE MOLARD", "42130"),
+            ],
+        )
+        self.assertEqual(
+            self.index.search("Saint-Étienne le"),
+            [CommuneMatch("42207", "ST ETIENNE LE MOLARD", "42130")],
+        )
+        # whole words first
+        self.assertEqual(
+            [match.name for match in self.index.search("etienne")],
+            ["ST ETIENNE", "ST ETIENNE", "ST ETIENNE LE MOLARD"],
+        )
+        self.assertEqual(self.index.search("ETR"), [self.index.search("etretat")[0]])
+        self.assertEqual(self.index.search("st etien", limit=1)[0].postal_code, "42000")
+
+    def test_no_match(self):
+        # matches the beginning of words only
+        self.assertEqual(self.index.search("tienne"), [])
+        self.assertEqual(self.index.search("st paul"), [])
+        self.assertEqual(self.index.search("zzz"), [])
+        # too short, "st" is expanded
+        self.assertEqual(self.index.search("et"), [])
+        self.assertEqual(len(self.index.search("st")), 4)
+        self.assertEqual(self.index.search(""), [])
+
+    def test_codes(self):
+        self.assertEqual(
+            [match.postal_code for match in self.index.search("422")],
+            ["42320", "42130", "42000", "42100"],
+        )
+        self.assertEqual(
+            self.index.search("06000"), [CommuneMatch("06088", "NICE", "06000")]
+        )
+        self.assertEqual(
+            self.index.search("0608"), [CommuneMatch("06088", "NICE", "06000")]
+        )
+
+    def test_rebuilt_on_import(self):
+        self.assertEqual(
+            search_communes("nice"), [CommuneMatch("06088", "NICE", "06000")]
+        )
+        export = "code_commune_insee;nom_commune;code_postal\n06088;NICE;06100\n"
+        import_records(iter_records(io.StringIO(export), "csv"))
+        self.assertEqual(
+            [match.postal_code for match in search_communes("nice")],
+            ["06000", "06100"],
+        )
+
+    def test_view(self):
+        with mock.patch("dj_codepostal_fr.utils._call") as mock_call:
+            response = communes_view(
+                RequestFactory().get("/codepostal/communes/", {"term": "st etien"})
+            )
+            mock_call.assert_not_called()
+        self.assertIn("ETag", response)
+        self.assertEqual(
+            json.loads(response.content)["results"][0],
+            {
+                "id": "42218/42000",
+                "text": "ST ETIENNE (42000)",
+                "insee": "42218",
+                "postal_code": "42000",
+            },
+        )
+
+        not_modified = communes_view(
+            RequestFactory().get(
+                "/codepostal/communes/",
+                {"term": "st etien"},
+                HTTP_IF_NONE_MATCH=response["ETag"],
+            )
+        )
+        self.assertEqual(not_modified.status_code, 304)
@@ -0,0 +1,151 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+import requests
+from unittest import skipIf
+
+from dj_codepostal_fr import datanova
+from dj_codepostal_fr.signals import datanova_attempt
+from dj_codepostal_fr.async_utils import apostal_code_location
+from dj_codepostal_fr.utils import postal_code_location
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # list of (status, delay in seconds) served in order, the last one is repeated
+    responses = [(200, 0)]
+    requests_count = 0
+
+    def do_GET(self):
+        cls = type(self)
+        status, delay = cls.responses[min(cls.requests_count, len(cls.responses) - 1)]
+        cls.requests_count += 1
+        time.sleep(delay)
+        body = json.dumps(
+            {
+                "total_count": 1,
+                "records": [
+                    {
+                        "record": {
+                            "fields": {
+                                "code_postal": "32000",
+                                "coordonnees_gps": {"lon": 0.57, "lat": 43.65},
+                            }
+                        }
+                    }
+                ],
+            }
+        ).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client timed out
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDatanovaClient(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = "http://127.0.0.1:%s/records" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        StubHandler.requests_count = 0
+        datanova.reset_session()
+        self.settings_override = override_settings(
+            CODEPOSTAL_DATANOVA_URL=self.url,
+            CODEPOSTAL_HTTP_BACKOFF=0.01,
+            CODEPOSTAL_HTTP_READ_TIMEOUT=0.2,
+        )
+        self.settings_override.enable()
+        self.attempts = []
+        datanova_attempt.connect(self._record_attempt)
+
+    def tearDown(self):
+        datanova_attempt.disconnect(self._record_attempt)
+        self.settings_override.disable()
+        datanova.reset_session()
+        cache.clear()
+        super().tearDown()
+
+    def _record_attempt(self, sender, **kwargs):
+        self.attempts.append(kwargs)
+
+    def test_keep_alive(self):
+        StubHandler.responses = [(200, 0)]
+        datanova.get({})
+        datanova.get({})
+        self.assertIs(datanova.get_session(), datanova.get_session())
+        self.assertEqual(StubHandler.requests_count, 2)
+        self.assertEqual([a["status_code"] for a in self.attempts], [200, 200])
+        self.assertTrue(all(a["duration"] >= 0 for a in self.attempts))
+
+    def test_retry_server_error(self):
+        StubHandler.responses = [(503, 0), (502, 0), (200, 0)]
+        response = datanova.get({})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a["status_code"] for a in self.attempts], [503, 502, 200])
+
+    def test_retries_exhausted(self):
+        StubHandler.responses = [(503, 0)]
+        with override_settings(CODEPOSTAL_HTTP_RETRIES=1):
+            response = datanova.get({})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(StubHandler.requests_count, 2)
+
+    def test_timeout(self):
+        StubHandler.responses = [(200, 0.5), (200, 0)]
+        response = datanova.get({})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(self.attempts[0]["error"], requests.Timeout)
+
+        StubHandler.responses = [(200, 0.5)]
+        with override_settings(CODEPOSTAL_HTTP_RETRIES=0):
+            with self.assertRaises(requests.Timeout):
+                datanova.get({})
+
+    def test_location(self):
+        StubHandler.responses = [(500, 0), (200, 0)]
+        self.assertEqual(postal_code_location("32000"), {"lon": 0.57, "lat": 43.65})
+
+    def test_location_unreachable(self):
+        StubHandler.responses = [(200, 0.5)]
+        with override_settings(CODEPOSTAL_HTTP_RETRIES=0):
+            self.assertIsNone(postal_code_location("32000"))
+        # not cached, next call succeeds
+        StubHandler.responses = [(200, 0)]
+        self.assertEqual(postal_code_location("32000"), {"lon": 0.57, "lat": 43.65})
+
+    @skipIf(datanova.httpx is None, "httpx is not installed")
+    async def test_async(self):
+        StubHandler.responses = [(503, 0), (200, 0.5), (200, 0)]
+        response = await datanova.aget({})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a["status_code"] for a in self.attempts], [503, None, 200])
+        self.assertIsInstance(self.attempts[1]["error"], requests.Timeout)
+
+    async def test_async_location(self):
+        StubHandler.responses = [(200, 0)]
+        self.assertEqual(
+            await apostal_code_location("32000"), {"lon": 0.57, "lat": 43.65}
+        )
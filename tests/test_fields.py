@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django import forms
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr.fields import MultiplePostalCodesField
+from dj_codepostal_fr.index import prefix_index
+from dj_codepostal_fr.models import CodePostal, CodePostalCompletions
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    postal_code_location,
+    unknown_postal_codes,
+)
+from dj_codepostal_fr.widgets import MultiplePostalCodesWithSuggest
+
+from .test_utils import MockResponse
+
+
+class PostalCodesForm(forms.Form):
+    postal_codes = MultiplePostalCodesField()
+
+
+class TestMultiplePostalCodesField(TestCase):
+    def setUp(self):
+        cache.clear()
+        prefix_index.invalidate()
+        CodePostalCompletions.store("321", ["32100", "32110"])
+        CodePostalCompletions.store("322", ["32200"])
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+        prefix_index.invalidate()
+
+    def test_valid(self):
+        form = PostalCodesForm({"postal_codes": ["32100", "32200", "32110"]})
+        # stored codes: one query
+        with self.assertNumQueries(1):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["postal_codes"], ["32100", "32200", "32110"])
+
+    def test_invalid(self):
+        form = PostalCodesForm({"postal_codes": ["32100", "3210"]})
+        with self.assertNumQueries(0):
+            self.assertFalse(form.is_valid())
+
+        form = PostalCodesForm({"postal_codes": ["32100", "32101", "32201"]})
+        self.assertFalse(form.is_valid())
+        self.assertIn("32101", form.errors["postal_codes"][0])
+
+    @mock.patch("requests.Session.get")
+    def test_stored_unknown(self, mock_get):
+        # reported missing by the API, then typed in a form
+        mock_get.return_value = MockResponse(200, {"total_count": 0, "records": []})
+        self.assertIsNone(postal_code_location("32199"))
+        CodePostal.objects.ensure(["32198"])
+
+        form = PostalCodesForm({"postal_codes": ["32100", "32198", "32199"]})
+        self.assertFalse(form.is_valid())
+        self.assertIn("32198", form.errors["postal_codes"][0])
+        self.assertEqual(unknown_postal_codes(["32199", "32100"]), ["32199"])
+
+    @override_settings(CODEPOSTAL_PREFIX_INDEX=True)
+    def test_prefix_index(self):
+        prefix_index.load()
+        with self.assertNumQueries(0):
+            self.assertEqual(unknown_postal_codes(["32100", "32200"]), [])
+
+    @mock.patch("dj_codepostal_fr.utils.postal_codes_completion")
+    def test_unknown_groups(self, mock_completion):
+        mock_completion.return_value = ["33000"]
+        self.assertEqual(
+            unknown_postal_codes(["32100", "33000", "33001", "33002"]),
+            ["33001", "33002"],
+        )
+        # one lookup per group
+        mock_completion.assert_called_once_with("330")
+
+        # not known to be unknown
+        mock_completion.side_effect = DatanovaThrottlingException()
+        self.assertEqual(unknown_postal_codes(["33001"]), [])
+        mock_completion.side_effect = None
+        mock_completion.return_value = None
+        self.assertEqual(unknown_postal_codes(["33001"]), [])
+
+    def test_check_exists(self):
+        field = MultiplePostalCodesField()
+        field.check_exists = False
+        with self.assertNumQueries(0):
+            self.assertEqual(field.clean(["32101"]), ["32101"])
+
+
+@override_settings(ROOT_URLCONF="dj_codepostal_fr.urls")
+class TestMultiplePostalCodesWithSuggest(TestCase):
+    def test_nearby_params(self):
+        widget = MultiplePostalCodesWithSuggest()
+        self.assertEqual(widget.get_url(), "/codepostal/nearby/")
+
+        widget = MultiplePostalCodesWithSuggest(nearby_distance=20, nearby_limit=5)
+        self.assertEqual(widget.get_url(), "/codepostal/nearby/?dist=20&limit=5")
+        self.assertEqual(
+            widget.build_attrs({})["data-ajax--url"],
+            "/codepostal/nearby/?dist=20&limit=5",
+        )
@@ -0,0 +1,105 @@
+from datetime import datetime
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from pytz import UTC
+
+from dj_codepostal_fr import fragments
+from dj_codepostal_fr.fragments import (
+    acomplete_and_suggest_json,
+    complete_and_suggest_json,
+)
+from dj_codepostal_fr.models import CodePostal, CodePostalCompletions
+from dj_codepostal_fr.utils import _nearby_cache_key, complete_and_suggest
+from dj_codepostal_fr.views import area_view
+
+from .test_utils import MockResponse
+
+class TestFragments(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragments._code_fragments.clear()
+        fragments._group_fragments.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "32110", "32120", "32200"]]
+        )
+        CodePostalCompletions.store("321", ["32100", "32110", "32120"])
+        cache.set(_nearby_cache_key(10, None, None, "32100"), ["32100", "32110", "32200"])
+        cache.set(_nearby_cache_key(10, None, None, "32200"), ["32200", "32300"])
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    cases = [
+        ([], "321"),
+        ([], "3211"),
+        ([], "329"),
+        ([], "32"),
+        (["32100"], ""),
+        (["32100"], "321"),
+        (["32100", "32200"], "32"),
+        (["32100", "32110", "32120"], "321"),
+    ]
+
+    @mock.patch("requests.Session.get")
+    def assert_equivalent(self, mock_get):
+        mock_get.return_value = MockResponse(200, {"total_count": 0, "records": []})
+        for postal_codes, term in self.cases * 2:
+            with self.subTest(postal_codes=postal_codes, term=term):
+                expected = {
+                    "err": "nil",
+                    "results": complete_and_suggest(postal_codes, term),
+                }
+                body, complete = complete_and_suggest_json(postal_codes, term)
+                self.assertEqual(json.loads(body), expected)
+                self.assertTrue(complete)
+                body, complete = async_to_sync(acomplete_and_suggest_json)(
+                    postal_codes, term
+                )
+                self.assertEqual(json.loads(body), expected)
+
+    def test_equivalent(self):
+        self.assert_equivalent()
+        self.assertIn("321", fragments._group_fragments)
+
+    def test_equivalent_without_orjson(self):
+        with mock.patch("dj_codepostal_fr.fragments.orjson", None):
+            self.assert_equivalent()
+
+    def test_group_changed(self):
+        complete_and_suggest_json([], "321")
+        CodePostalCompletions.store("321", ["32130"])
+        cache.clear()
+        body, _ = complete_and_suggest_json([], "321")
+        self.assertEqual(
+            [item["id"] for item in json.loads(body)["results"]],
+            ["32100", "32110", "32120", "32130"],
+        )
+
+    @mock.patch("requests.Session.get")
+    def test_throttled(self, mock_get):
+        mock_get.return_value = MockResponse(
+            status_code=429, json={"reset_time": datetime.now(tz=UTC).isoformat()}
+        )
+        cache.delete(_nearby_cache_key(10, None, None, "32200"))
+        expected = {"err": "nil", "results": complete_and_suggest(["32200"], "322")}
+        body, complete = complete_and_suggest_json(["32200"], "322")
+        self.assertEqual(json.loads(body), expected)
+        self.assertFalse(complete)
+
+    @override_settings(CODEPOSTAL_FAST_JSON=True)
+    def test_view(self):
+        request = RequestFactory().get(
+            "/codepostal/nearby/", {"postal_codes[]": ["32100"], "term": "321"}
+        )
+        response = area_view(request)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIn("ETag", response)
+        self.assertEqual(
+            json.loads(response.content),
+            {"err": "nil", "results": complete_and_suggest(["32100"], "321")},
+        )
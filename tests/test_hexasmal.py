@@ -0,0 +1,110 @@
+import io
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from dj_codepostal_fr.hexasmal import import_records, iter_records
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
+from dj_codepostal_fr.utils import postal_code_location, postal_codes_completion
+
+CSV_EXPORT = """#Code_commune_INSEE;Nom_commune;Code_postal;Ligne_5;Libellé_d_acheminement;coordonnees_gps
+32013;AUCH;32000;;AUCH;43.6534,0.5755
+32107;CONDOM;32100;;CONDOM;43.9578,0.3922
+32048;BLAZIERT;32100;;BLAZIERT;43.9142,0.4781
+01001;L ABERGEMENT CLEMENCIAT;01400;;L ABERGEMENT CLEMENCIAT;46.1534,4.9260
+"""
+
+JSON_EXPORT = """[
+{"datasetid": "laposte_hexasmal", "fields": {"code_commune_insee": "32013", "code_postal": "32000", "coordonnees_gps": [43.6534, 0.5755]}},
+{"datasetid": "laposte_hexasmal", "fields": {"code_commune_insee": "32107", "code_postal": "32100", "coordonnees_gps": [43.9578, 0.3922]}},
+{"datasetid": "laposte_hexasmal", "fields": {"code_commune_insee": "32048", "code_postal": "32100", "coordonnees_gps": [43.9142, 0.4781]}},
+{"datasetid": "laposte_hexasmal", "fields": {"code_commune_insee": "01001", "code_postal": 1400, "coordonnees_gps": [46.1534, 4.9260]}}
+]"""
+
+
+class TestIterRecords(TestCase):
+    def test_csv(self):
+        records = list(iter_records(io.StringIO(CSV_EXPORT), "csv"))
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]["postal_code"], "32000")
+        self.assertEqual(records[0]["name"], "AUCH")
+        self.assertAlmostEqual(records[0]["lon"], 0.5755)
+        self.assertAlmostEqual(records[0]["lat"], 43.6534)
+
+    def test_json(self):
+        with mock.patch("dj_codepostal_fr.hexasmal._JSON_CHUNK_SIZE", 16):
+            records = list(iter_records(io.StringIO(JSON_EXPORT), "json"))
+        self.assertEqual(
+            [record["postal_code"] for record in records],
+            ["32000", "32100", "32100", "01400"],
+        )
+        self.assertAlmostEqual(records[1]["lon"], 0.3922)
+
+
+class TestImport(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_import(self):
+        # a previous API failure must not shadow the imported data
+        cache.set("codepostal.utils._AeL3zuay" + "location32100", False)
+        # e.g. typed in a form before the import
+        CodePostal.objects.create(code="32000", known=False)
+        stats = import_records(
+            iter_records(io.StringIO(CSV_EXPORT), "csv"), batch_size=2
+        )
+        self.assertEqual(
+            stats, {"rows": 4, "postal_codes": 3, "prefixes": 3, "communes": 4}
+        )
+        self.assertEqual(CodePostal.objects.filter(known=True).count(), 3)
+        self.assertEqual(
+            sorted(CodePostalCompletions.complete("321")), ["32100"]
+        )
+        location = CodePostalLocation.objects.get(code="32100")
+        self.assertAlmostEqual(location.longitude, (0.3922 + 0.4781) / 2)
+
+        with mock.patch("dj_codepostal_fr.utils._call") as mock_call:
+            self.assertAlmostEqual(
+                postal_code_location("32100")["lat"], (43.9578 + 43.9142) / 2
+            )
+            self.assertEqual(postal_codes_completion("014"), ["01400"])
+            cache.clear()
+            self.assertIsNotNone(postal_code_location("01400"))
+            self.assertEqual(postal_codes_completion("3200"), ["32000"])
+            mock_call.assert_not_called()
+
+    def test_reimport_updates(self):
+        import_records(iter_records(io.StringIO(CSV_EXPORT), "csv"))
+        import_records(
+            iter_records(
+                io.StringIO(
+                    "code_postal;coordonnees_gps\n32000;44.0,1.0\n32001;44.0,1.0\n"
+                ),
+                "csv",
+            )
+        )
+        self.assertEqual(CodePostal.objects.count(), 4)
+        self.assertEqual(
+            CodePostalLocation.objects.get(code="32000").longitude, 1.0
+        )
+        self.assertEqual(
+            sorted(CodePostalCompletions.complete("320")), ["32000", "32001"]
+        )
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as export:
+            export.write(JSON_EXPORT)
+            export.flush()
+            call_command("import_hexasmal", export.name, stdout=io.StringIO())
+        self.assertEqual(CodePostalLocation.objects.count(), 3)
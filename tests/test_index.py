@@ -0,0 +1,176 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr.index import (
+    PostalCodeIndex,
+    SpatialIndex,
+    prefix_index,
+    spatial_index,
+)
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation
+from dj_codepostal_fr.utils import (
+    complete_and_suggest,
+    has_error_items,
+    postal_codes_completion,
+    postal_codes_nearby,
+    postal_codes_nearby_many,
+)
+
+
+class TestPostalCodeIndex(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "32111", "32200", "01400"]]
+        )
+        self.index = PostalCodeIndex()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+        prefix_index.invalidate()
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete("3"), ["32100", "32111", "32200"])
+        self.assertEqual(self.index.complete("321"), ["32100", "32111"])
+        self.assertEqual(self.index.complete("32111"), ["32111"])
+        self.assertEqual(self.index.complete("99"), [])
+        self.assertIn("01400", self.index)
+        self.assertNotIn("01401", self.index)
+
+    def test_rebuild_on_change(self):
+        self.assertEqual(self.index.complete("014"), ["01400"])
+        with override_settings(CODEPOSTAL_INDEX_CHECK_INTERVAL=0):
+            CodePostal.objects.create(code="01410")
+            self.assertEqual(self.index.complete("014"), ["01400", "01410"])
+
+    def test_invalidated_by_signal(self):
+        prefix_index.load()
+        CodePostal.objects.create(code="01410")
+        self.assertFalse(prefix_index.loaded)
+
+    @override_settings(CODEPOSTAL_PREFIX_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_completion(self, mock_call):
+        with mock.patch("dj_codepostal_fr.utils.cache") as mock_cache:
+            self.assertEqual(postal_codes_completion("3211"), ["32111"])
+            self.assertEqual(postal_codes_completion("3219"), [])
+            mock_cache.get.assert_not_called()
+        mock_call.assert_not_called()
+
+    @override_settings(CODEPOSTAL_PREFIX_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_completion_fallback(self, mock_call):
+        mock_call.return_value = None
+        self.assertIsNone(postal_codes_completion("330"))
+        mock_call.assert_called_once()
+
+
+# (code, lon, lat)
+LOCATIONS = [
+    ("32000", 0.5755, 43.6534),  # Auch
+    ("32550", 0.6247, 43.6101),  # Pavie, ~6 km from Auch
+    ("32100", 0.3922, 43.9578),  # Condom, ~37 km from Auch
+    ("75001", 2.3417, 48.8626),  # Paris
+]
+
+
+class TestSpatialIndex(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code, _, _ in LOCATIONS + [("32999", 0, 0)]]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id=code, longitude=lon, latitude=lat)
+                for code, lon, lat in LOCATIONS
+            ]
+            + [CodePostalLocation(code_id="32999", longitude=None, latitude=None)]
+        )
+        self.index = SpatialIndex()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+        spatial_index.invalidate()
+
+    def test_nearby(self):
+        lon, lat = self.index.location("32000")
+        self.assertEqual(
+            [code for code, _ in self.index.nearby(lon, lat, 10)], ["32000", "32550"]
+        )
+        nearby = self.index.nearby(lon, lat, 50)
+        self.assertEqual([code for code, _ in nearby], ["32000", "32550", "32100"])
+        self.assertAlmostEqual(nearby[2][1], 37.0, delta=1)
+        self.assertEqual(len(self.index.nearby(lon, lat, 1000)), 4)
+        self.assertEqual(len(self.index.nearby(lon, lat, 1000, limit=2)), 2)
+        self.assertIsNone(self.index.location("32999"))
+
+    @override_settings(CODEPOSTAL_SPATIAL_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_postal_codes_nearby(self, mock_call):
+        self.assertEqual(
+            postal_codes_nearby(dist_km=50, postal_code="32000"),
+            ["32000", "32550", "32100"],
+        )
+        self.assertEqual(
+            postal_codes_nearby(dist_km=50, postal_code="32000", limit=1), ["32000"]
+        )
+        self.assertEqual(
+            postal_codes_nearby(dist_km=5, lon=2.34, lat=48.86), ["75001"]
+        )
+        mock_call.assert_not_called()
+
+    @override_settings(CODEPOSTAL_SPATIAL_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_postal_codes_nearby_fallback(self, mock_call):
+        mock_call.return_value = None
+        self.assertIsNone(postal_codes_nearby(postal_code="32999"))
+
+    def test_nearby_many(self):
+        points = [self.index.location("32550"), self.index.location("75001")]
+        nearby = self.index.nearby_many(points, 10)
+        self.assertEqual({code for code, _ in nearby[:2]}, {"75001", "32550"})
+        self.assertEqual(nearby[2][0], "32000")
+        self.assertAlmostEqual(nearby[2][1], 6.0, delta=1)
+        # the closest code of each point: themselves
+        closest = self.index.nearby_many(points, 10, limit_per_point=1)
+        self.assertEqual({code for code, _ in closest}, {"75001", "32550"})
+        with mock.patch("dj_codepostal_fr.index.numpy", None):
+            self.index.load()
+            nearby_fallback = self.index.nearby_many(points, 10)
+            closest_fallback = self.index.nearby_many(points, 10, limit_per_point=1)
+        self.assertEqual(closest_fallback, closest)
+        self.assertEqual(len(nearby_fallback), 3)
+        self.assertEqual(nearby_fallback[2][0], "32000")
+        self.assertAlmostEqual(nearby_fallback[2][1], nearby[2][1])
+        self.assertEqual(len(self.index.nearby_many(points, 10, limit=1)), 1)
+        self.assertEqual(self.index.nearby_many([], 10), [])
+
+    @override_settings(CODEPOSTAL_SPATIAL_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_postal_codes_nearby_many(self, mock_call):
+        mock_call.return_value = None
+        self.assertEqual(
+            postal_codes_nearby_many(["32100", "32999", "75001"], dist_km=40)[2:],
+            ["32000"],
+        )
+        self.assertEqual(
+            postal_codes_nearby_many(["32000"], dist_km=40, code_limit=2),
+            ["32000", "32550"],
+        )
+
+    @override_settings(CODEPOSTAL_SPATIAL_INDEX=True)
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_complete_and_suggest(self, mock_call):
+        mock_call.return_value = None
+        res = complete_and_suggest(["32000", "32999", "75001", "99999"], "")
+        self.assertEqual(len(res), 2)
+        self.assertEqual([item["id"] for item in res[0]["children"]], ["32550"])
+        # the API failed for the unknown code
+        self.assertTrue(has_error_items(res))
+        # only for the unknown code
+        mock_call.assert_called_once()
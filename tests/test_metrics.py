@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from pytz import UTC
+
+from dj_codepostal_fr.metrics import registry
+from dj_codepostal_fr.models import CodePostal, CodePostalCompletions
+from dj_codepostal_fr.signals import lookup_tier, lookup_timed
+from dj_codepostal_fr.utils import (
+    DatanovaThrottlingException,
+    complete_and_suggest,
+    postal_codes_completion,
+)
+from dj_codepostal_fr.views import metrics_view
+
+from .test_utils import MockResponse
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "32200"]]
+        )
+        CodePostalCompletions.store("321", ["32100"])
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+        registry.reset()
+
+    def test_disabled(self):
+        receiver = mock.Mock()
+        lookup_tier.connect(receiver)
+        lookup_timed.connect(receiver)
+        self.addCleanup(lookup_tier.disconnect, receiver)
+        self.addCleanup(lookup_timed.disconnect, receiver)
+
+        self.assertEqual(postal_codes_completion("321"), ["32100"])
+        receiver.assert_not_called()
+        with self.assertRaises(Http404):
+            metrics_view(RequestFactory().get("/codepostal/metrics/"))
+
+    @override_settings(CODEPOSTAL_METRICS=True)
+    def test_tiers(self):
+        self.assertEqual(postal_codes_completion("321"), ["32100"])
+        self.assertEqual(postal_codes_completion("3210"), ["32100"])
+        self.assertEqual(
+            registry.get("codepostal_lookup_tier_total", lookup="completion", tier="db"),
+            1,
+        )
+        self.assertEqual(
+            registry.get(
+                "codepostal_lookup_tier_total", lookup="completion", tier="cache"
+            ),
+            1,
+        )
+        count, total = registry.summaries["codepostal_lookup_seconds"][
+            (("lookup", "completion"),)
+        ]
+        self.assertEqual(count, 2)
+        self.assertGreater(total, 0)
+
+    @override_settings(CODEPOSTAL_METRICS=True)
+    @mock.patch("requests.Session.get")
+    def test_throttling(self, mock_get):
+        mock_get.return_value = MockResponse(
+            status_code=429,
+            json={
+                "reset_time": (datetime.now(tz=UTC) + timedelta(seconds=60)).isoformat()
+            },
+        )
+        with self.assertRaises(DatanovaThrottlingException):
+            postal_codes_completion("322")
+        with self.assertRaises(DatanovaThrottlingException):
+            postal_codes_completion("323")
+        self.assertEqual(mock_get.call_count, 1)
+
+        self.assertEqual(registry.get("codepostal_datanova_throttled_total"), 1)
+        self.assertAlmostEqual(
+            registry.get("codepostal_datanova_throttled_seconds_total"), 60, delta=2
+        )
+        self.assertEqual(registry.get("codepostal_datanova_rejected_total"), 1)
+        count, _ = registry.summaries["codepostal_datanova_request_seconds"][
+            (("status", "429"),)
+        ]
+        self.assertEqual(count, 1)
+
+    @override_settings(CODEPOSTAL_METRICS=True)
+    def test_view(self):
+        complete_and_suggest([], "321")
+        response = metrics_view(RequestFactory().get("/codepostal/metrics/"))
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn("# TYPE codepostal_lookup_tier_total counter", text)
+        self.assertIn(
+            'codepostal_lookup_tier_total{lookup="completion",tier="db"} 1', text
+        )
+        self.assertIn("# TYPE codepostal_lookup_seconds summary", text)
+        self.assertIn(
+            'codepostal_lookup_seconds_count{lookup="complete_and_suggest"} 1', text
+        )
@@ -0,0 +1,180 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+
+from dj_codepostal_fr.fields import MultiplePostalCodesField
+from dj_codepostal_fr.models import CodePostal, CodePostalCompletions, CodePostalMany
+from dj_codepostal_fr.signals import dataset_version
+
+
+class TestCodePostalCompletions(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [
+                CodePostal(code=code)
+                for code in ["09900", "09999", "10000", "32100", "32111", "99999"]
+            ]
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_starting_with(self):
+        self.assertEqual(CodePostal.starting_with("099"), ["09900", "09999"])
+        self.assertEqual(CodePostal.starting_with("0999"), ["09999"])
+        self.assertEqual(CodePostal.starting_with("321"), ["32100", "32111"])
+        self.assertEqual(CodePostal.starting_with("999"), ["99999"])
+        self.assertEqual(CodePostal.starting_with("555"), [])
+
+    def test_complete(self):
+        with self.assertRaises(CodePostalCompletions.DoesNotExist):
+            CodePostalCompletions.complete("321")
+        CodePostalCompletions.store("321", [])
+        self.assertEqual(CodePostalCompletions.complete("321"), ["32100", "32111"])
+        self.assertEqual(CodePostalCompletions.complete("3211"), ["32111"])
+        self.assertEqual(
+            CodePostalCompletions.objects.get(portion="321").get_completions(),
+            ["32100", "32111"],
+        )
+
+    def test_store(self):
+        version = dataset_version()
+        CodePostalCompletions.store("321", ["32100", "32111"])
+        self.assertEqual(dataset_version(), version)
+
+        # filled from the API: not a change of the dataset
+        CodePostalCompletions.store("321", ["32100", "32150", "32150"])
+        self.assertEqual(dataset_version(), version)
+        self.assertEqual(
+            CodePostalCompletions.complete("321"), ["32100", "32111", "32150"]
+        )
+        with self.assertRaises(ValueError):
+            CodePostalCompletions.store("32", ["32100"])
+        with self.assertRaises(ValueError):
+            CodePostalCompletions.store("321", ["32200"])
+
+
+class TestCodePostalManager(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.create(code="32100")
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_ensure(self):
+        version = dataset_version()
+        with self.assertNumQueries(2):
+            postal_codes = CodePostal.objects.ensure(
+                ["32200", "32100", "32200", "32300"]
+            )
+        self.assertEqual(
+            [postal_code.code for postal_code in postal_codes],
+            ["32200", "32100", "32300"],
+        )
+        self.assertEqual(dataset_version(), version)
+        # not known from the dataset nor the API
+        self.assertEqual(CodePostal.starting_with("32"), ["32100"])
+        self.assertFalse(postal_codes[0].known)
+
+        version = dataset_version()
+        with self.assertNumQueries(1):
+            self.assertEqual(len(CodePostal.objects.ensure(["32100", "32300"])), 2)
+        self.assertEqual(dataset_version(), version)
+        with self.assertNumQueries(0):
+            self.assertEqual(CodePostal.objects.ensure([]), [])
+
+        with self.assertNumQueries(2):
+            CodePostal.objects.ensure(["32200", "32100"], known=True)
+        self.assertEqual(CodePostal.starting_with("32"), ["32100", "32200"])
+
+    def test_many_form_data(self):
+        field = CodePostalMany()
+        field.set_attributes_from_name("postal_codes")
+        self.assertIsInstance(field.formfield(), MultiplePostalCodesField)
+
+        instance = mock.Mock()
+        field.save_form_data(instance, ["32100", "32200"])
+        postal_codes = instance.postal_codes.set.call_args[0][0]
+        self.assertEqual(
+            [postal_code.code for postal_code in postal_codes], ["32100", "32200"]
+        )
+        self.assertTrue(CodePostal.objects.filter(code="32200").exists())
+
+
+class TestEndingsMigration(TransactionTestCase):
+    before = [("dj_codepostal_fr", "0004_commune")]
+    after = [("dj_codepostal_fr", "0005_codepostalcompletions_remove_endings")]
+
+    def test_migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        apps.get_model("dj_codepostal_fr", "CodePostal").objects.create(code="32100")
+        apps.get_model("dj_codepostal_fr", "CodePostalCompletions").objects.create(
+            portion="321", endings="00,11,22"
+        )
+
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        self.assertEqual(
+            list(
+                apps.get_model("dj_codepostal_fr", "CodePostal")
+                .objects.order_by("code")
+                .values_list("code", flat=True)
+            ),
+            ["32100", "32111", "32122"],
+        )
+
+        executor.loader.build_graph()
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        completion = apps.get_model(
+            "dj_codepostal_fr", "CodePostalCompletions"
+        ).objects.get(portion="321")
+        self.assertEqual(completion.endings, "00,11,22")
+
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+
+class TestKnownMigration(TransactionTestCase):
+    before = [("dj_codepostal_fr", "0005_codepostalcompletions_remove_endings")]
+    after = [("dj_codepostal_fr", "0006_codepostal_known")]
+
+    def test_migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        CodePostal = apps.get_model("dj_codepostal_fr", "CodePostal")
+        CodePostalLocation = apps.get_model("dj_codepostal_fr", "CodePostalLocation")
+        for code in ["32100", "32110", "32198", "32199"]:
+            CodePostal.objects.create(code=code)
+        CodePostalLocation.objects.create(code_id="32100", longitude=0.4, latitude=44)
+        # reported missing by the API
+        CodePostalLocation.objects.create(code_id="32199")
+        # in the dataset, without coordinates
+        CodePostalLocation.objects.create(code_id="32198")
+        apps.get_model("dj_codepostal_fr", "Commune").objects.create(
+            insee="32001", name="X", postal_code_id="32198"
+        )
+
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        CodePostal = executor.loader.project_state(self.after).apps.get_model(
+            "dj_codepostal_fr", "CodePostal"
+        )
+        self.assertEqual(
+            list(CodePostal.objects.filter(known=False).values_list("code", flat=True)),
+            ["32199"],
+        )
+
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
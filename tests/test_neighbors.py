@@ -0,0 +1,103 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation, CodePostalNeighbor
+from dj_codepostal_fr.neighbors import build_neighbors, neighbors, neighbors_many
+from dj_codepostal_fr.utils import postal_codes_nearby, postal_codes_nearby_many
+
+# 75001, 75002 and 92100 within 10 km, 77300 about 40 km away
+LOCATIONS = {
+    "75001": (2.34, 48.86),
+    "75002": (2.34, 48.87),
+    "92100": (2.24, 48.83),
+    "77300": (2.60, 48.55),
+    "13001": (5.38, 43.30),
+}
+
+
+@override_settings(CODEPOSTAL_NEIGHBORS=True)
+class TestNeighbors(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in [*LOCATIONS, "99999"]]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id=code, longitude=lon, latitude=lat)
+                for code, (lon, lat) in LOCATIONS.items()
+            ]
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_build(self):
+        self.assertEqual(build_neighbors(batch_size=2), 17)
+        rows = list(
+            CodePostalNeighbor.objects.filter(code_id="75001")
+            .order_by("distance")
+            .values_list("neighbor_id", "distance")
+        )
+        self.assertEqual([code for code, _ in rows], ["75001", "75002", "92100", "77300"])
+        self.assertEqual(rows[0][1], 0)
+        self.assertAlmostEqual(rows[1][1], 1112, delta=2)
+        self.assertFalse(CodePostalNeighbor.objects.filter(code_id="99999").exists())
+
+        # rebuilt from scratch
+        self.assertEqual(build_neighbors(count=2), 9)
+
+    def test_built_narrower(self):
+        self.assertIsNone(neighbors("75001", 10, 30))
+        build_neighbors(count=2, max_dist_km=5)
+        self.assertEqual(neighbors("75001", 5, 2), ["75001", "75002"])
+        # wider than the build, whatever the settings
+        self.assertIsNone(neighbors("75001", 10, 2))
+        self.assertIsNone(neighbors("75001", 5, 30))
+        self.assertEqual(neighbors_many(["75001"], 10, 30), {})
+
+        # read from DB by the other processes
+        cache.clear()
+        self.assertIsNone(neighbors("75001", 10, 2))
+        self.assertEqual(neighbors("75001", 5, 2), ["75001", "75002"])
+
+    def test_lookups(self):
+        build_neighbors()
+        self.assertEqual(neighbors("75001", 10, 30), ["75001", "75002", "92100"])
+        self.assertEqual(neighbors("75001", 10, 2), ["75001", "75002"])
+        self.assertIsNone(neighbors("99999", 10, 30))
+        # wider than the table
+        self.assertIsNone(neighbors("75001", 100, 30))
+        self.assertIsNone(neighbors("75001", 10, 50))
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                neighbors_many(["75001", "13001", "99999"], 5),
+                {"75001": ["75001", "75002"], "13001": ["13001"]},
+            )
+
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_nearby(self, mock_call):
+        build_neighbors()
+        self.assertEqual(
+            postal_codes_nearby(10, postal_code="75002"), ["75002", "75001", "92100"]
+        )
+        with self.assertNumQueries(0):
+            # cached
+            self.assertEqual(
+                postal_codes_nearby(10, postal_code="75002"),
+                ["75002", "75001", "92100"],
+            )
+        self.assertEqual(
+            postal_codes_nearby_many(["13001", "77300"], dist_km=5), ["13001", "77300"]
+        )
+        mock_call.assert_not_called()
+
+    def test_command(self):
+        out = StringIO()
+        call_command("build_codepostal_neighbors", "--count", "3", stdout=out)
+        self.assertIn("Stored 13 neighbors", out.getvalue())
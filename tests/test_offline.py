@@ -0,0 +1,111 @@
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation
+from dj_codepostal_fr.offline import (
+    MANIFEST_NAME,
+    build_dataset,
+    dataset_name,
+    dataset_url,
+    write_dataset,
+)
+from dj_codepostal_fr.widgets import MultiplePostalCodesWithSuggest
+
+
+def undelta(deltas, scale=None):
+    values = []
+    previous = 0
+    for delta in deltas:
+        if delta is None:
+            values.append(None)
+        else:
+            previous += delta
+            values.append(previous / scale if scale else previous)
+    return values
+
+
+class TestOfflineDataset(TestCase):
+    def setUp(self):
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "01400", "32000", "32200"]]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id="32000", longitude=0.5755, latitude=43.6534),
+                CodePostalLocation(code_id="01400", longitude=4.926, latitude=46.1534),
+                CodePostalLocation(code_id="32100", longitude=0.3922, latitude=43.9578),
+            ]
+        )
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_build(self):
+        dataset = build_dataset()
+        self.assertEqual(dataset["format"], 1)
+        self.assertEqual(dataset["codes"], [1400, 30600, 100, 100])
+        self.assertEqual(undelta(dataset["codes"]), [1400, 32000, 32100, 32200])
+        self.assertEqual(
+            undelta(dataset["lons"], dataset["scale"]), [4.926, 0.576, 0.392, None]
+        )
+        self.assertEqual(
+            undelta(dataset["lats"], dataset["scale"]), [46.153, 43.653, 43.958, None]
+        )
+
+    def test_write(self):
+        path = write_dataset(self.directory.name)
+        name = os.path.basename(path)
+        self.assertRegex(name, r"^codepostal-[0-9a-f]{16}\.json$")
+        with open(path) as f:
+            self.assertEqual(json.load(f), build_dataset())
+        # same content, same name
+        self.assertEqual(write_dataset(self.directory.name), path)
+
+        with override_settings(CODEPOSTAL_OFFLINE_DIR=self.directory.name):
+            self.assertEqual(dataset_name(), name)
+            CodePostal.objects.create(code="32300")
+            new_path = write_dataset()
+            self.assertNotEqual(new_path, path)
+            # the manifest may keep the same mtime
+            os.utime(os.path.join(self.directory.name, MANIFEST_NAME), (0, 0))
+            self.assertEqual(dataset_name(), os.path.basename(new_path))
+
+    def test_no_dataset(self):
+        self.assertIsNone(dataset_name())
+        with override_settings(CODEPOSTAL_OFFLINE_DIR=self.directory.name):
+            self.assertIsNone(dataset_name())
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command("build_codepostal_offline", self.directory.name, stdout=stdout)
+        self.assertIn("codepostal-", stdout.getvalue())
+        self.assertTrue(
+            os.path.exists(os.path.join(self.directory.name, MANIFEST_NAME))
+        )
+
+    @override_settings(STATIC_URL="/static/", ROOT_URLCONF="dj_codepostal_fr.urls")
+    def test_widget(self):
+        widget = MultiplePostalCodesWithSuggest()
+        self.assertNotIn("data-codepostal-offline", widget.build_attrs({}))
+        self.assertNotIn("dj_codepostal_fr/codepostal-offline.js", widget.media._js)
+
+        path = write_dataset(self.directory.name)
+        with override_settings(
+            CODEPOSTAL_OFFLINE=True, CODEPOSTAL_OFFLINE_DIR=self.directory.name
+        ):
+            self.assertEqual(
+                widget.build_attrs({})["data-codepostal-offline"],
+                "/static/" + os.path.basename(path),
+            )
+            self.assertEqual(
+                widget.media._js[-1], "dj_codepostal_fr/codepostal-offline.js"
+            )
+            with override_settings(CODEPOSTAL_OFFLINE_URL="https://cdn.example.com/"):
+                self.assertEqual(
+                    dataset_url(),
+                    "https://cdn.example.com/" + os.path.basename(path),
+                )
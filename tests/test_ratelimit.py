@@ -0,0 +1,63 @@
+import asyncio
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr import ratelimit
+from dj_codepostal_fr.utils import DatanovaThrottlingException, postal_codes_completion
+
+from .test_utils import MockResponse
+
+
+@override_settings(CODEPOSTAL_RATE_LIMIT=5, CODEPOSTAL_RATE_LIMIT_RESERVED=0.4)
+class TestRateLimit(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    @override_settings(CODEPOSTAL_RATE_LIMIT=None)
+    def test_disabled(self):
+        self.assertTrue(all(ratelimit.acquire() for _ in range(100)))
+
+    def test_interactive(self):
+        self.assertEqual(
+            [ratelimit.acquire() for _ in range(7)], [True] * 5 + [False] * 2
+        )
+
+    def test_background_yields(self):
+        with ratelimit.background(), mock.patch(
+            "dj_codepostal_fr.ratelimit.time.sleep"
+        ) as sleep:
+            for _ in range(3):
+                self.assertTrue(ratelimit.acquire())
+            sleep.assert_not_called()
+            # budget of 3 used, waits for the next window
+            sleep.side_effect = lambda seconds: cache.clear()
+            self.assertTrue(ratelimit.acquire())
+            sleep.assert_called_once()
+        # interactive calls still have the reserved part
+        cache.set(ratelimit._window()[0], 3)
+        self.assertTrue(ratelimit.acquire())
+        self.assertTrue(ratelimit.acquire())
+        self.assertFalse(ratelimit.acquire())
+
+    def test_async(self):
+        async def acquire_all():
+            return [await ratelimit.aacquire() for _ in range(6)]
+
+        self.assertEqual(asyncio.run(acquire_all()), [True] * 5 + [False])
+
+    @mock.patch("requests.Session.get")
+    def test_call_not_made(self, mock_get):
+        mock_get.return_value = MockResponse(
+            status_code=200,
+            json={"records": [{"record": {"fields": {"code_postal": "32100"}}}]},
+        )
+        cache.set(ratelimit._window()[0], 5)
+        with self.assertRaises(DatanovaThrottlingException):
+            postal_codes_completion("321")
+        mock_get.assert_not_called()
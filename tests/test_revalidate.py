@@ -0,0 +1,195 @@
+import io
+import time
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr import revalidate
+from dj_codepostal_fr.cache import cache
+from dj_codepostal_fr.hexasmal import import_records, iter_records
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+    Commune,
+)
+from dj_codepostal_fr.neighbors import build_neighbors
+from dj_codepostal_fr.signals import dataset_version, notify_dataset_changed
+from dj_codepostal_fr.utils import (
+    _completion_cache_key,
+    _location_cache_key,
+    _nearby_cache_key,
+    postal_codes_completion,
+    postal_codes_nearby,
+)
+
+from .test_utils import MockResponse
+
+
+def codes_response(*codes):
+    return MockResponse(
+        200, {"records": [{"record": {"fields": {"code_postal": code}}} for code in codes]}
+    )
+
+
+def stale():
+    # past the freshness of the nearby codes, not of the locations
+    return mock.patch(
+        "dj_codepostal_fr.cache.time.time", return_value=time.time() + 8 * 24 * 3600
+    )
+
+
+class TestRevalidate(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    @mock.patch("requests.Session.get")
+    def test_completion(self, mock_get):
+        key = _completion_cache_key("321")
+        cache.set(key, ["32100"], timeout=None)
+        mock_get.return_value = codes_response("32100", "32110")
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), ["32100", "32110"])
+        self.assertEqual(CodePostalCompletions.complete("321"), ["32100", "32110"])
+
+        # once per CODEPOSTAL_CACHE_ERROR_TTL
+        revalidate.revalidate([key])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @mock.patch("requests.Session.get")
+    def test_stored_completion(self, mock_get):
+        import_records(
+            iter_records(
+                io.StringIO(
+                    "Code_commune_INSEE;Nom_commune;Code_postal;Ligne_5;"
+                    "Libellé_d_acheminement;coordonnees_gps\n"
+                    "32013;AUCH;32000;;AUCH;43.6534,0.5755\n"
+                ),
+                "csv",
+            )
+        )
+        key = _completion_cache_key("320")
+        cache.set(key, [], timeout=None)
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), ["32000"])
+        mock_get.assert_not_called()
+
+    @mock.patch("requests.Session.get")
+    def test_nearby(self, mock_get):
+        cache.set(
+            _location_cache_key("32000"), {"lon": 0.58, "lat": 43.65}, timeout=None
+        )
+        key = _nearby_cache_key(20, None, None, "32000", 12)
+        cache.set(key, ["32100"], timeout=None)
+        mock_get.return_value = codes_response("32100", "32300")
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), ["32100", "32300"])
+        params = mock_get.call_args[1]["params"]
+        self.assertIn("[0.58,43.65]}',20km", params["where"].replace(" ", ""))
+        self.assertEqual(params["limit"], 12)
+
+    @mock.patch("requests.Session.get")
+    def test_imported_location(self, mock_get):
+        CodePostal.objects.create(code="32000")
+        CodePostalLocation.objects.create(
+            code_id="32000", longitude=0.58, latitude=43.65
+        )
+        Commune.objects.create(insee="32013", name="AUCH", postal_code_id="32000")
+        key = _location_cache_key("32000")
+        cache.set(key, False, timeout=None)
+        version = dataset_version()
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), {"lon": 0.58, "lat": 43.65})
+        mock_get.assert_not_called()
+        self.assertEqual(dataset_version(), version)
+
+    @mock.patch("requests.Session.get")
+    def test_unchanged_location(self, mock_get):
+        CodePostal.objects.create(code="32000")
+        CodePostalLocation.objects.create(
+            code_id="32000", longitude=0.58, latitude=43.65
+        )
+        key = _location_cache_key("32000")
+        cache.set(key, {"lon": 0.58, "lat": 43.65}, timeout=None)
+        mock_get.return_value = MockResponse(
+            200,
+            {
+                "total_count": 1,
+                "records": [
+                    {
+                        "record": {
+                            "fields": {
+                                "code_postal": "32000",
+                                "coordonnees_gps": {"lon": 0.58, "lat": 43.65},
+                            }
+                        }
+                    }
+                ],
+            },
+        )
+        version = dataset_version()
+        revalidate.revalidate([key])
+        mock_get.assert_called_once()
+        self.assertEqual(cache.get(key), {"lon": 0.58, "lat": 43.65})
+        self.assertEqual(dataset_version(), version)
+
+    @override_settings(CODEPOSTAL_NEIGHBORS=True)
+    @mock.patch("requests.Session.get")
+    def test_nearby_from_table(self, mock_get):
+        CodePostal.objects.bulk_create(
+            [CodePostal(code="32000"), CodePostal(code="32300")]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id="32000", longitude=0.58, latitude=43.65),
+                CodePostalLocation(code_id="32300", longitude=0.40, latitude=43.52),
+            ]
+        )
+        build_neighbors()
+        key = _nearby_cache_key(10, None, None, "32000")
+        cache.set(key, ["32100"], timeout=None)
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), ["32000"])
+        mock_get.assert_not_called()
+
+    @mock.patch("requests.Session.get")
+    def test_nearby_other_version(self, mock_get):
+        cache.set(
+            _location_cache_key("32000"), {"lon": 0.58, "lat": 43.65}, timeout=None
+        )
+        key = _nearby_cache_key(10, None, None, "32000")
+        cache.set(key, ["32100"], timeout=None)
+        notify_dataset_changed()
+        # not read anymore
+        revalidate.revalidate([key])
+        mock_get.assert_not_called()
+
+    @mock.patch("requests.Session.get")
+    def test_error_keeps_stale_value(self, mock_get):
+        key = _completion_cache_key("321")
+        cache.set(key, ["32100"], timeout=None)
+        mock_get.return_value = MockResponse(500, {})
+        revalidate.revalidate([key])
+        self.assertEqual(cache.get(key), ["32100"])
+
+        # without a value, the error is only kept CODEPOSTAL_CACHE_ERROR_TTL
+        with mock.patch.object(cache.backend, "add") as mock_add:
+            self.assertIsNone(postal_codes_completion("322"))
+        self.assertEqual(mock_add.call_args[1], {"timeout": 60})
+
+    @mock.patch("requests.Session.get")
+    def test_served_while_revalidated(self, mock_get):
+        cache.set(
+            _location_cache_key("32000"), {"lon": 0.58, "lat": 43.65}, timeout=None
+        )
+        key = _nearby_cache_key(10, None, None, "32000")
+        cache.set(key, ["32100"], timeout=None)
+        mock_get.return_value = codes_response("32100", "32300")
+        with stale():
+            self.assertEqual(postal_codes_nearby(postal_code="32000"), ["32100"])
+            revalidate._queue.join()
+        self.assertEqual(postal_codes_nearby(postal_code="32000"), ["32100", "32300"])
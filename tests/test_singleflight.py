@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from dj_codepostal_fr.singleflight import _lock_key_prefix, acoalesce, coalesce
+from dj_codepostal_fr.utils import postal_codes_nearby
+
+from .test_utils import MockResponse
+
+
+@override_settings(
+    CODEPOSTAL_SINGLE_FLIGHT_WAIT=1, CODEPOSTAL_SINGLE_FLIGHT_POLL=0.01
+)
+class TestCoalesce(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(0.05)
+        cache.set("key", "value")
+        return "value"
+
+    def run_threads(self, target, count=5):
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(target()))
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_threads(self):
+        results = self.run_threads(lambda: coalesce("key", self.fetch))
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(cache.get(_lock_key_prefix + "key"))
+
+    @override_settings(CODEPOSTAL_SINGLE_FLIGHT=False)
+    def test_disabled(self):
+        self.run_threads(lambda: coalesce("key", self.fetch), count=2)
+        self.assertEqual(self.calls, 2)
+
+    def test_other_process(self):
+        # another process holds the lock, and caches the value later
+        cache.add(_lock_key_prefix + "key", "other")
+        threading.Timer(0.05, lambda: cache.set("key", "other value")).start()
+        self.assertEqual(coalesce("key", self.fetch), "other value")
+        self.assertEqual(self.calls, 0)
+
+    @override_settings(CODEPOSTAL_SINGLE_FLIGHT_WAIT=0.05)
+    def test_other_process_timeout(self):
+        cache.add(_lock_key_prefix + "key", "other")
+        self.assertEqual(coalesce("key", self.fetch), "value")
+        self.assertEqual(self.calls, 1)
+        # the lock of the other process is kept
+        self.assertEqual(cache.get(_lock_key_prefix + "key"), "other")
+
+    def test_fetch_error(self):
+        def failing():
+            raise RuntimeError()
+
+        with self.assertRaises(RuntimeError):
+            coalesce("key", failing)
+        self.assertEqual(coalesce("key", self.fetch), "value")
+
+    def test_failure_shared(self):
+        def failing():
+            self.calls += 1
+            time.sleep(0.1)
+            # nothing cached, e.g. a connection error
+
+        results = self.run_threads(lambda: coalesce("key", failing), count=6)
+        self.assertEqual(results, [None] * 6)
+        self.assertEqual(self.calls, 1)
+
+    def test_exception_shared(self):
+        def failing():
+            self.calls += 1
+            time.sleep(0.1)
+            raise RuntimeError()
+
+        def call():
+            try:
+                return coalesce("key", failing)
+            except RuntimeError:
+                return "raised"
+
+        self.assertEqual(self.run_threads(call), ["raised"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(CODEPOSTAL_SINGLE_FLIGHT_WAIT=0.05)
+    def test_wait_timeout(self):
+        def slow():
+            self.calls += 1
+            time.sleep(0.3)
+
+        start = time.monotonic()
+        self.run_threads(lambda: coalesce("key", slow), count=6)
+        # the waiters fetch themselves, concurrently
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(self.calls, 6)
+
+    async def test_async(self):
+        async def fetch():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            await cache.aset("key", "value")
+            return "value"
+
+        results = await asyncio.gather(*[acoalesce("key", fetch) for _ in range(5)])
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(self.calls, 1)
+
+    async def test_async_failure_shared(self):
+        async def failing():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+
+        results = await asyncio.gather(*[acoalesce("key", failing) for _ in range(5)])
+        self.assertEqual(results, [None] * 5)
+        self.assertEqual(self.calls, 1)
+
+    @mock.patch("requests.Session.get")
+    def test_nearby(self, mock_get):
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return MockResponse(
+                200, {"records": [{"record": {"fields": {"code_postal": "32000"}}}]}
+            )
+
+        mock_get.side_effect = slow_get
+        results = self.run_threads(lambda: postal_codes_nearby(lon=0.5, lat=43.6))
+        self.assertEqual(results, [["32000"]] * 5)
+        mock_get.assert_called_once()
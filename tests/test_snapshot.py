@@ -0,0 +1,132 @@
+from io import StringIO
+import os
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+
+from dj_codepostal_fr.models import CodePostal, CodePostalLocation
+from dj_codepostal_fr.snapshot import (
+    Snapshot,
+    SnapshotError,
+    build_snapshot,
+    get_snapshot,
+    reset_snapshot,
+)
+from dj_codepostal_fr.utils import (
+    postal_code_location,
+    postal_code_locations,
+    postal_codes_completion,
+)
+from dj_codepostal_fr.views import area_view
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [
+                CodePostal(code=code)
+                for code in ["32100", "32111", "32200", "01400", "99999"]
+            ]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id="32100", longitude=0.5, latitude=43.5),
+                CodePostalLocation(code_id="01400", longitude=5.25, latitude=46.125),
+                CodePostalLocation(code_id="99999", longitude=None, latitude=None),
+            ]
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "codepostal.snapshot")
+        self.addCleanup(reset_snapshot)
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_lookups(self):
+        self.assertEqual(build_snapshot(self.path), 5)
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+
+        self.assertEqual(len(snapshot), 5)
+        self.assertEqual(snapshot.complete("3"), ["32100", "32111", "32200"])
+        self.assertEqual(snapshot.complete("321"), ["32100", "32111"])
+        self.assertEqual(snapshot.complete("3211"), ["32111"])
+        self.assertEqual(snapshot.complete("32111"), ["32111"])
+        self.assertEqual(snapshot.complete("01"), ["01400"])
+        self.assertEqual(snapshot.complete("98"), [])
+        self.assertEqual(snapshot.complete("321ab"), [])
+        self.assertEqual(snapshot.complete("321111"), [])
+        self.assertIn("01400", snapshot)
+        self.assertNotIn("01401", snapshot)
+        self.assertNotIn("1400", snapshot)
+
+        self.assertEqual(snapshot.location("32100"), (0.5, 43.5))
+        self.assertEqual(snapshot.location("01400"), (5.25, 46.125))
+        self.assertIsNone(snapshot.location("32111"))
+        self.assertIsNone(snapshot.location("99999"))
+        self.assertIsNone(snapshot.location("12345"))
+
+    def test_invalid_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not a snapshot")
+        with self.assertRaises(SnapshotError):
+            Snapshot(self.path)
+
+    def test_get_snapshot(self):
+        self.assertIsNone(get_snapshot())
+        with override_settings(
+            CODEPOSTAL_SNAPSHOT_PATH=self.path, CODEPOSTAL_INDEX_CHECK_INTERVAL=0
+        ):
+            self.assertIsNone(get_snapshot())
+            build_snapshot(self.path)
+            self.assertEqual(len(get_snapshot()), 5)
+
+            CodePostal.objects.create(code="32300")
+            build_snapshot(self.path)
+            # a different inode, even within the same mtime tick
+            self.assertEqual(len(get_snapshot()), 6)
+
+    def test_command(self):
+        out = StringIO()
+        with override_settings(CODEPOSTAL_SNAPSHOT_PATH=self.path):
+            call_command("build_codepostal_snapshot", stdout=out)
+        self.assertIn("Wrote 5 postal codes", out.getvalue())
+        self.assertTrue(os.path.exists(self.path))
+
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_utils_read_snapshot_first(self, mock_call):
+        build_snapshot(self.path)
+        with override_settings(CODEPOSTAL_SNAPSHOT_PATH=self.path), mock.patch(
+            "dj_codepostal_fr.utils.cache"
+        ) as mock_cache, self.assertNumQueries(0):
+            self.assertEqual(postal_codes_completion("3211"), ["32111"])
+            self.assertEqual(postal_codes_completion("3219"), [])
+            self.assertEqual(postal_code_location("32100"), {"lon": 0.5, "lat": 43.5})
+            self.assertEqual(
+                postal_code_locations(["01400", "32100"]),
+                {
+                    "01400": {"lon": 5.25, "lat": 46.125},
+                    "32100": {"lon": 0.5, "lat": 43.5},
+                },
+            )
+        mock_cache.get.assert_not_called()
+        mock_cache.get_many.assert_not_called()
+        mock_call.assert_not_called()
+
+    @mock.patch("dj_codepostal_fr.utils._call")
+    def test_non_digit_term(self, mock_call):
+        build_snapshot(self.path)
+        with override_settings(CODEPOSTAL_SNAPSHOT_PATH=self.path):
+            self.assertIsNone(postal_codes_completion("123ab"))
+            response = area_view(
+                RequestFactory().get("/codepostal/nearby/", {"term": "123ab"})
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Aucun code postal ne correspond", response.content.decode())
+        mock_call.assert_not_called()
@@ -0,0 +1,188 @@
+import io
+import tempfile
+from unittest import mock
+
+from dj_codepostal_fr.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from dj_codepostal_fr.hexasmal import import_records, iter_records
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+    CodePostalNeighbor,
+    Commune,
+)
+from dj_codepostal_fr.signals import dataset_version
+from dj_codepostal_fr.sync import SyncError, _sync_once, sync_records
+from dj_codepostal_fr.utils import (
+    _completion_cache_key,
+    _location_cache_key,
+    _nearby_cache_key,
+    _nearby_cell_cache_key,
+    _grid_cell,
+    unknown_postal_codes,
+)
+
+HEADER = "#Code_commune_INSEE;Nom_commune;Code_postal;Ligne_5;Libellé_d_acheminement;coordonnees_gps\n"
+
+EXPORT = HEADER + """32013;AUCH;32000;;AUCH;43.6534,0.5755
+32107;CONDOM;32100;;CONDOM;43.9578,0.3922
+32048;BLAZIERT;32100;;BLAZIERT;43.9142,0.4781
+01001;L ABERGEMENT CLEMENCIAT;01400;;L ABERGEMENT CLEMENCIAT;46.1534,4.9260
+75101;PARIS 01;75001;;PARIS;48.8626,2.3363
+"""
+
+# 32000 moved, BLAZIERT removed from 32100, 01400 retired, 32300 inserted
+NEW_EXPORT = HEADER + """32013;AUCH;32000;;AUCH;43.6500,0.5800
+32107;CONDOM;32100;;CONDOM;43.9578,0.3922
+32300;MIRANDE;32300;;MIRANDE;43.5150,0.4040
+75101;PARIS 01;75001;;PARIS;48.8626,2.3363
+"""
+
+
+def records(export):
+    return iter_records(io.StringIO(export), "csv")
+
+
+class TestSync(TestCase):
+    def setUp(self):
+        cache.clear()
+        import_records(records(EXPORT))
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_unchanged(self):
+        nearby_key = _nearby_cache_key(10, None, None, "32000")
+        cache.set(nearby_key, ["32001"], timeout=None)
+        version = dataset_version()
+        stats = sync_records(records(EXPORT))
+        self.assertEqual(
+            (stats["inserted"], stats["updated"], stats["retired"]), (0, 0, 0)
+        )
+        self.assertEqual(stats["unchanged"], 4)
+        self.assertEqual(stats["rows"], 5)
+        self.assertEqual(dataset_version(), version)
+        self.assertEqual(cache.get(nearby_key), ["32001"])
+
+    def test_sync(self):
+        nearby_keys = [
+            lambda: _nearby_cache_key(10, None, None, "32000"),
+            lambda: _nearby_cache_key(25, None, None, "75001", 12),
+            lambda: _nearby_cache_key(10, 0.58, 43.65, None),
+        ]
+        cache.set_many({key(): ["32001"] for key in nearby_keys}, timeout=None)
+        version = dataset_version()
+
+        stats = sync_records(records(NEW_EXPORT), max_retired=0.5)
+        self.assertEqual(
+            (stats["inserted"], stats["updated"], stats["retired"], stats["unchanged"]),
+            (1, 2, 1, 1),
+        )
+        self.assertNotEqual(dataset_version(), version)
+
+        self.assertEqual(
+            sorted(CodePostal.objects.filter(known=True).values_list("code", flat=True)),
+            ["32000", "32100", "32300", "75001"],
+        )
+        self.assertIsNone(CodePostalLocation.objects.get(code="01400").latitude)
+        self.assertTrue(CodePostalCompletions.objects.filter(portion="323").exists())
+        location = CodePostalLocation.objects.get(code="32100")
+        self.assertAlmostEqual(location.longitude, 0.3922)
+        self.assertEqual(
+            sorted(Commune.objects.values_list("name", flat=True)),
+            ["AUCH", "CONDOM", "MIRANDE", "PARIS 01"],
+        )
+
+        # the affected cache keys, and the nearby suggestions of any distance
+        # or limit through the dataset version
+        self.assertEqual(
+            cache.get(_location_cache_key("32000")), {"lon": 0.58, "lat": 43.65}
+        )
+        self.assertIs(cache.get(_location_cache_key("01400")), False)
+        self.assertEqual(cache.get(_completion_cache_key("014")), [])
+        self.assertEqual(cache.get(_completion_cache_key("323")), ["32300"])
+        for key in nearby_keys:
+            self.assertIsNone(cache.get(key()))
+
+        # applied
+        self.assertEqual(sync_records(records(NEW_EXPORT))["unchanged"], 4)
+
+    @override_settings(CODEPOSTAL_NEARBY_GRID=0.1)
+    def test_grid_cells(self):
+        auch_cell = _nearby_cell_cache_key(10, *_grid_cell(0.5755, 43.6534))
+        paris_cell = _nearby_cell_cache_key(10, *_grid_cell(2.3363, 48.8626))
+        cache.set_many({auch_cell: [], paris_cell: []}, timeout=None)
+        sync_records(records(NEW_EXPORT), max_retired=0.5)
+        self.assertIsNone(
+            cache.get(_nearby_cell_cache_key(10, *_grid_cell(0.5755, 43.6534)))
+        )
+        self.assertIsNone(
+            cache.get(_nearby_cell_cache_key(10, *_grid_cell(2.3363, 48.8626)))
+        )
+
+    def test_retired(self):
+        with self.assertRaises(SyncError):
+            sync_records(records(NEW_EXPORT))
+        self.assertTrue(CodePostal.objects.get(code="01400").known)
+
+        stats = sync_records(records(NEW_EXPORT), retire=False)
+        self.assertEqual(stats["retired"], 0)
+        self.assertTrue(CodePostal.objects.get(code="01400").known)
+        self.assertEqual(cache.get(_completion_cache_key("014")), ["01400"])
+
+        with self.assertRaises(SyncError):
+            sync_records(records(HEADER))
+
+    def test_retired_kept_in_records(self):
+        neighbor = CodePostalNeighbor.objects.create(
+            code_id="01400", neighbor_id="01400", distance=0
+        )
+        sync_records(records(NEW_EXPORT), max_retired=0.5)
+        # not deleted, nor the rows of the CodePostalMany fields
+        self.assertTrue(CodePostal.objects.filter(code="01400").exists())
+        self.assertFalse(Commune.objects.filter(postal_code="01400").exists())
+        self.assertFalse(CodePostalNeighbor.objects.filter(id=neighbor.id).exists())
+        self.assertEqual(unknown_postal_codes(["01400", "32100"]), ["01400"])
+
+        # back in a later export
+        stats = sync_records(records(EXPORT), retire=False)
+        self.assertEqual(stats["inserted"], 1)
+        self.assertTrue(CodePostal.objects.get(code="01400").known)
+        self.assertEqual(cache.get(_completion_cache_key("014")), ["01400"])
+
+    def test_dry_run(self):
+        stats = sync_records(records(NEW_EXPORT), max_retired=0.5, dry_run=True)
+        self.assertEqual(stats["inserted"], 1)
+        self.assertFalse(CodePostal.objects.filter(code="32300").exists())
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as export:
+            export.write(NEW_EXPORT)
+            export.flush()
+            with self.assertRaises(CommandError):
+                call_command("sync_hexasmal", export.name, stdout=io.StringIO())
+            stdout = io.StringIO()
+            call_command(
+                "sync_hexasmal", export.name, "--max-retired", "0.5", stdout=stdout
+            )
+        self.assertIn("1 inserted, 2 updated, 1 retired", stdout.getvalue())
+
+    @mock.patch("dj_codepostal_fr.sync.sync_source")
+    def test_once_per_interval(self, mock_sync):
+        _sync_once(60)
+        _sync_once(60)
+        mock_sync.assert_called_once_with()
+
+    def test_malformed_source(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as export:
+            export.write('[{"fields": {"code_postal": "32')
+            export.flush()
+            with override_settings(CODEPOSTAL_SYNC_SOURCE=export.name), self.assertLogs(
+                "codepostal.sync", "ERROR"
+            ):
+                _sync_once(60)
+        self.assertTrue(CodePostal.objects.get(code="01400").known)
@@ -2,19 +2,31 @@ from datetime import datetime
 from django.core.cache import cache
 from re import L
 from unittest import mock
-from dj_codepostal_fr.models import CodePostalCompletions
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
 
+from dj_codepostal_fr.signals import dataset_version
 from dj_codepostal_fr.utils import (
     DatanovaThrottlingException,
+    _nearby_cache_key,
+    _store_locations,
     complete_and_suggest,
     postal_code_location,
+    fetch_postal_code_locations,
+    postal_code_locations,
     postal_codes_completion,
+    postal_codes_nearby,
 )
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from pytz import UTC
 
 
 class MockResponse:
+    url = "https://datanova.laposte.fr/api/records/1.0/search/"
+
     def __init__(self, status_code, json=None):
         self.status_code = status_code
         self._json = json
@@ -24,7 +36,7 @@ class MockResponse:
 
 
 class TestApiError(TestCase):
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_location(self, mock_call):
         mock_call.return_value = MockResponse(
             status_code=429, json={"reset_time": datetime.now(tz=UTC).isoformat()}
@@ -32,7 +44,7 @@ class TestApiError(TestCase):
         with self.assertRaises(DatanovaThrottlingException):
             postal_code_location("32100")
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_complete_and_suggest(self, mock_call):
         """
         Test that no results are returned, and error messages are displayed
@@ -48,7 +60,7 @@ class TestApiError(TestCase):
             self.assertIn("Impossible d'obtenir", item["text"])
             self.assertEqual(len(item.get("children", [])), 0)
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_complete_and_suggest_default(self, mock_call):
         """
         Test that no results are returned, and error messages are displayed
@@ -75,17 +87,10 @@ class TestApiError(TestCase):
 
 class TestApiErrorWithDbValues(TestCase):
     def setUp(self):
-        CodePostalCompletions.objects.bulk_create(
-            [
-                CodePostalCompletions(portion=p, endings=e)
-                for p, e in [
-                    ("321", "00,11,22,33"),
-                    ("322", "01,12,23,34"),
-                ]
-            ]
-        )
+        CodePostalCompletions.store("321", ["32100", "32111", "32122", "32133"])
+        CodePostalCompletions.store("322", ["32201", "32212", "32223", "32234"])
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_complete_and_suggest_stored(self, mock_call):
         """
         Test that no results are returned, and error messages are displayed
@@ -108,7 +113,7 @@ class TestApiErrorWithDbValues(TestCase):
         self.assertEqual(len(messages), 1)
         self.assertIn("Impossible d'obtenir les suggestions à proximité", messages[0])
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_complete_and_suggest_stored_no_default(self, mock_call):
         """
         Test that no results are returned, and error messages are displayed
@@ -135,7 +140,7 @@ class TestCached(TestCase):
     def setUp(self):
         cache.clear()
         _cache_key_prefix = "codepostal.utils._AeL3zuay"
-        nearby_key = _cache_key_prefix + "nearby" + f"10/None/None/32200"
+        nearby_key = _nearby_cache_key(10, None, None, "32200")
         complete_key = _cache_key_prefix + "complete321"
 
         cache.set(nearby_key, ["33200", "01200", "87200"])
@@ -184,7 +189,7 @@ class TestApiResults(TestCase):
         super().tearDown()
         cache.clear()
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_completion(self, mock_get):
         mock_get.return_value = MockResponse(
             200,
@@ -200,7 +205,7 @@ class TestApiResults(TestCase):
         res = complete_and_suggest([], "322")
         self.assertEqual(len(res), 3, res)
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_completion_nothing(self, mock_get):
         mock_get.return_value = MockResponse(
             200,
@@ -211,7 +216,7 @@ class TestApiResults(TestCase):
         self.assertEqual(len(res), 1, res)
         self.assertEqual(res[0]["text"], "Aucun code postal ne correspond")
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     def test_nearby(self, mock_get):
         mock_get.return_value = MockResponse(
             200,
@@ -241,10 +246,10 @@ class TestApiResults(TestCase):
         self.assertAlmostEqual(pos["lon"], 42)
         self.assertAlmostEqual(pos["lat"], 0)
 
-    @mock.patch("requests.get")
-    @mock.patch("dj_codepostal_fr.utils.postal_code_location")
-    def test_complete_nearby(self, mock_location, mock_get):
-        mock_location.return_value = {"lon": 42.0, "lat": 0.0}
+    @mock.patch("requests.Session.get")
+    @mock.patch("dj_codepostal_fr.utils._postal_code_locations")
+    def test_complete_nearby(self, mock_locations, mock_get):
+        mock_locations.return_value = {"32000": {"lon": 42.0, "lat": 0.0}}, True
         mock_get.return_value = MockResponse(
             200,
             {
@@ -263,12 +268,12 @@ class TestApiResults(TestCase):
             {item["id"] for item in res[0]["children"]}, {"32100", "32300", "87010"}
         )
 
-    @mock.patch("requests.get")
-    @mock.patch("dj_codepostal_fr.utils.postal_code_location")
+    @mock.patch("requests.Session.get")
+    @mock.patch("dj_codepostal_fr.utils._postal_code_locations")
     @mock.patch("dj_codepostal_fr.utils.postal_codes_completion")
-    def test_complete_nearby_with_portion(self, mock_completion, mock_location, mock_get):
+    def test_complete_nearby_with_portion(self, mock_completion, mock_locations, mock_get):
         mock_completion.return_value = ["32110", "32120"]
-        mock_location.return_value = {"lon": 42.0, "lat": 0.0}
+        mock_locations.return_value = {"32000": {"lon": 42.0, "lat": 0.0}}, True
         mock_get.return_value = MockResponse(
             200,
             {
@@ -292,3 +297,279 @@ class TestApiResults(TestCase):
 
         self.assertEqual(set(completion), {"32110", "32120"})
         self.assertEqual(set(nearby), {"32100"})
+
+
+@override_settings(CODEPOSTAL_NEARBY_GRID=0.1)
+class TestNearbyGrid(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    @mock.patch("requests.Session.get")
+    @mock.patch("dj_codepostal_fr.utils.postal_code_locations")
+    def test_cell(self, mock_locations, mock_get):
+        mock_get.return_value = MockResponse(
+            200,
+            {
+                "records": [
+                    {"record": {"fields": {"code_postal": code}}}
+                    for code in ["32000", "32100", "32200", "32300"]
+                ]
+            },
+        )
+        mock_locations.return_value = {
+            "32000": {"lon": 0.52, "lat": 43.62},
+            "32100": {"lon": 0.60, "lat": 43.62},
+            "32200": {"lon": 0.70, "lat": 43.62},
+            "32300": None,
+        }
+
+        # 32100 and 32200 are about 6 and 14 km from 32000
+        self.assertEqual(
+            postal_codes_nearby(10, 0.521, 43.621), ["32000", "32100"]
+        )
+        self.assertEqual(
+            postal_codes_nearby(10, 0.58, 43.63), ["32100", "32000", "32200"]
+        )
+        self.assertEqual(postal_codes_nearby(10, 0.58, 43.63, limit=1), ["32100"])
+        # one API query for the cell
+        self.assertEqual(mock_get.call_count, 1)
+        params = mock_get.call_args[1]["params"]
+        self.assertIn("[0.55,43.65]}',17km", params["where"].replace(" ", ""))
+        mock_locations.assert_called_once_with(["32000", "32100", "32200", "32300"])
+
+        # another distance, another cell entry
+        postal_codes_nearby(20, 0.521, 43.621)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch("requests.Session.get")
+    @mock.patch("dj_codepostal_fr.utils.postal_code_locations")
+    def test_cell_pages(self, mock_locations, mock_get):
+        def page(*args, params, **kwargs):
+            codes = [f"75{number:03}" for number in range(120)]
+            offset = params["offset"]
+            return MockResponse(
+                200,
+                {
+                    "total_count": len(codes),
+                    "records": [
+                        {"record": {"fields": {"code_postal": code}}}
+                        for code in codes[offset : offset + params["limit"]]
+                    ],
+                },
+            )
+
+        mock_get.side_effect = page
+        mock_locations.side_effect = lambda codes: {
+            code: {"lon": 2.35, "lat": 48.85} for code in codes
+        }
+        self.assertEqual(len(postal_codes_nearby(10, 2.35, 48.85, limit=200)), 120)
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch("requests.Session.get")
+    def test_settings(self, mock_get):
+        mock_get.return_value = MockResponse(200, {"records": []})
+        with override_settings(
+            CODEPOSTAL_NEARBY_GRID=None,
+            CODEPOSTAL_NEARBY_DISTANCE=25,
+            CODEPOSTAL_NEARBY_LIMIT=12,
+        ):
+            self.assertIsNone(postal_codes_nearby(lon=0.5, lat=43.6))
+        params = mock_get.call_args[1]["params"]
+        self.assertIn("25km", params["where"])
+        self.assertEqual(params["limit"], 12)
+
+
+class TestLocations(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32000", "32100", "32999"]]
+        )
+        CodePostalLocation.objects.bulk_create(
+            [
+                CodePostalLocation(code_id="32100", longitude=0.39, latitude=43.95),
+                CodePostalLocation(code_id="32999", longitude=None, latitude=None),
+            ]
+        )
+        cache.set(
+            "codepostal.utils._AeL3zuay" + "location32000", {"lon": 0.57, "lat": 43.65}
+        )
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    @mock.patch("requests.Session.get")
+    def test_locations(self, mock_get):
+        mock_get.return_value = MockResponse(
+            200,
+            {
+                "total_count": 2,
+                "records": [
+                    {
+                        "record": {
+                            "fields": {
+                                "code_postal": "01400",
+                                "coordonnees_gps": {"lon": 4.9, "lat": 46.1},
+                            }
+                        }
+                    },
+                    {
+                        "record": {
+                            "fields": {
+                                "code_postal": "01400",
+                                "coordonnees_gps": {"lon": 5.1, "lat": 46.3},
+                            }
+                        }
+                    },
+                ],
+            },
+        )
+
+        with self.assertNumQueries(1):
+            res = postal_code_locations(["32000", "32100", "32999"])
+        self.assertEqual(
+            res,
+            {
+                "32000": {"lon": 0.57, "lat": 43.65},
+                "32100": {"lon": 0.39, "lat": 43.95},
+                "32999": None,
+            },
+        )
+
+        res = postal_code_locations(["32000", "01400", "01500", 32100])
+        mock_get.assert_called_once()
+        self.assertEqual(
+            mock_get.call_args[1]["params"]["where"],
+            "code_postal=01400 or code_postal=01500",
+        )
+        self.assertAlmostEqual(res["01400"]["lon"], 5.0)
+        self.assertIsNone(res["01500"])
+        self.assertEqual(res["32100"], {"lon": 0.39, "lat": 43.95})
+
+        # stored in DB and cache
+        self.assertAlmostEqual(
+            CodePostalLocation.objects.get(code="01400").latitude, 46.2
+        )
+        self.assertIsNone(CodePostalLocation.objects.get(code="01500").latitude)
+        with self.assertNumQueries(0):
+            self.assertIsNone(postal_code_location("01500"))
+        mock_get.assert_called_once()
+
+    @mock.patch("requests.Session.get")
+    def test_unknown_not_completed(self, mock_get):
+        CodePostalCompletions.store("321", ["32100"])
+        mock_get.return_value = MockResponse(200, {"total_count": 0, "records": []})
+        self.assertIsNone(postal_code_location("32199"))
+        self.assertFalse(CodePostal.objects.get(code="32199").known)
+        self.assertEqual(postal_codes_completion("321"), ["32100"])
+
+        # e.g. a new code of the dataset
+        CodePostalCompletions.store("321", ["32100", "32199"])
+        self.assertTrue(CodePostal.objects.get(code="32199").known)
+        self.assertEqual(CodePostalCompletions.complete("321"), ["32100", "32199"])
+
+    def test_store_notifies_changes_only(self):
+        version = dataset_version()
+        _store_locations({"01400": {"lon": 5.0, "lat": 46.2}, "32999": None})
+        self.assertEqual(dataset_version(), version)
+        _store_locations({"32100": {"lon": 0.39, "lat": 43.95}})
+        self.assertEqual(dataset_version(), version)
+
+        _store_locations({"32100": {"lon": 0.4, "lat": 43.95}})
+        self.assertNotEqual(dataset_version(), version)
+
+
+class TestFetchLocations(TestCase):
+    # codes with their number of records (communes) in the mocked API
+    records_count = {
+        "32000": 1,
+        "32100": 3,
+        "32110": 2,
+        "32120": 0,
+        "32200": 4,
+        "32300": 1,
+        "32400": 2,
+    }
+
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in self.records_count]
+        )
+        CodePostalLocation.objects.create(code_id="32000", longitude=0, latitude=0)
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def mock_api(self, url, params, **kwargs):
+        codes = [clause.split("=")[1] for clause in params["where"].split(" or ")]
+        records = [
+            {
+                "record": {
+                    "fields": {
+                        "code_postal": code,
+                        "coordonnees_gps": {"lon": i, "lat": 40},
+                    }
+                }
+            }
+            for code in codes
+            for i in range(self.records_count[code])
+        ]
+        page = records[params["offset"] : params["offset"] + params["limit"]]
+        return MockResponse(200, {"total_count": len(records), "records": page})
+
+    @mock.patch("dj_codepostal_fr.utils._page_size", 2)
+    @mock.patch("requests.Session.get")
+    def test_fetch(self, mock_get):
+        mock_get.side_effect = self.mock_api
+        progress = []
+
+        found = fetch_postal_code_locations(
+            chunk_size=3, progress=lambda *args: progress.append(args[:2])
+        )
+        self.assertEqual(found, 5)
+        self.assertEqual(progress, [(3, 6), (6, 6)])
+        # chunk 1 has 5 records in 3 pages, chunk 2 has 7 records in 4 pages
+        self.assertEqual(mock_get.call_count, 7)
+        self.assertEqual(CodePostalLocation.objects.count(), 7)
+        self.assertAlmostEqual(
+            CodePostalLocation.objects.get(code="32200").longitude, 1.5
+        )
+        self.assertIsNone(CodePostalLocation.objects.get(code="32120").longitude)
+        self.assertEqual(postal_code_location("32100"), {"lon": 1.0, "lat": 40})
+
+        self.assertEqual(fetch_postal_code_locations(), 0)
+        self.assertEqual(mock_get.call_count, 7)
+
+    @mock.patch("requests.Session.get")
+    def test_resume(self, mock_get):
+        throttled = MockResponse(
+            status_code=429, json={"reset_time": datetime.now(tz=UTC).isoformat()}
+        )
+        first_chunk = self.mock_api(
+            None,
+            {
+                "where": "code_postal=32100 or code_postal=32110",
+                "offset": 0,
+                "limit": 100,
+            },
+        )
+        mock_get.side_effect = [first_chunk, throttled]
+        with self.assertRaises(DatanovaThrottlingException):
+            fetch_postal_code_locations(chunk_size=2)
+        self.assertEqual(CodePostalLocation.objects.count(), 3)
+
+        cache.clear()
+        mock_get.side_effect = self.mock_api
+        self.assertEqual(fetch_postal_code_locations(chunk_size=2), 3)
+        self.assertEqual(CodePostalLocation.objects.count(), 7)
+        self.assertEqual(
+            mock_get.call_args_list[-2][1]["params"]["where"],
+            "code_postal=32120 or code_postal=32200",
+        )
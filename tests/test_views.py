@@ -0,0 +1,156 @@
+from datetime import datetime
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from pytz import UTC
+import requests
+
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
+from dj_codepostal_fr.signals import notify_dataset_changed
+from dj_codepostal_fr.views import area_view, async_area_view
+
+from .test_utils import MockResponse
+
+
+class TestAreaViewHttpCaching(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "32110"]]
+        )
+        CodePostalCompletions.store("321", ["32100", "32110"])
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def get(self, params, view=area_view, **headers):
+        request = self.factory.get("/codepostal/nearby/", params, headers=headers)
+        if view is async_area_view:
+            return async_to_sync(view)(request)
+        return view(request)
+
+    def test_etag(self):
+        response = self.get({"term": "321"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age=3600", response["Cache-Control"])
+        etag = response["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.get({"term": " 321 "})["ETag"], etag)
+        self.assertNotEqual(self.get({"term": "3211"})["ETag"], etag)
+        self.assertEqual(self.get({"term": "321"}, view=async_area_view)["ETag"], etag)
+
+        notify_dataset_changed()
+        self.assertNotEqual(self.get({"term": "321"})["ETag"], etag)
+
+    def test_postal_codes_order(self):
+        codes = ["32200", "32300", "32400", "32500", "32600", "32700", "32800"]
+        with mock.patch(
+            "dj_codepostal_fr.views.complete_and_suggest", return_value=[]
+        ) as mock_complete:
+            first = self.get({"postal_codes[]": ["32110", " 32100", "32110", ""]})
+            mock_complete.assert_called_with(["32110", "32100"], "", None, None)
+            second = self.get({"postal_codes[]": ["32110", "32100"]})
+            self.assertEqual(first["ETag"], second["ETag"])
+            # nearby suggestions of the last selected codes first
+            third = self.get({"postal_codes[]": ["32100", "32110"]})
+            mock_complete.assert_called_with(["32100", "32110"], "", None, None)
+            self.assertNotEqual(third["ETag"], first["ETag"])
+
+            # only the order of the last 5 codes matters
+            first = self.get({"postal_codes[]": codes})
+            second = self.get({"postal_codes[]": [codes[1], codes[0], *codes[2:]]})
+            self.assertEqual(first["ETag"], second["ETag"])
+
+    @mock.patch("requests.Session.get")
+    def test_etag_kept_by_cache_fills(self, mock_get):
+        mock_get.return_value = MockResponse(
+            200,
+            {
+                "total_count": 1,
+                "records": [
+                    {
+                        "record": {
+                            "fields": {
+                                "code_postal": "32100",
+                                "coordonnees_gps": {"lon": 0.39, "lat": 43.95},
+                            }
+                        }
+                    }
+                ],
+            },
+        )
+        etag = self.get({"term": "321"})["ETag"]
+        # the location of 32100 is fetched from the API, then its neighbors
+        self.get({"postal_codes[]": ["32100"]})
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(self.get({"term": "321"})["ETag"], etag)
+
+    @mock.patch("requests.Session.get")
+    def test_nearby_params(self, mock_get):
+        CodePostalLocation.objects.create(code_id="32100", longitude=0.39, latitude=43.95)
+        mock_get.return_value = MockResponse(200, {"records": []})
+        etag = self.get({"postal_codes[]": ["32100"]})["ETag"]
+        # the nearby codes of 32100
+        mock_get.assert_called_once()
+        with mock.patch(
+            "dj_codepostal_fr.views.complete_and_suggest", return_value=[]
+        ) as mock_complete:
+            response = self.get({"postal_codes[]": ["32100"], "dist": "20", "limit": "5"})
+            mock_complete.assert_called_with(["32100"], "", 20.0, 5)
+            self.assertNotEqual(response["ETag"], etag)
+
+            # out of bounds or invalid: the settings
+            response = self.get(
+                {"postal_codes[]": ["32100"], "dist": "1000", "limit": "x"}
+            )
+            mock_complete.assert_called_with(["32100"], "", None, None)
+            self.assertEqual(response["ETag"], etag)
+
+    def test_not_modified(self):
+        etag = self.get({"term": "321"})["ETag"]
+        for view, target in (
+            (area_view, "dj_codepostal_fr.views.complete_and_suggest"),
+            (async_area_view, "dj_codepostal_fr.views.acomplete_and_suggest"),
+        ):
+            with mock.patch(target) as mock_complete:
+                response = self.get({"term": "321"}, view=view, if_none_match=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+            mock_complete.assert_not_called()
+
+    @mock.patch("requests.Session.get")
+    def test_errors_not_stored(self, mock_get):
+        mock_get.return_value = MockResponse(
+            status_code=429, json={"reset_time": datetime.now(tz=UTC).isoformat()}
+        )
+        response = self.get({"term": "322"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-store", response["Cache-Control"])
+        self.assertFalse(response.has_header("ETag"))
+
+    @mock.patch("requests.Session.get")
+    def test_api_failure_not_stored(self, mock_get):
+        mock_get.side_effect = requests.ConnectionError()
+        for view in (area_view, async_area_view):
+            for fast_json in (False, True):
+                for params in (
+                    {"term": "322"},
+                    {"postal_codes[]": ["32100"]},
+                ):
+                    with self.subTest(view=view, fast_json=fast_json, **params):
+                        with override_settings(CODEPOSTAL_FAST_JSON=fast_json):
+                            response = self.get(params, view=view)
+                        self.assertEqual(response.status_code, 200)
+                        self.assertIn("Impossible d'obtenir", response.content.decode())
+                        self.assertNotIn("Aucun", response.content.decode())
+                        self.assertIn("no-store", response["Cache-Control"])
+                        self.assertFalse(response.has_header("ETag"))
@@ -0,0 +1,120 @@
+import io
+from unittest import mock
+
+from dj_codepostal_fr.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from dj_codepostal_fr import ratelimit
+from dj_codepostal_fr.models import (
+    CodePostal,
+    CodePostalCompletions,
+    CodePostalLocation,
+)
+from dj_codepostal_fr.utils import (
+    _completion_cache_key,
+    _location_cache_key,
+    postal_code_location,
+    postal_codes_completion,
+)
+from dj_codepostal_fr.warmup import _warm_cache_once, warm_cache
+
+from .test_utils import MockResponse
+
+
+class TestWarmCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        CodePostal.objects.bulk_create(
+            [CodePostal(code=code) for code in ["32100", "32110", "32200", "01400"]]
+        )
+        CodePostalCompletions.store("321", ["32100", "32110"])
+        CodePostalCompletions.store("322", ["32200"])
+        CodePostalLocation.objects.create(code_id="32100", longitude=0.4, latitude=43.9)
+        CodePostalLocation.objects.create(code_id="32200")
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def mock_api(self, url, params, **kwargs):
+        # priority of the calling thread
+        self.priorities.append(ratelimit._priority.get())
+        if params["where"].startswith("search"):
+            codes = ["01400", "01410"]
+        else:
+            codes = [clause.split("=")[1] for clause in params["where"].split(" or ")]
+        records = [
+            {
+                "record": {
+                    "fields": {
+                        "code_postal": code,
+                        "coordonnees_gps": {"lon": 4.9, "lat": 46.1},
+                    }
+                }
+            }
+            # 32110 is unknown to the API
+            for code in codes
+            if code != "32110"
+        ]
+        return MockResponse(200, {"total_count": len(records), "records": records})
+
+    @mock.patch("requests.Session.get")
+    def test_from_db(self, mock_get):
+        stats = warm_cache(batch_size=1, fetch=False)
+        self.assertEqual(stats["completions"], 2)
+        self.assertEqual(stats["locations"], 2)
+        self.assertEqual(stats["keys"], 4)
+        mock_get.assert_not_called()
+
+        self.assertCountEqual(
+            cache.get(_completion_cache_key("321")), ["32100", "32110"]
+        )
+        self.assertEqual(
+            cache.get(_location_cache_key("32100")), {"lon": 0.4, "lat": 43.9}
+        )
+        self.assertIs(cache.get(_location_cache_key("32200")), False)
+        self.assertIsNone(cache.get(_location_cache_key("32110")))
+
+    @mock.patch("requests.Session.get")
+    def test_fetch_missing(self, mock_get):
+        self.priorities = []
+        mock_get.side_effect = self.mock_api
+        stats = warm_cache(workers=2)
+        self.assertEqual(stats["fetched"], 3)
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(stats["keys"], 7)
+        # one completion query, one locations query
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(self.priorities, [ratelimit.BACKGROUND] * 2)
+
+        self.assertCountEqual(CodePostalCompletions.complete("014"), ["01400", "01410"])
+        self.assertAlmostEqual(
+            CodePostalLocation.objects.get(code="01400").longitude, 4.9
+        )
+        self.assertIsNone(CodePostalLocation.objects.get(code="32110").longitude)
+        with mock.patch("dj_codepostal_fr.utils._call") as mock_call:
+            self.assertEqual(postal_codes_completion("0141"), ["01410"])
+            self.assertIsNone(postal_code_location("32110"))
+            mock_call.assert_not_called()
+
+    @mock.patch("requests.Session.get")
+    def test_failed(self, mock_get):
+        # rate limit reached
+        with mock.patch("dj_codepostal_fr.ratelimit.acquire", return_value=False):
+            stats = warm_cache()
+        self.assertEqual(stats["failed"], 2)
+        self.assertEqual(stats["fetched"], 0)
+        mock_get.assert_not_called()
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command("warm_codepostal_cache", "--no-fetch", stdout=stdout)
+        self.assertIn("Wrote 4 keys", stdout.getvalue())
+
+    @mock.patch("dj_codepostal_fr.warmup.warm_cache")
+    def test_once(self, mock_warm_cache):
+        with mock.patch("dj_codepostal_fr.warmup.connection"):
+            _warm_cache_once()
+            _warm_cache_once()
+        mock_warm_cache.assert_called_once_with()